@@ -0,0 +1,17 @@
+"""
+Micro-benchmarks of the pure Python hot paths of ACIT.
+
+The benchmarks only use synthetic inputs, so they run offline, without the
+model, LIF files or ImageJ. Run them from the repository root with:
+
+    python -m benchmarks                       # run all, save the results
+    python -m benchmarks -k filter_boxes       # only matching benchmarks
+    python -m benchmarks --save-baseline       # make these the baseline
+    python -m benchmarks --baseline benchmarks/baseline.json
+
+Results are saved as JSON in benchmarks/results. When a baseline is given
+(or benchmarks/baseline.json exists), every benchmark is compared with it,
+and the exit code is 1 if any got slower by more than --threshold.
+Baselines are machine specific, so make one on the machine that runs the
+comparison.
+"""
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks.cases import BENCHMARKS
+from benchmarks.runner import compare, print_comparison, run_benchmarks, save_results
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_baseline = os.path.join(here, 'baseline.json')
+
+parser = argparse.ArgumentParser(description='Run the ACIT micro-benchmarks.')
+parser.add_argument('-k', dest='pattern', default='*',
+                    help='Only run the benchmarks matching this pattern')
+parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='Number of repeats per benchmark (default 5)')
+parser.add_argument('--output', '-o', default=None,
+                    help='Where to save the results, defaults to '
+                         'benchmarks/results/<date>-<time>.json')
+parser.add_argument('--baseline', default=None,
+                    help='Results to compare with, defaults to '
+                         'benchmarks/baseline.json if it exists')
+parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                    help='Also save the results as benchmarks/baseline.json')
+parser.add_argument('--threshold', type=float, default=0.2,
+                    help='Slow down counted as a regression (default 0.2 = 20%%)')
+args = parser.parse_args()
+
+if args.list:
+    for name, setup, kwargs in BENCHMARKS:
+        print(name)
+    sys.exit(0)
+
+results = run_benchmarks(BENCHMARKS, args.pattern, args.repeat)
+output = args.output or os.path.join(here, 'results',
+                                     time.strftime('%Y%m%d-%H%M%S') + '.json')
+save_results(results, output)
+print('Results saved to ' + output)
+
+baseline_path = args.baseline
+if baseline_path is None and os.path.exists(default_baseline) and not args.save_baseline:
+    baseline_path = default_baseline
+if args.save_baseline:
+    save_results(results, default_baseline)
+    print('Saved as baseline')
+
+if baseline_path:
+    with open(baseline_path) as f:
+        rows = compare(results, json.load(f), args.threshold)
+    print_comparison(rows, args.threshold)
+    if any(row[4] for row in rows):
+        sys.exit(1)
@@ -0,0 +1,111 @@
+"""
+The benchmarks. Each one is a function decorated with @benchmark, that does
+its set up and returns the function to time.
+"""
+import itertools
+import os
+import tempfile
+from xml.etree import ElementTree as ET
+
+import numpy as np
+
+from benchmarks import synthetic
+
+BENCHMARKS = []
+
+
+def benchmark(name, **params):
+    """
+    Registers a benchmark, once for every combination of the parameters.
+
+    Args:
+        name (str): Name of the benchmark
+        **params: Lists of values for each argument of the set up function
+
+    Examples:
+        >>> @benchmark('filter_boxes', n=[10, 100])
+        >>> def bench_filter_boxes(n):
+        >>>     boxes, scores = random_boxes(n)
+        >>>     return lambda: filter_boxes(boxes, scores, [], [])
+    """
+    def register(setup):
+        keys = sorted(params)
+        for values in itertools.product(*[params[key] for key in keys]):
+            kwargs = dict(zip(keys, values))
+            label = ','.join('%s=%s' % item for item in kwargs.items())
+            BENCHMARKS.append((name + ('[' + label + ']' if label else ''),
+                               setup, kwargs))
+        return setup
+    return register
+
+
+_tmpdir = tempfile.TemporaryDirectory(prefix='acit-bench-')
+
+
+def _trackmate_file(n_tracks, n_frames):
+    path = os.path.join(_tmpdir.name, 'tracks_%d_%d.trackmate.xml' % (n_tracks, n_frames))
+    if not os.path.exists(path):
+        synthetic.write_trackmate_xml(path, n_tracks, n_frames)
+    return path
+
+
+@benchmark('filter_boxes', boxes=[10, 50, 200])
+def bench_filter_boxes(boxes):
+    from cell_track.tools.box import filter_boxes
+    in_boxes, in_scores = synthetic.random_boxes(boxes)
+    return lambda: filter_boxes(in_boxes, in_scores, [], [])
+
+
+@benchmark('spot_features', boxes=[50, 200])
+def bench_spot_features(boxes):
+    from cell_track.tools.spot_features import box_features
+    in_boxes, _ = synthetic.random_boxes(boxes, duplicate_fraction=0)
+    frame = np.random.RandomState(0).randint(0, 256, (synthetic.HEIGHT, synthetic.WIDTH),
+                                             dtype=np.uint8)
+    return lambda: box_features(frame, in_boxes)
+
+
+@benchmark('trackmate_xml_write', frames=[30, 120])
+def bench_trackmate_xml_write(frames, spots=60):
+    from cell_track.tools.trackmate import trackmateXML
+    boxes, scores = synthetic.random_boxes(spots, duplicate_fraction=0)
+
+    def run():
+        tm_xml = trackmateXML()
+        tm_xml.filename = 'synthetic.tif'
+        tm_xml.imagepath = _tmpdir.name
+        for frame in range(frames):
+            tm_xml.frame = frame
+            tm_xml.nframes = frame + 1
+            tm_xml.add_frame_spots(boxes, scores)
+        tm_xml.write_xml()
+    return run
+
+
+@benchmark('track_parse', tracks=[20, 80])
+def bench_track_parse(tracks, frames=40):
+    from cell_track.tools.trackmate import Track
+    path = _trackmate_file(tracks, frames)
+
+    def run():
+        root = ET.parse(path).getroot()
+        return [Track(xml_track, root) for xml_track in root.findall('Model/AllTracks/Track')]
+    return run
+
+
+@benchmark('process_imagestack', tracks=[20, 80, 320])
+def bench_process_imagestack(tracks, frames=40):
+    from cell_track.tools.trackmate import process_imagestack
+    path = _trackmate_file(tracks, frames)
+    return lambda: process_imagestack(path)
+
+
+@benchmark('video_overlay', tracks=[20, 80])
+def bench_video_overlay(tracks, frames=40):
+    from cell_track.tools.trackmate import Track, draw_track_overlay
+    root = ET.parse(_trackmate_file(tracks, frames)).getroot()
+    all_tracks = [Track(xml_track, root) for xml_track in root.findall('Model/AllTracks/Track')]
+    filt_tracks = [track for track in all_tracks if track.include]
+    lines = [line for track in filt_tracks for line in track.lines]
+    page = np.zeros((synthetic.HEIGHT, synthetic.WIDTH, 3), dtype=np.uint8)
+    return lambda: draw_track_overlay(page, frames // 2, filt_tracks, lines)
@@ -0,0 +1,122 @@
+"""
+Running the benchmarks, saving the results and comparing them with a baseline.
+"""
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+
+def time_function(func, repeat=5):
+    """
+    Times a function like timeit does: the function is called often enough
+    to take at least 0.2 seconds, and this is repeated.
+
+    Returns:
+        dict: Seconds per call, 'best' and 'median' of the repeats, and the
+            'number' of calls per repeat
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {'best': min(times), 'median': statistics.median(times),
+            'number': number, 'repeat': repeat}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run_benchmarks(benchmarks, pattern='*', repeat=5):
+    """
+    Runs the benchmarks whose name matches pattern.
+
+    Args:
+        benchmarks (list): (name, setup, kwargs) as in cases.BENCHMARKS
+        pattern (str): fnmatch pattern, a plain word matches any name containing it
+        repeat (int): Number of repeats per benchmark
+
+    Returns:
+        dict: 'meta' about the machine and version, and 'results' with the
+            timings of each benchmark by name
+    """
+    if not any(char in pattern for char in '*?['):
+        pattern = '*' + pattern + '*'
+    results = {}
+    for name, setup, kwargs in benchmarks:
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        results[name] = time_function(setup(**kwargs), repeat=repeat)
+        print('%-40s %12s' % (name, format_time(results[name]['best'])))
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': _git_commit(),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.node(), 'argv': sys.argv[1:]}
+    return {'meta': meta, 'results': results}
+
+
+def format_time(seconds):
+    """Seconds as a short string with a sensible unit."""
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3g %s' % (seconds / scale, unit)
+    return '%.3g ns' % (seconds / 1e-9)
+
+
+def save_results(results, path):
+    """Writes results as JSON, creating the folder."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compares the best times with a baseline.
+
+    Args:
+        results (dict): As returned by run_benchmarks()
+        baseline (dict): Results of an earlier run
+        threshold (float): Relative slow down counted as a regression
+
+    Returns:
+        list: (name, baseline seconds, seconds, relative change, regressed)
+            for each benchmark in both
+    """
+    rows = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best']
+        after = result['best']
+        change = after / before - 1 if before > 0 else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    """Prints the rows of compare() as a table."""
+    if not rows:
+        print('No benchmarks in common with the baseline')
+        return
+    print('\n%-40s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'change'))
+    for name, before, after, change, regressed in rows:
+        print('%-40s %12s %12s %+7.1f%%%s' % (name, format_time(before), format_time(after),
+                                              change * 100,
+                                              '  REGRESSION' if regressed else ''))
+    regressions = sum(row[4] for row in rows)
+    if regressions:
+        print('\n%d benchmark(s) more than %d%% slower than the baseline'
+              % (regressions, threshold * 100))
@@ -0,0 +1,128 @@
+"""
+Synthetic inputs for the benchmarks.
+"""
+import math
+import random
+from xml.etree import ElementTree as ET
+
+WIDTH = 1392
+HEIGHT = 1040
+
+
+def random_boxes(n, seed=0, duplicate_fraction=0.3, width=WIDTH, height=HEIGHT):
+    """
+    Random detections like the network produces: boxes of cell size, a part
+    of which has near-duplicates that filter_boxes has to resolve.
+
+    Args:
+        n (int): Number of boxes
+        seed (int): Random seed
+        duplicate_fraction (float): Fraction of boxes that are a shifted
+            copy of an earlier box
+        width (int): Image width
+        height (int): Image height
+
+    Returns:
+        Two lists: boxes as [x1, y1, x2, y2], and scores
+    """
+    rng = random.Random(seed)
+    boxes, scores = [], []
+    for i in range(n):
+        if boxes and rng.random() < duplicate_fraction:
+            x1, y1, x2, y2 = rng.choice(boxes)
+            dx, dy = rng.uniform(-8, 8), rng.uniform(-8, 8)
+            box = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+        else:
+            size = rng.uniform(20, 60)
+            x1, y1 = rng.uniform(0, width - size), rng.uniform(0, height - size)
+            box = [x1, y1, x1 + size, y1 + size * rng.uniform(0.7, 1.3)]
+        boxes.append(box)
+        scores.append(rng.uniform(0.2, 1.0))
+    return boxes, scores
+
+
+def random_walks(n_tracks, n_frames, seed=0, step=4.0, width=WIDTH, height=HEIGHT):
+    """
+    Random walk tracks of cells.
+
+    Returns:
+        list: For every track a list of (x, y) positions, one per frame
+    """
+    rng = random.Random(seed)
+    walks = []
+    for track in range(n_tracks):
+        x, y = rng.uniform(50, width - 50), rng.uniform(50, height - 50)
+        walk = []
+        for frame in range(n_frames):
+            x = min(max(x + rng.gauss(0, step), 0), width - 1)
+            y = min(max(y + rng.gauss(0, step), 0), height - 1)
+            walk.append((x, y))
+        walks.append(walk)
+    return walks
+
+
+def write_trackmate_xml(path, n_tracks, n_frames, seed=0, pixelwidth=1.843,
+                        timeinterval=300.0):
+    """
+    Writes a .trackmate.xml file like the ones TrackMate makes, with one
+    track per random walk and every second track passing the filters.
+
+    Only the elements and features read by trackmate.Track and
+    process_imagestack() are written.
+
+    Args:
+        path (str): The file to write
+        n_tracks (int): Number of tracks
+        n_frames (int): Number of frames, every track spans all of them
+        seed (int): Random seed
+        pixelwidth (float): Microns per pixel, written to ImageData
+        timeinterval (float): Seconds per frame, written to ImageData
+    """
+    walks = random_walks(n_tracks, n_frames, seed)
+    root = ET.Element('TrackMate', version='3.8.0')
+    model = ET.SubElement(root, 'Model', spatialunits='micron', timeunits='sec')
+    all_spots = ET.SubElement(model, 'AllSpots', nspots=str(n_tracks * n_frames))
+    all_tracks = ET.SubElement(model, 'AllTracks')
+    filtered = ET.SubElement(model, 'FilteredTracks')
+
+    frames = [ET.SubElement(all_spots, 'SpotsInFrame', frame=str(frame))
+              for frame in range(n_frames)]
+    spot_id = 0
+    for track_id, walk in enumerate(walks):
+        ids = []
+        for frame, (x, y) in enumerate(walk):
+            ET.SubElement(frames[frame], 'Spot', ID=str(spot_id), name='ID' + str(spot_id),
+                          QUALITY='0.9', POSITION_X='%.3f' % (x * pixelwidth),
+                          POSITION_Y='%.3f' % (y * pixelwidth),
+                          POSITION_T=str(frame * timeinterval), FRAME=str(frame))
+            ids.append(spot_id)
+            spot_id += 1
+        steps = [math.hypot(x2 - x1, y2 - y1) * pixelwidth
+                 for (x1, y1), (x2, y2) in zip(walk[:-1], walk[1:])]
+        total = sum(steps)
+        displacement = math.hypot(walk[-1][0] - walk[0][0],
+                                  walk[-1][1] - walk[0][1]) * pixelwidth
+        speeds = sorted(step / timeinterval for step in steps) or [0.0]
+        track = ET.SubElement(
+            all_tracks, 'Track', name='Track_' + str(track_id), TRACK_ID=str(track_id),
+            TRACK_INDEX=str(track_id), NUMBER_SPOTS=str(n_frames), NUMBER_GAPS='0',
+            NUMBER_SPLITS='0', TRACK_DISPLACEMENT=repr(displacement),
+            TRACK_MEAN_SPEED=repr(sum(speeds) / len(speeds)),
+            TRACK_MEDIAN_SPEED=repr(speeds[len(speeds) // 2]),
+            TOTAL_DISTANCE_TRAVELED=repr(total), MAX_DISTANCE_TRAVELED=repr(displacement),
+            CONFINMENT_RATIO=repr(displacement / total if total else 0.0),
+            TRACK_X_LOCATION=repr(sum(x for x, y in walk) / n_frames),
+            TRACK_Y_LOCATION=repr(sum(y for x, y in walk) / n_frames))
+        for source, target in zip(ids[:-1], ids[1:]):
+            ET.SubElement(track, 'Edge', SPOT_SOURCE_ID=str(source),
+                          SPOT_TARGET_ID=str(target))
+        if track_id % 2 == 0:
+            ET.SubElement(filtered, 'TrackID', TRACK_ID=str(track_id))
+
+    settings = ET.SubElement(root, 'Settings')
+    ET.SubElement(settings, 'ImageData', filename='synthetic.tif', folder='./',
+                  width=str(WIDTH), height=str(HEIGHT), nslices='1',
+                  nframes=str(n_frames), pixelwidth=str(pixelwidth),
+                  pixelheight=str(pixelwidth), voxeldepth='1.0',
+                  timeinterval=str(timeinterval))
+    ET.ElementTree(root).write(path, encoding='UTF-8', xml_declaration=True)
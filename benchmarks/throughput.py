@@ -0,0 +1,163 @@
+"""
+End-to-end throughput of the pipeline on a synthetic time-lapse.
+
+Generates TIFF stacks of moving cells (see timelapse.make_timelapse), and
+runs them through detection with the stub model, tracking, the CSV files and
+the videos, reporting frames per second and peak memory per stage:
+
+    python -m benchmarks.throughput --series 8 --frames 60 --cells 100
+
+--max-memory runs the stages in their memory-bounded variants, as the
+option of the same name of python -m cell_track does.
+
+Tracking uses the Python linker (cell_track.tools.linking), or Fiji with
+--imagej. The video stage needs sk-video and ffmpeg and is skipped without.
+The detection recall against the ground truth checks that the stages did
+real work.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree as ET
+
+import numpy as np
+
+from benchmarks.runner import save_results
+from benchmarks.timelapse import StubModel, make_timelapse
+
+
+def detection_recall(truth, max_distance=8.0):
+    """
+    Fraction of the ground truth cells that have a tracked spot within
+    max_distance pixels, over all stacks and frames.
+    """
+    found = total = 0
+    for stack_path, positions in truth.items():
+        root = ET.parse(stack_path + '.trackmate.xml').getroot()
+        for spots_in_frame in root.findall('Model/AllSpots/SpotsInFrame'):
+            frame = int(spots_in_frame.get('frame'))
+            spots = np.array([(float(spot.get('POSITION_X')), float(spot.get('POSITION_Y')))
+                              for spot in spots_in_frame.findall('Spot')]).reshape(-1, 2)
+            cells = positions[:, frame]
+            total += len(cells)
+            if len(spots):
+                distances = np.hypot(cells[:, np.newaxis, 0] - spots[np.newaxis, :, 0],
+                                     cells[:, np.newaxis, 1] - spots[np.newaxis, :, 1])
+                found += int((distances.min(axis=1) <= max_distance).sum())
+    return found / total if total else 0.0
+
+
+def run_imagej(imagej, folder):
+    """Tracks with the TrackMate script in Fiji, as python -m cell_track does."""
+    import cell_track
+    script = os.path.join(os.path.dirname(cell_track.__file__), 'ImageJ',
+                          'TrackmateHeadlessPy.py')
+    subprocess.run([imagej, '--headless', script, folder], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end throughput on synthetic data.')
+    parser.add_argument('--series', type=int, default=4, help='Number of stacks (default 4)')
+    parser.add_argument('--frames', type=int, default=40, help='Frames per stack (default 40)')
+    parser.add_argument('--cells', type=int, default=50, help='Cells per stack (default 50)')
+    parser.add_argument('--radius', type=float, default=12, help='Cell radius in px (default 12)')
+    parser.add_argument('--speed', type=float, default=4, help='Cell speed in px/frame (default 4)')
+    parser.add_argument('--inference_time', type=float, default=0.0,
+                        help='Seconds the stub model sleeps per frame, to '
+                             'simulate the network (default 0)')
+    parser.add_argument('--folder', default=None,
+                        help='Where to write the data, kept afterwards. '
+                             'Defaults to a temporary folder.')
+    parser.add_argument('--imagej', default=None,
+                        help='ImageJ executable, to track with TrackMate '
+                             'instead of the Python linker')
+    parser.add_argument('--no-video', dest='no_video', action='store_true',
+                        help='Skip the video stage')
+    parser.add_argument('--max-memory', dest='max_memory', default=None,
+                        help='Memory budget, e.g. 2G, see the --max-memory '
+                             'option of python -m cell_track')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Where to save the results, defaults to '
+                             'benchmarks/results/throughput-<date>-<time>.json')
+    args = parser.parse_args()
+
+    from cell_track.tools.metrics import METRICS
+    from cell_track.tools.memory import MemoryBudget
+    from cell_track.tools.track_image import track_tiff_folder
+    from cell_track.tools.trackmate import drawTrackmateVideo, process_xml_folder
+    from cell_track.tools.linking import link_folder
+
+    root = args.folder or tempfile.mkdtemp(prefix='acit-throughput-')
+    print('Generating %d stacks of %d frames with %d cells in %s'
+          % (args.series, args.frames, args.cells, root))
+    truth = make_timelapse(root, args.series, args.frames, args.cells,
+                           args.radius, args.speed)
+    group_folder = os.path.dirname(next(iter(truth)))
+    n_frames = args.series * args.frames
+
+    stages = {}
+    budget = MemoryBudget(args.max_memory) if args.max_memory else None
+
+    def stage(name, func):
+        start = time.perf_counter()
+        with METRICS.memory(name):
+            func()
+        seconds = time.perf_counter() - start
+        stages[name] = {'seconds': seconds, 'frames_per_second': n_frames / seconds,
+                        'peak_rss_mb': METRICS.memory_stats[name]['rss_peak_mb']}
+
+    METRICS.reset()
+    model = StubModel(radius=args.radius, inference_time=args.inference_time)
+    stage('detect', lambda: track_tiff_folder(group_folder, model,
+                                              low_memory=budget is not None))
+    if args.imagej:
+        stage('track', lambda: run_imagej(args.imagej, root))
+    else:
+        stage('track', lambda: link_folder(root))
+    stage('csv', lambda: process_xml_folder(group_folder))
+    try:
+        import skvideo.io  # noqa: F401
+        has_video = True
+    except ImportError:
+        has_video = False
+        print('sk-video is not installed, skipping the video stage')
+    if has_video and not args.no_video:
+        csv_path = os.path.join(group_folder, 'alldata.csv')
+        stage('video', lambda: [drawTrackmateVideo(path, csv_path, budget=budget)
+                                for path in truth])
+
+    tracks = [len(ET.parse(path + '.trackmate.xml').getroot().findall(
+        'Model/FilteredTracks/TrackID')) for path in truth]
+    results = {
+        'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'argv': sys.argv[1:],
+                 'tracker': 'imagej' if args.imagej else 'python'},
+        'stages': stages,
+        'detection_recall': detection_recall(truth),
+        'filtered_tracks_per_stack': sum(tracks) / len(tracks),
+        'metrics': METRICS.summary(),
+    }
+
+    print('\n%-8s %10s %10s %14s' % ('stage', 'seconds', 'frames/s', 'peak RSS MB'))
+    for name, result in stages.items():
+        print('%-8s %10.2f %10.1f %14.1f' % (name, result['seconds'],
+                                             result['frames_per_second'],
+                                             result['peak_rss_mb']))
+    print('\nDetection recall: %.3f, filtered tracks per stack: %.1f (%d cells)'
+          % (results['detection_recall'], results['filtered_tracks_per_stack'], args.cells))
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = args.output or os.path.join(
+        here, 'results', 'throughput-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    save_results(results, output)
+    print('Results saved to ' + output)
+    if args.folder is None:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Synthetic phase contrast-like time-lapses with known cell trajectories, and a
+stub model that finds the cells in them, for throughput benchmarks without
+tensorflow.
+"""
+import csv
+import math
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import HEIGHT, WIDTH
+
+
+def cell_trajectories(n_cells, n_frames, seed=0, speed=4.0, persistence=0.8,
+                      width=WIDTH, height=HEIGHT, margin=20):
+    """
+    Persistent random walks that bounce off the image borders.
+
+    Args:
+        n_cells (int): Number of cells
+        n_frames (int): Number of frames
+        seed (int): Random seed
+        speed (float): Mean step in pixels per frame
+        persistence (float): 0 for a random direction every frame, close to 1
+            for nearly straight paths
+        width (int): Image width
+        height (int): Image height
+        margin (int): Distance the cells keep from the borders
+
+    Returns:
+        numpy.ndarray: (n_cells, n_frames, 2) x, y positions
+    """
+    rng = random.Random(seed)
+    positions = np.zeros((n_cells, n_frames, 2))
+    for cell in range(n_cells):
+        x = rng.uniform(margin, width - margin)
+        y = rng.uniform(margin, height - margin)
+        angle = rng.uniform(0, 2 * math.pi)
+        for frame in range(n_frames):
+            positions[cell, frame] = x, y
+            angle = persistence * angle + (1 - persistence) * rng.uniform(0, 2 * math.pi) \
+                + rng.gauss(0, 0.3)
+            step = abs(rng.gauss(speed, speed / 3))
+            x, y = x + step * math.cos(angle), y + step * math.sin(angle)
+            if not margin <= x <= width - margin:
+                angle = math.pi - angle
+                x = min(max(x, margin), width - margin)
+            if not margin <= y <= height - margin:
+                angle = -angle
+                y = min(max(y, margin), height - margin)
+    return positions
+
+
+def render_frame(positions, radius=12, seed=0, width=WIDTH, height=HEIGHT):
+    """
+    Draws cells as bright blobs with a dark halo on a noisy background.
+
+    Args:
+        positions (numpy.ndarray): (n, 2) x, y centers of the cells
+        radius (float): Cell radius in pixels
+
+    Returns:
+        numpy.ndarray: (height, width) uint8 frame
+    """
+    rng = np.random.RandomState(seed)
+    frame = np.full((height, width), 110.0, dtype=np.float32)
+    frame += rng.normal(0, 6, (height, width)).astype(np.float32)
+    size = int(3 * radius)
+    yy, xx = np.mgrid[-size:size + 1, -size:size + 1]
+    for x, y in positions:
+        cx, cy = int(round(x)), int(round(y))
+        r2 = (xx + cx - x) ** 2 + (yy + cy - y) ** 2
+        blob = 90 * np.exp(-r2 / (2 * (radius / 1.5) ** 2)) \
+            - 30 * np.exp(-r2 / (2 * (radius * 1.3) ** 2))
+        y1, y2 = max(cy - size, 0), min(cy + size + 1, height)
+        x1, x2 = max(cx - size, 0), min(cx + size + 1, width)
+        frame[y1:y2, x1:x2] += blob[y1 - cy + size:y2 - cy + size,
+                                    x1 - cx + size:x2 - cx + size]
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def make_timelapse(folder, n_series=4, n_frames=40, n_cells=50, radius=12,
+                   speed=4.0, seed=0, group='Synthetic'):
+    """
+    Writes a folder of synthetic time-lapse TIFF stacks, one per series, and
+    their ground truth.
+
+    The stacks are written to folder/group/Well<n>-Pos001.tif, the layout
+    python -m cell_track produces from a LIF file. The ground truth is
+    written to folder/group/ground_truth.csv with the columns series, cell,
+    frame, x and y.
+
+    Args:
+        folder (str): The output folder
+        n_series (int): Number of stacks
+        n_frames (int): Frames per stack
+        n_cells (int): Cells per stack
+        radius (float): Cell radius in pixels
+        speed (float): Mean speed in pixels per frame
+        seed (int): Random seed
+        group (str): Name of the subfolder
+
+    Returns:
+        dict: stack path: (n_cells, n_frames, 2) ground truth positions
+    """
+    out_folder = os.path.join(folder, group)
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    truth = {}
+    with open(os.path.join(out_folder, 'ground_truth.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['series', 'cell', 'frame', 'x', 'y'])
+        for series in range(n_series):
+            name = 'Well%d-Pos001.tif' % (series + 1)
+            positions = cell_trajectories(n_cells, n_frames, seed=seed + series, speed=speed)
+            pages = [Image.fromarray(render_frame(positions[:, frame], radius,
+                                                  seed=seed * 1000 + series * 100 + frame))
+                     for frame in range(n_frames)]
+            path = os.path.join(out_folder, name)
+            pages[0].save(path, format='tiff', save_all=True, append_images=pages[1:])
+            truth[path] = positions
+            for cell in range(n_cells):
+                for frame in range(n_frames):
+                    writer.writerow([name, cell, frame] +
+                                    ['%.2f' % value for value in positions[cell, frame]])
+    return truth
+
+
+class StubModel:
+    """
+    Stand-in for the RetinaNet model, with the same predict_on_batch()
+    contract, that finds the bright blobs of make_timelapse() frames.
+
+    Every found cell gets a box of the cell size with a little jitter, and a
+    few get a second, overlapping box with a lower score, like the network
+    gives, so filter_boxes has work to do. The output is padded to max_detections
+    with score -1, as the network does.
+
+    Args:
+        radius (float): Cell radius in pixels, as in make_timelapse()
+        threshold (float): Brightness above the background of a cell center
+        inference_time (float): Seconds to sleep per call, to simulate the cost
+            of the network
+        max_detections (int): Size of the padded output
+        seed (int): Random seed of the jitter
+    """
+    def __init__(self, radius=12, threshold=45, inference_time=0.0,
+                 max_detections=300, seed=0):
+        self.radius = radius
+        self.threshold = threshold
+        self.inference_time = inference_time
+        self.max_detections = max_detections
+        self._rng = np.random.RandomState(seed)
+
+    def predict_on_batch(self, batch):
+        """
+        Args:
+            batch (numpy.ndarray): (n, y, x, 3) preprocessed frames
+
+        Returns:
+            (boxes, scores, labels): (n, max_detections, 4), (n, max_detections)
+                and (n, max_detections) arrays, boxes in batch coordinates
+        """
+        import cv2
+        if self.inference_time:
+            time.sleep(self.inference_time)
+        n = len(batch)
+        boxes = np.full((n, self.max_detections, 4), -1, dtype=np.float32)
+        scores = np.full((n, self.max_detections), -1, dtype=np.float32)
+        labels = np.full((n, self.max_detections), -1, dtype=np.int32)
+        scale = batch.shape[1] / HEIGHT
+        for index, image in enumerate(batch):
+            gray = image[:, :, 0] - image[:, :, 0].mean()  # the means are removed
+            gray = cv2.GaussianBlur(gray, (0, 0), 2)
+            peaks = (gray == cv2.dilate(gray, np.ones((7, 7), np.uint8))) & \
+                (gray > self.threshold)
+            ys, xs = np.nonzero(peaks)
+            found = []
+            size = self.radius * scale
+            for x, y in zip(xs, ys):
+                jitter = self._rng.normal(0, 0.1 * size, 4)
+                score = min(0.99, 0.5 + gray[y, x] / 200)
+                found.append(([x - size, y - size, x + size, y + size] + jitter, score))
+                if self._rng.rand() < 0.2:
+                    shift = self._rng.normal(0, 0.3 * size, 2)
+                    found.append(([x - size + shift[0], y - size + shift[1],
+                                   x + size + shift[0], y + size + shift[1]], score * 0.6))
+            found.sort(key=lambda item: -item[1])
+            for i, (box, score) in enumerate(found[:self.max_detections]):
+                boxes[index, i] = box
+                scores[index, i] = score
+                labels[index, i] = 0
+        return boxes, scores, labels
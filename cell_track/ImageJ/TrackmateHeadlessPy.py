@@ -144,6 +144,9 @@ def magic(file):
     # Configure track filters - We want to get rid of the two immobile spots at
     # the bottom right of the image. Track displacement must be above 10 pixels.
 
+    # Keep in line with TRACK_FILTERS in cell_track/tools/linking.py. Other
+    # filters can be applied afterwards with utilities/refilter_tracks.py,
+    # without tracking again.
     filter2 = FeatureFilter('NUMBER_SPOTS', 31, True)
     settings.addTrackFilter(filter2)
     #filter3 = FeatureFilter('NUMBER_GAPS', 2, False)
@@ -195,10 +198,16 @@ def magic(file):
     trackmate.execTrackFiltering(True)
     trackmate.computeEdgeFeatures(True)
 
-    outfile = TmXmlWriter(File(str(file[:-4] + ".trackmate.xml")))
+    # Write to a temporary file first, a half-written .trackmate.xml must
+    # never look like a finished one.
+    outpath = str(file[:-4] + ".trackmate.xml")
+    outfile = TmXmlWriter(File(outpath + ".tmp"))
     outfile.appendSettings(settings)
     outfile.appendModel(model)
     outfile.writeToFile()
+    if os.path.exists(outpath):
+        os.remove(outpath)
+    os.rename(outpath + ".tmp", outpath)
 
     ISBIChallengeExporter.exportToFile(model, settings, File(str(file[:-4] + ".ISBI.xml")))
 
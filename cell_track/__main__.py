@@ -40,6 +40,92 @@ def get_args():
                              'compiles csv results from xml. Requires ffmpeg. '
                              '--track is required',
                         action="store_true")
+    parser.add_argument('--zarr',
+                        help='Write each image series as a chunked Zarr '
+                             'store (one chunk per frame) instead of an '
+                             'LZW compressed TIFF stack. Requires zarr.',
+                        action="store_true")
+    parser.add_argument('--no-tiff-export',
+                        help='Do not write image stacks at all. '
+                             '--make_video reads the frames directly from '
+                             'the LIF files, which must stay in place.',
+                        dest='no_tiff_export',
+                        action="store_true")
+    parser.add_argument('--no-manifest',
+                        help='Do not record the stages in the run manifest '
+                             '(acit_manifest.sqlite in the output folder). '
+                             'Finished series are then only recognised by '
+                             'their XML files.',
+                        dest='no_manifest',
+                        action="store_true")
+    parser.add_argument('--watch',
+                        help='Keep running, and process every LIF file that '
+                             'appears in --lif_folder once it is completely '
+                             'written. The model stays loaded between files.',
+                        action="store_true")
+    parser.add_argument('--settle_time', type=float, default=60.0,
+                        help='With --watch: seconds a LIF file must stay '
+                             'unchanged before it is processed (default 60)')
+    parser.add_argument('--poll_interval', type=float, default=10.0,
+                        help='With --watch: seconds between two scans of '
+                             '--lif_folder (default 10)')
+    parser.add_argument('--queue',
+                        help='Work queue folder on a filesystem shared by '
+                             'several machines. Each machine run with the '
+                             'same --queue, --lif_folder and --out_folder '
+                             'detects the series it claims from the queue, '
+                             'until all are done. Run --track, --make_csv '
+                             'and --make_video afterwards without --queue.',
+                        default=None)
+    parser.add_argument('--lease_time', type=float, default=600.0,
+                        help='With --queue: seconds without heartbeat after '
+                             'which the series claimed by a machine are '
+                             'given to another (default 600)')
+    parser.add_argument('--metrics_textfile',
+                        help='Also write the metrics of each run to this '
+                             'file in the Prometheus text format, e.g. in '
+                             'the textfile collector folder of node_exporter',
+                        default=None)
+    parser.add_argument('--profile',
+                        help='Profile every stage, and write cProfile dumps, '
+                             'flame graph stacks and the tensorflow timeline '
+                             'to acit_profile in the output folder',
+                        action="store_true")
+    parser.add_argument('--no-server',
+                        help='Always load the model in this process, even '
+                             'if an inference server with the same model '
+                             'is running.',
+                        dest='no_server',
+                        action="store_true")
+    parser.add_argument('--max-memory',
+                        help='Keep the memory of the pipeline under this '
+                             'size, e.g. 8G. Image stacks and XML files are '
+                             'then written as they are made, and fewer '
+                             'frames are decoded ahead.',
+                        dest='max_memory',
+                        default=None)
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='Number of frames sent to the model at once, '
+                             'defaults to the tuning profile (see tune), or 1')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes detecting series side by '
+                             'side, each with its own copy of the model. '
+                             'Defaults to the tuning profile, or 1.')
+    parser.add_argument('--pin',
+                        help='Run every detection worker on its own cores, '
+                             'of a single NUMA node where there are several, '
+                             'with as many tensorflow threads as cores. '
+                             'Without --workers, one worker per NUMA node.',
+                        action="store_true")
+    parser.add_argument('--catalog',
+                        help='With --make_csv: also add the tracks and spots '
+                             'to this SQLite catalog, which can collect '
+                             'many experiments (see query_catalog.py)',
+                        default=None)
+    parser.add_argument('--trace_memory',
+                        help='Also record the Python allocations of every '
+                             'stage with tracemalloc, slows the run down',
+                        action="store_true")
     required = parser.add_argument_group('Required')
     required.add_argument('--lif_folder', '-l',
                           help='The tiff folder to process',
@@ -55,6 +141,99 @@ def get_args():
     return parser.parse_args()
 
 
+def get_tune_args(argv):
+    """Setup the command line arguments of the tune command."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m cell_track tune',
+                                     description='Find the fastest inference settings '
+                                                 'for this machine, later runs use them.')
+    parser.add_argument('--gpu',
+                        help='Id of the GPU to use '
+                             '(as reported by nvidia-smi).')
+    parser.add_argument('--model', '-m', help='Path of the model, defaults to the '
+                                              'model included with the module',
+                        default=model_path)
+    parser.add_argument('--frames', type=int, default=32,
+                        help='Number of frames to run per setting')
+    parser.add_argument('--intra', help='Intra-op thread counts to try, e.g. 4,8,16')
+    parser.add_argument('--inter', help='Inter-op thread counts to try, e.g. 1,2')
+    parser.add_argument('--batch', help='Batch sizes to try, e.g. 1,2,4')
+    parser.add_argument('--workers', help='Numbers of worker processes to try, e.g. 1,2')
+    parser.add_argument('--pin', help='Pin the workers to their own cores, as '
+                                      'python -m cell_track --pin does',
+                        action="store_true")
+    required = parser.add_argument_group('Required')
+    required.add_argument('--stack', '-s',
+                          help='A TIFF stack or Zarr store to run the model on',
+                          required=True)
+    return parser.parse_args(argv)
+
+
+def get_sweep_args(argv):
+    """Setup the command line arguments of the sweep command."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m cell_track sweep',
+                                     description='Try filtering and tracking settings on the '
+                                                 'logged detections of a run, without '
+                                                 'running the model again.')
+    parser.add_argument('--score', help='Score thresholds to try, e.g. 0.1,0.2,0.3')
+    parser.add_argument('--center', help='Center distances of the box filter to try, '
+                                         'in pixels, e.g. 10,20,30')
+    parser.add_argument('--linking', help='Linking max distances to try, in pixels, '
+                                          'e.g. 20,40,60')
+    parser.add_argument('--gap_closing', help='Gap closing max distances to try, in pixels')
+    parser.add_argument('--max_gap', help='Max frame gaps to try, e.g. 2,4')
+    parser.add_argument('--filters', help='Track filters, as for '
+                                          'utilities/refilter_tracks.py, e.g. '
+                                          'NUMBER_SPOTS>31,NUMBER_SPLITS<0.5 (the default)')
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes, defaults to the number of cores')
+    parser.add_argument('--out', '-o', help='CSV file of the results, defaults to '
+                                            'acit_sweep.csv in the folder')
+    required = parser.add_argument_group('Required')
+    required.add_argument('--folder', '-f',
+                          help='Output folder of a run, searched for .detections.jsonl '
+                               'files in all subfolders',
+                          required=True)
+    return parser.parse_args(argv)
+
+
+if sys.argv[1:2] == ['sweep']:
+    from cell_track.tools.linking import TRACK_FILTERS
+    from cell_track.tools.sweep import default_grid, find_logs, sweep
+    from cell_track.tools.trackmate import parse_track_filters
+    args = get_sweep_args(sys.argv[2:])
+    grid = default_grid()
+    for key, values, kind in (('score_threshold', args.score, float),
+                              ('center_distance', args.center, float),
+                              ('linking_max_distance', args.linking, float),
+                              ('gap_closing_max_distance', args.gap_closing, float),
+                              ('max_frame_gap', args.max_gap, int)):
+        if values:
+            grid[key] = [kind(value) for value in values.split(',')]
+    logs = find_logs(args.folder)
+    print('Sweeping over ' + str(len(logs)) + ' detection logs')
+    filters = parse_track_filters(args.filters) if args.filters else TRACK_FILTERS
+    results = sweep(logs, grid, args.workers, filters)
+    out_path = args.out or os.path.join(args.folder, 'acit_sweep.csv')
+    results.to_csv(out_path, index=False)
+    print(results.to_string(index=False))
+    print('Saved ' + out_path)
+    sys.exit(0)
+
+if sys.argv[1:2] == ['tune']:
+    from cell_track.tools.tuning import default_grid, tune
+    args = get_tune_args(sys.argv[2:])
+    if args.gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
+    grid = default_grid()
+    for key, values in (('intra_op_threads', args.intra), ('inter_op_threads', args.inter),
+                        ('batch_size', args.batch), ('workers', args.workers)):
+        if values:
+            grid[key] = [int(value) for value in values.split(',')]
+    tune(args.model, args.stack, grid, args.frames, pin=args.pin)
+    sys.exit(0)
+
 if len(sys.argv) < 2:
     import PySimpleGUI as sg
     layout = [
@@ -62,6 +241,7 @@ if len(sys.argv) < 2:
         [sg.Checkbox('Track cells with trackmate', default=True, key="track"), ],
         [sg.Checkbox('Make csv files for all wells', default=True, key="csv"), ],
         [sg.Checkbox('Make mp4 videos with tracking data', default=True, key="video"), ],
+        [sg.Checkbox('Save image series as Zarr stores instead of TIFF', default=False, key="zarr"), ],
         [sg.Text('Model:'), sg.InputText(model_path, key="model"), sg.FileBrowse()],
         [sg.Text('LIF folder:'), sg.InputText('Folder containing LIF files', key="lif"), sg.FolderBrowse()],
         [sg.Text('Output folder:'), sg.InputText('Output folder', key='output'), sg.FolderBrowse()],
@@ -75,6 +255,20 @@ if len(sys.argv) < 2:
     enable_track = gui_val['track']
     make_csv = gui_val['csv']
     make_video = gui_val['video']
+    use_zarr = gui_val['zarr']
+    no_tiff_export = False
+    no_manifest = False
+    watch = False
+    no_server = False
+    queue_folder = None
+    metrics_textfile = None
+    profile = False
+    max_memory = None
+    trace_memory = False
+    batch_size = None
+    workers = None
+    pin = False
+    catalog_path = None
     model_path = gui_val['model']
     lif_folder = gui_val['lif']
     out_folder = gui_val['output']
@@ -88,21 +282,43 @@ else:
     enable_track = args.track
     make_csv = args.make_csv
     make_video = args.make_video
+    use_zarr = args.zarr
+    no_tiff_export = args.no_tiff_export
+    no_manifest = args.no_manifest
+    watch = args.watch
+    no_server = args.no_server
+    queue_folder = args.queue
+    metrics_textfile = args.metrics_textfile
+    profile = args.profile
+    max_memory = args.max_memory
+    trace_memory = args.trace_memory
+    batch_size = args.batch_size
+    workers = args.workers
+    pin = args.pin
+    catalog_path = args.catalog
+    lease_time = args.lease_time
+    settle_time = args.settle_time
+    poll_interval = args.poll_interval
     lif_folder = args.lif_folder
 
 # Yes.. this is against PEP8, but this prevents taking time to load
-# tensorflow if all we're doing is looking at the arguments.
-import tensorflow as tf  # noqa
-tf.logging.set_verbosity(tf.logging.ERROR)
-import keras  # noqa
+# modules if all we're doing is looking at the arguments. Tensorflow is only
+# imported by load_model(), and not at all when an inference server is used.
 import os  # noqa
 import glob  # noqa
-from cell_track.tools import get_session, safe_load_model  # noqa
-from cell_track.tools.track_image import track_lif  # noqa
+import json  # noqa
+from contextlib import contextmanager  # noqa
+from cell_track.tools import LazyModel, load_model  # noqa
+from cell_track.tools.metrics import METRICS  # noqa
+from cell_track.tools.memory import MemoryBudget  # noqa
+from cell_track.tools.tuning import load_tuning  # noqa
+from cell_track.tools.profiling import StageProfiler  # noqa
+from cell_track.tools.manifest import RunManifest  # noqa
+from cell_track.tools.track_image import track_lif, track_lifs_parallel, iter_lif_series  # noqa
 
 
 lif_list = glob.glob(os.path.join(lif_folder, '*.lif'))
-if len(lif_list) < 1:
+if len(lif_list) < 1 and not watch:
     raise ValueError("No LIF files to process.")
 
 def getOutLifPath(lif_path):
@@ -111,23 +327,65 @@ def getOutLifPath(lif_path):
     outdirname = os.path.splitext(outfilename)[0]
     return os.path.join(out_folder, outdirname)
 
-# Use GPU if available / enabled
-if enable_gpu:
-    os.environ['CUDA_VISIBLE_DEVICES'] = enable_gpu
-
-keras.backend.tensorflow_backend.set_session(get_session())
-
-# convert into inference model
-print('Loading model')
-model = safe_load_model(model_path)
+def walkSeriesFolders(outpath):
+    """Yields (parent, folder) for each output folder, skipping Zarr stores"""
+    for dir, subFolders, files in os.walk(outpath):
+        subFolders[:] = [subdir for subdir in subFolders
+                         if not subdir.endswith('.zarr')]
+        for subdir in subFolders:
+            yield dir, subdir
+
+def getStackExt(lif_name, series):
+    """The extension of the image stack of a series, as recorded by track_lif"""
+    record = manifest.get(lif_name, series, 'detect')
+    if record and json.loads(record['params']).get('out_format') == 'zarr':
+        return '.zarr'
+    return '.tif'
+
+if no_tiff_export:
+    out_format = 'none'
+elif use_zarr:
+    out_format = 'zarr'
+else:
+    out_format = 'tiff'
+
+# SQLite locking is not reliable on network filesystems, so the machines of a
+# --queue run don't share a manifest. The queue itself records what is done,
+# and a later run with the manifest adopts the outputs by their XML files.
+manifest = None if no_manifest or queue_folder else RunManifest(out_folder)
+
+budget = MemoryBudget(max_memory) if max_memory else None
+
+# Thread counts are set by get_session(), see tuning
+tuning = load_tuning()
+if tuning:
+    print('Using the tuning profile of this machine, from ' + tuning['tuned'])
+if batch_size is None:
+    batch_size = tuning.get('batch_size', 1)
+pin = pin or tuning.get('pin', False)
+if workers is None:
+    # Pinned workers default to one per NUMA node
+    from cell_track.tools.affinity import numa_nodes
+    workers = tuning.get('workers', len(numa_nodes()) if pin else 1)
+
+
+def run_detection(lif_list, model, model_hash=''):
+    """ML/track on the files"""
+    if workers > 1:
+        track_lifs_parallel([(liffile, getOutLifPath(liffile)) for liffile in lif_list],
+                            model_path, workers, pin=pin, budget=budget,
+                            out_format=out_format, batch_size=batch_size)
+    # With workers, this records their outputs in the manifest and redoes
+    # the series that changed since the last run.
+    for liffile in lif_list:
+        outpath = getOutLifPath(liffile)
+        track_lif(liffile, outpath, model, out_format=out_format,
+                  manifest=manifest, model_hash=model_hash,
+                  low_memory=budget is not None, batch_size=batch_size)
 
-# ML/track on the files
-for liffile in lif_list:
-    outpath = getOutLifPath(liffile)
-    track_lif(liffile, outpath, model)
 
-# Run tracking through ImageJ
-if enable_track:
+def run_tracking(lif_list):
+    """Run tracking through ImageJ"""
     import subprocess
     import shutil
     # Todo: This looks for the bin, not necessarily the 'path'
@@ -148,44 +406,254 @@ if enable_track:
     if imagej_path is None:
         raise RuntimeError("Can't find ImageJ exec. Link / Add 'ImageJ' to the $PATH")
 
-
-
-
     for liffile in lif_list:
         outpath = getOutLifPath(liffile)
-        if sys.platform.startswith('win'):
-            ij_script = str(os.path.join(local_path, 'ImageJ/TrackmateHeadlessPyWin.py'))
-            os.system(imagej_path + ' --ij2 --headless --console --run "' +
-                      ij_script + '" "infilename=\'' + outpath + '\'"')
-        else:
-            ij_script = str(os.path.join(local_path, 'ImageJ/TrackmateHeadlessPy.py'))
-            subprocess.run([imagej_path, '--headless', ij_script, outpath])
-
-# Make summary CSV files for each lif?
-if make_csv:
+        lif_name = os.path.basename(liffile)
+        if manifest is not None:
+            pending = manifest.pending('track', lif_name)
+            if not pending:
+                print("Tracking of " + lif_name + " is up to date, skipping")
+                continue
+            for series in pending:
+                manifest.start(lif_name, series, 'track',
+                               manifest.upstream_hash(lif_name, series, 'detect'))
+        print("Tracking " + lif_name)
+        with METRICS.timer('track.imagej'):
+            if sys.platform.startswith('win'):
+                ij_script = str(os.path.join(local_path, 'ImageJ/TrackmateHeadlessPyWin.py'))
+                os.system(imagej_path + ' --ij2 --headless --console --run "' +
+                          ij_script + '" "infilename=\'' + outpath + '\'"')
+            else:
+                ij_script = str(os.path.join(local_path, 'ImageJ/TrackmateHeadlessPy.py'))
+                subprocess.run([imagej_path, '--headless', ij_script, outpath])
+        METRICS.count('track.lifs')
+        if manifest is not None:
+            for series in pending:
+                stack_path = os.path.join(outpath, series + getStackExt(lif_name, series))
+                tracked = os.path.exists(stack_path + '.trackmate.xml')
+                manifest.finish(lif_name, series, 'track',
+                                status='done' if tracked else 'failed')
+
+
+def run_csv(lif_list):
+    """Make summary CSV files and the Parquet dataset for each lif"""
     from cell_track.tools.trackmate import process_xml_folder
+    from cell_track.tools.dataset import DATASET_FOLDER, dataset_available, write_folder
+    dataset_root = os.path.join(out_folder, DATASET_FOLDER)
+    write_dataset = dataset_available()
+    if not write_dataset:
+        print('pyarrow is not installed, skipping the Parquet dataset')
+    catalog = None
+    if catalog_path:
+        from cell_track.tools.catalog import Catalog
+        catalog = Catalog(catalog_path)
+        experiment = os.path.basename(os.path.normpath(out_folder))
+        run_id = catalog.add_run(experiment, out_folder, os.path.basename(model_path),
+                                 {'lifs': [os.path.basename(lif) for lif in lif_list]})
+
+    def make_csv(outpath, lif_name, folder):
+        process_xml_folder(os.path.join(outpath, folder), budget=budget)
+        if catalog is not None:
+            with METRICS.timer('csv.catalog'):
+                added = catalog.add_folder(os.path.join(outpath, folder), experiment,
+                                           os.path.splitext(lif_name)[0], folder, run_id)
+            print('Added %d stacks to the catalog %s' % (added, catalog_path))
+        if write_dataset:
+            with METRICS.timer('csv.dataset'):
+                n_tracks, n_spots = write_folder(dataset_root, os.path.join(outpath, folder),
+                                                 os.path.splitext(lif_name)[0], folder)
+            print('Wrote %d tracks and %d spots to %s' % (n_tracks, n_spots, dataset_root))
+
     for liffile in lif_list:
         outpath = getOutLifPath(liffile)
+        lif_name = os.path.basename(liffile)
 
-        for dir, subFolders, files in os.walk(outpath):
-            for subdir in subFolders:
+        if manifest is None:
+            for dir, subdir in walkSeriesFolders(outpath):
                 print("Making CSVs in folder: " + subdir)
-                process_xml_folder(os.path.join(outpath, subdir))
-
-
-if make_video:
-    if not enable_track:
-        raise RuntimeError('--make_video requires --track')
+                make_csv(outpath, lif_name, subdir)
+            continue
+
+        # The CSV files are per folder, so a folder is redone if any of
+        # its series was tracked again.
+        pending_folders = set(os.path.dirname(series) for series in
+                              manifest.pending('csv', lif_name))
+        for folder in sorted(pending_folders):
+            print("Making CSVs in folder: " + folder)
+            folder_series = [series for series in manifest.series(lif_name, 'track')
+                             if os.path.dirname(series) == folder]
+            for series in folder_series:
+                manifest.start(lif_name, series, 'csv',
+                               manifest.upstream_hash(lif_name, series, 'track'))
+            try:
+                make_csv(outpath, lif_name, folder)
+            except BaseException:
+                for series in folder_series:
+                    manifest.finish(lif_name, series, 'csv', status='failed')
+                raise
+            for series in folder_series:
+                manifest.finish(lif_name, series, 'csv')
+    if catalog is not None:
+        catalog.close()
+
+
+def run_video(lif_list):
+    """Make videos and compile the alldata.csv files"""
     from cell_track.tools.trackmate import drawTrackmateVideo
 
     print('Making video, compiling csv files.')
 
     for liffile in lif_list:
         outpath = getOutLifPath(liffile)
+        lif_name = os.path.basename(liffile)
+
+        if out_format == 'none':
+            from readlif.reader import LifFile
+            from cell_track.tools.stack_io import LifFrameSource
+            lif_data = LifFile(liffile)
+            pending = (manifest.pending('video', lif_name)
+                       if manifest is not None else None)
+            for index, image, folder_path, path in iter_lif_series(lif_data):
+                stack_path = os.path.join(outpath, path + '.tif')
+                if not os.path.exists(stack_path + '.trackmate.xml'):
+                    continue
+                if pending is not None and path not in pending:
+                    continue
+                if manifest is not None:
+                    manifest.start(lif_name, path, 'video',
+                                   manifest.upstream_hash(lif_name, path, 'track'))
+                drawTrackmateVideo(stack_path,
+                                   os.path.join(outpath, folder_path, 'alldata.csv'),
+                                   frames=LifFrameSource(lif_data, index),
+                                   budget=budget)
+                if manifest is not None:
+                    manifest.finish(lif_name, path, 'video')
+            continue
+
+        if manifest is not None:
+            for series in manifest.pending('video', lif_name):
+                stack_path = os.path.join(outpath, series + getStackExt(lif_name, series))
+                with manifest.run(lif_name, series, 'video',
+                                  manifest.upstream_hash(lif_name, series, 'track')):
+                    drawTrackmateVideo(stack_path, os.path.join(
+                        outpath, os.path.dirname(series), 'alldata.csv'),
+                        budget=budget)
+            continue
+
+        for dir, subdir in walkSeriesFolders(outpath):
+            print("Processing folder: " + subdir)
+            stack_list = (glob.glob(os.path.join(dir, subdir, '*.tif')) +
+                          glob.glob(os.path.join(dir, subdir, '*.zarr')))
+            for file in stack_list:
+                drawTrackmateVideo(file, os.path.join(outpath, subdir, 'alldata.csv'),
+                                   budget=budget)
+
+
+if make_video and not enable_track:
+    raise RuntimeError('--make_video requires --track')
+if queue_folder and (enable_track or make_csv or make_video or watch):
+    raise RuntimeError('--queue only runs the detection, run --track, '
+                       '--make_csv and --make_video once all machines are done')
+
+# Use GPU if available / enabled
+if enable_gpu:
+    os.environ['CUDA_VISIBLE_DEVICES'] = enable_gpu
+
+profiler = StageProfiler(os.path.join(out_folder, 'acit_profile') if profile else None)
+if workers > 1 and not queue_folder:
+    # The workers load their own models, this one only detects what they left
+    model = LazyModel(model_path, use_server=not no_server)
+else:
+    model = profiler.wrap_model(load_model(model_path, use_server=not no_server))
+
+model_hash = manifest.model_hash(model_path) if manifest is not None else ''
 
-        for dir, subFolders, files in os.walk(outpath):
-            for subdir in subFolders:
-                print("Processing folder: " + subdir)
-                tiff_list = glob.glob(os.path.join(dir, subdir, '*.tif'), )
-                for file in tiff_list:
-                    drawTrackmateVideo(file, os.path.join(outpath, subdir, 'alldata.csv'))
+
+@contextmanager
+def stage(name):
+    """Runs a stage under the profiler, recording its memory use"""
+    with profiler.stage(name), METRICS.memory(name, trace=trace_memory):
+        yield
+    if budget is not None:
+        budget.check(name)
+
+
+def write_run_metrics(name=''):
+    """Writes the metrics of the run as JSON, and as Prometheus textfile if asked"""
+    import time
+    json_path = os.path.join(out_folder, 'acit_metrics_' +
+                             time.strftime('%Y%m%d-%H%M%S') + name + '.json')
+    METRICS.write_json(json_path)
+    if metrics_textfile:
+        METRICS.write_prometheus(metrics_textfile)
+    summary = METRICS.summary()
+    print('Run took %.1f s, frames/s per stage: %s' % (
+        summary['duration'], ', '.join('%s %.2f' % item for item in
+                                       summary['frames_per_second'].items())))
+    print('Peak memory per stage: ' + ', '.join(
+        '%s %.0f MB' % (name, stats['rss_peak_mb'])
+        for name, stats in summary['memory'].items()))
+    print('Metrics written to ' + json_path)
+
+
+def run_pipeline(lif_list):
+    """Runs all enabled stages on the LIF files"""
+    METRICS.reset()
+    with stage('detect'):
+        run_detection(lif_list, model, model_hash)
+
+    if enable_track:
+        with stage('track'):
+            run_tracking(lif_list)
+
+    # Make summary CSV files for each lif?
+    if make_csv:
+        with stage('csv'):
+            run_csv(lif_list)
+
+    if make_video:
+        with stage('video'):
+            run_video(lif_list)
+
+    write_run_metrics()
+
+
+if watch:
+    import traceback
+    from cell_track.tools.watch import LifWatcher
+    watcher = LifWatcher(lif_folder, settle_time=settle_time,
+                         poll_interval=poll_interval)
+    print('Watching ' + str(lif_folder) + ' for LIF files, Ctrl-C to stop')
+    try:
+        for liffile in watcher.watch():
+            print('New LIF file: ' + os.path.basename(liffile))
+            try:
+                run_pipeline([liffile])
+            except Exception:
+                # Keep watching, the file is retried when it changes or
+                # the watcher is restarted.
+                traceback.print_exc()
+    except KeyboardInterrupt:
+        print('Stopped watching')
+elif queue_folder:
+    from cell_track.tools.work_queue import WorkQueue, run_worker
+    queue = WorkQueue(queue_folder, lease_time=lease_time)
+    for liffile in lif_list:
+        queue.add_lif(liffile)
+    print('Worker ' + queue.worker_id + ' joining queue ' + queue_folder +
+          ': ' + str(queue.counts()))
+
+    def process_unit(unit):
+        print('Claimed ' + unit['series'] + ' of ' + os.path.basename(unit['lif']))
+        track_lif(unit['lif'], getOutLifPath(unit['lif']), model,
+                  out_format=out_format, series=[unit['series']],
+                  low_memory=budget is not None, batch_size=batch_size)
+
+    METRICS.reset()
+    with stage('detect'):
+        finished = run_worker(queue, process_unit)
+    write_run_metrics('_' + queue.worker_id)
+    print('Queue finished, this worker did ' + str(finished) + ' series: ' +
+          str(queue.counts()))
+else:
+    run_pipeline(lif_list)
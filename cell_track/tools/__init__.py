@@ -1,14 +1,24 @@
-def get_session():
+def get_session(tuning=None):
     """
     Gets the modified tensorflow session.
 
+    Args:
+        tuning: dict with the intra_op_threads and inter_op_threads to use,
+            defaults to the tuning profile of the host (see tuning). Missing
+            values are left to tensorflow.
+
     Returns:
         tensorflow.Session
 
     """
     import tensorflow as tf
+    if tuning is None:
+        from cell_track.tools.tuning import load_tuning
+        tuning = load_tuning()
     config = tf.compat.v1.ConfigProto()
     config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = tuning.get('intra_op_threads', 0)
+    config.inter_op_parallelism_threads = tuning.get('inter_op_threads', 0)
     return tf.compat.v1.Session(config=config)
 
 def safe_load_model(model_path):
@@ -28,4 +38,57 @@ def safe_load_model(model_path):
         model = models.load_model(model_path, backbone_name='resnet50', convert=True)
     except:
         model = models.load_model(model_path, backbone_name='resnet50')
-    return model
\ No newline at end of file
+    return model
+
+
+def load_model(model_path, use_server=True, tuning=None):
+    """
+    Gets a model for inference, from a running inference server if there is
+    one with the same model, otherwise by loading it in this process.
+
+    Tensorflow is only imported when the model is loaded here, so using a
+    server (see cell_track.tools.server) also saves its start-up time.
+
+    Args:
+        model_path: path to the .hd5 model file
+        use_server: look for an inference server first
+        tuning: thread counts of the session, see get_session()
+
+    Returns:
+        keras.models.Model or cell_track.tools.server.RemoteModel, both with
+        a predict_on_batch() method
+
+    """
+    if use_server:
+        from cell_track.tools.server import connect
+        model = connect(model_path)
+        if model is not None:
+            print('Using the inference server at ' + model.address)
+            return model
+    import tensorflow as tf
+    import keras
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+    keras.backend.tensorflow_backend.set_session(get_session(tuning))
+    print('Loading model')
+    return safe_load_model(model_path)
+
+
+class LazyModel:
+    """
+    Stands in for a model that is only loaded, with load_model(), when
+    predict_on_batch() is first called. Used when worker processes do the
+    detection, so this process loads a model only for what they left.
+
+    Args:
+        model_path: path to the .hd5 model file
+        **kwargs: use_server and tuning for load_model()
+    """
+    def __init__(self, model_path, **kwargs):
+        self.model_path = model_path
+        self._kwargs = kwargs
+        self._model = None
+
+    def predict_on_batch(self, batch):
+        if self._model is None:
+            self._model = load_model(self.model_path, **self._kwargs)
+        return self._model.predict_on_batch(batch)
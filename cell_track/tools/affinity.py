@@ -0,0 +1,128 @@
+"""
+Pinning of the detection workers to cores and NUMA nodes, for --pin.
+
+A tensorflow session rarely gets faster past 8 to 16 cores for batches of a
+few frames, so big machines are best used by several model replicas that
+each run on their own cores. On machines with several sockets, every replica
+is kept on the cores of one NUMA node, and since Linux allocates memory on
+the node of the thread that first touches it, the model and frames of the
+replica end up in the memory of that node too.
+
+The topology is read from /sys/devices/system/node. Elsewhere, or without
+that folder, all cores are treated as one node.
+"""
+import glob
+import os
+import re
+
+NODE_ROOT = '/sys/devices/system/node'
+
+
+def parse_cpulist(text):
+    """
+    Parses a Linux cpu list, like '0-3,8-11'.
+
+    Returns:
+        list: The cpu numbers, sorted
+    """
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    """Formats cpu numbers as a cpu list, the reverse of parse_cpulist()."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else '%d-%d' % (first, last)
+                    for first, last in ranges)
+
+
+def allowed_cpus():
+    """The cpus this process may run on, e.g. as limited by taskset or cgroups."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(root=NODE_ROOT):
+    """
+    The NUMA nodes of the machine, and the allowed cpus of each.
+
+    Args:
+        root (str): The sysfs node folder
+
+    Returns:
+        dict: node number: sorted list of cpus, without nodes that have no
+            allowed cpus
+    """
+    allowed = set(allowed_cpus())
+    nodes = {}
+    for path in glob.glob(os.path.join(root, 'node[0-9]*', 'cpulist')):
+        node = int(re.search(r'node(\d+)', path).group(1))
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def replica_cpu_sets(replicas, nodes=None):
+    """
+    Splits the cpus between model replicas. Replicas are spread over the
+    nodes in turn, and the cpus of a node are split evenly between its
+    replicas, so no replica spans two nodes.
+
+    Args:
+        replicas (int): Number of replicas
+        nodes (dict): node: cpus, defaults to numa_nodes()
+
+    Returns:
+        list: (node, cpus) for each replica. If there are more replicas than
+            cpus on a node, the cpus are shared.
+    """
+    nodes = nodes or numa_nodes()
+    order = sorted(nodes)
+    per_node = {node: [] for node in order}
+    for replica in range(replicas):
+        per_node[order[replica % len(order)]].append(replica)
+    cpu_sets = [None] * replicas
+    for node, members in per_node.items():
+        cpus = nodes[node]
+        for index, replica in enumerate(members):
+            if len(members) > len(cpus):
+                share = [cpus[index % len(cpus)]]
+            else:
+                share = cpus[index * len(cpus) // len(members):
+                             (index + 1) * len(cpus) // len(members)]
+            cpu_sets[replica] = (node, share)
+    return cpu_sets
+
+
+def replica_tuning(cpus):
+    """Thread counts of the session of a replica running on cpus, see get_session()."""
+    return {'intra_op_threads': len(cpus), 'inter_op_threads': min(2, len(cpus))}
+
+
+def pin_to_cpus(cpus):
+    """
+    Restricts this process to the cpus, and sizes the OpenMP thread pool of
+    MKL builds of tensorflow to them. Must be called before tensorflow is
+    imported.
+
+    Returns:
+        bool: False if pinning is not supported here
+    """
+    os.environ['OMP_NUM_THREADS'] = str(len(cpus))
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
@@ -0,0 +1,324 @@
+"""
+Motility analytics computed from the spot positions of the tracks.
+
+The tracks of one stack, or of a whole plate, are flattened into arrays with
+one entry per spot, sorted by track and frame:
+
+    track_id  frame  t (s)  x (um)  y (um)
+
+and every metric is computed for all tracks at once with numpy, instead of
+per track in Python, or per metric in a Fiji analyzer. A track is assumed to
+have at most one spot per frame, which the track filters of the pipeline
+ensure (no splits).
+
+The spot positions written by the detector are in pixels, they are scaled by
+the pixel width of the ImageData of the XML file, and the frames by its
+time interval.
+
+Examples:
+    >>> trajectories, tracks = read_plate(glob.glob('/data/results/Exp1/Group1/*trackmate.xml'))
+    >>> metrics = track_metrics(trajectories)
+    >>> lags, lag_times, per_track, ensemble = msd(trajectories, max_lag=20)
+"""
+import os
+import re
+from collections import namedtuple
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+# The columns of track_metrics()
+METRIC_COLUMNS = ['n_spots', 'duration', 'total_distance', 'net_displacement',
+                  'max_displacement', 'mean_speed', 'max_speed', 'straightness',
+                  'directional_persistence', 'mean_turning_angle']
+
+Trajectories = namedtuple('Trajectories', 'track_id frame t x y')
+Trajectories.__doc__ = """
+Spot arrays of a set of tracks, sorted by track_id, then frame.
+
+Attributes:
+    track_id (numpy.ndarray): int, the track of each spot, unique over a plate
+    frame (numpy.ndarray): int, the frame of each spot
+    t (numpy.ndarray): The time of each spot in seconds
+    x (numpy.ndarray): The x position in microns
+    y (numpy.ndarray): The y position in microns
+"""
+
+
+def parse_trackmate_xml(xml_path):
+    """
+    Reads the spots, tracks and image data of a trackmate XML file, without
+    keeping the XML tree in memory.
+
+    Returns:
+        dict: With the keys
+            'spots': ID: (frame, x, y) of every spot, positions as in the file
+            'tracks': (attributes, spot IDs) of every Track, in file order
+            'filtered': set of the TRACK_ID that passed the track filters
+            'image_data': the attributes of ImageData
+    """
+    spots = {}
+    tracks = []
+    filtered = set()
+    image_data = {}
+    for event, elem in ET.iterparse(xml_path):
+        if elem.tag == 'Spot':
+            spots[elem.get('ID')] = (int(round(float(elem.get('FRAME')))),
+                                     float(elem.get('POSITION_X')),
+                                     float(elem.get('POSITION_Y')))
+            elem.clear()
+        elif elem.tag == 'Track':
+            ids = set()
+            for edge in elem.iter('Edge'):
+                ids.add(edge.get('SPOT_SOURCE_ID'))
+                ids.add(edge.get('SPOT_TARGET_ID'))
+            tracks.append((dict(elem.attrib), ids))
+            elem.clear()
+        elif elem.tag == 'TrackID':
+            filtered.add(elem.get('TRACK_ID'))
+        elif elem.tag == 'ImageData':
+            image_data = dict(elem.attrib)
+    return {'spots': spots, 'tracks': tracks, 'filtered': filtered,
+            'image_data': image_data}
+
+
+def build_trajectories(parsed, filtered_only=True, pixel_size=None, frame_interval=None):
+    """
+    Builds the Trajectories of a parsed trackmate XML file.
+
+    Args:
+        parsed (dict): As from parse_trackmate_xml()
+        filtered_only (bool): Only the tracks that passed the track filters
+        pixel_size (float): Microns per pixel, defaults to the pixelwidth of
+            the ImageData in the file, or 1
+        frame_interval (float): Seconds per frame, defaults to the
+            timeinterval of the ImageData in the file, or 1
+
+    Returns:
+        (Trajectories, list): The trajectories, and the TRACK_ID of each
+            track_id, which counts from 0.
+    """
+    image_data = parsed['image_data']
+    if pixel_size is None:
+        pixel_size = float(image_data.get('pixelwidth', 1.0))
+    if frame_interval is None:
+        frame_interval = float(image_data.get('timeinterval', 1.0))
+
+    spots = parsed['spots']
+    rows = []
+    names = []
+    for attributes, ids in parsed['tracks']:
+        name = attributes.get('TRACK_ID')
+        if filtered_only and name not in parsed['filtered']:
+            continue
+        track_id = len(names)
+        names.append(name)
+        rows.extend((track_id,) + spots[spot_id] for spot_id in ids)
+    table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    order = np.lexsort((table[:, 1], table[:, 0]))
+    table = table[order]
+    frames = table[:, 1].astype(np.int64)
+    trajectories = Trajectories(track_id=table[:, 0].astype(np.int64), frame=frames,
+                                t=frames * frame_interval,
+                                x=table[:, 2] * pixel_size, y=table[:, 3] * pixel_size)
+    return trajectories, names
+
+
+def read_trajectories(xml_path, filtered_only=True, pixel_size=None, frame_interval=None):
+    """
+    Reads the tracks of a trackmate XML file as Trajectories, see
+    build_trajectories() for the arguments and return values.
+    """
+    return build_trajectories(parse_trackmate_xml(xml_path), filtered_only,
+                              pixel_size, frame_interval)
+
+
+def read_plate(xml_paths, filtered_only=True):
+    """
+    Reads the tracks of several trackmate XML files into one Trajectories,
+    so the metrics of a whole plate are computed in one pass.
+
+    Returns:
+        (Trajectories, pandas.DataFrame): The trajectories, and a table with
+            the stack, well and TRACK_ID of each track_id.
+    """
+    well_search = re.compile('(Well[0-9]*)')
+    parts = []
+    tracks = []
+    offset = 0
+    for xml_path in sorted(xml_paths):
+        trajectories, names = read_trajectories(xml_path, filtered_only)
+        parts.append(trajectories._replace(track_id=trajectories.track_id + offset))
+        stack = os.path.basename(xml_path)
+        well = well_search.search(stack)
+        tracks.append(pd.DataFrame({'stack': stack,
+                                    'well': well.group(0) if well else '',
+                                    'TRACK_ID': names}))
+        offset += len(names)
+    if not parts:
+        empty = np.zeros(0)
+        return (Trajectories(empty.astype(np.int64), empty.astype(np.int64), empty, empty,
+                             empty), pd.DataFrame(columns=['stack', 'well', 'TRACK_ID']))
+    trajectories = Trajectories(*[np.concatenate(arrays) for arrays in zip(*parts)])
+    return trajectories, pd.concat(tracks, ignore_index=True)
+
+
+def _segments(trajectories):
+    """Steps between consecutive spots of the same track."""
+    same = trajectories.track_id[1:] == trajectories.track_id[:-1]
+    track = trajectories.track_id[1:][same]
+    dx = np.diff(trajectories.x)[same]
+    dy = np.diff(trajectories.y)[same]
+    dt = np.diff(trajectories.t)[same]
+    return track, dx, dy, dt
+
+
+def turning_angles(trajectories):
+    """
+    The angle between consecutive steps of every track, in radians between
+    -pi and pi, positive counterclockwise in image coordinates. Steps
+    without movement have no direction and are skipped.
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): The track_id of each angle, and the angles
+    """
+    track, dx, dy, dt = _segments(trajectories)
+    moved = (dx != 0) | (dy != 0)
+    track, dx, dy = track[moved], dx[moved], dy[moved]
+    heading = np.arctan2(dy, dx)
+    same = track[1:] == track[:-1]
+    angles = np.diff(heading)[same]
+    angles = (angles + np.pi) % (2 * np.pi) - np.pi
+    return track[1:][same], angles
+
+
+def track_metrics(trajectories):
+    """
+    Per track motility metrics.
+
+    Returns:
+        pandas.DataFrame: Indexed by track_id, with the columns:
+            n_spots, duration (s), total_distance (um),
+            net_displacement (um, first to last spot), max_displacement (um,
+            from the first spot), mean_speed and max_speed (um/s, over the
+            steps), straightness (net_displacement / total_distance, the
+            confinement ratio of TrackMate), directional_persistence (mean
+            cosine of the turning angles) and mean_turning_angle (mean
+            absolute turning angle, in radians)
+    """
+    columns = METRIC_COLUMNS
+    track_id = trajectories.track_id
+    if not len(track_id):
+        return pd.DataFrame(columns=columns).rename_axis('track_id')
+    n_tracks = int(track_id.max()) + 1
+    n_spots = np.bincount(track_id, minlength=n_tracks)
+    present = n_spots > 0
+    first = np.zeros(n_tracks, dtype=np.int64)
+    first[1:] = np.cumsum(n_spots)[:-1]
+    last = first + np.maximum(n_spots, 1) - 1
+
+    x, y, t = trajectories.x, trajectories.y, trajectories.t
+    duration = t[last] - t[first]
+    net_displacement = np.hypot(x[last] - x[first], y[last] - y[first])
+    from_start = np.hypot(x - x[first][track_id], y - y[first][track_id])
+    max_displacement = np.zeros(n_tracks)
+    np.maximum.at(max_displacement, track_id, from_start)
+
+    track, dx, dy, dt = _segments(trajectories)
+    step = np.hypot(dx, dy)
+    total_distance = np.bincount(track, weights=step, minlength=n_tracks)
+    n_steps = np.bincount(track, minlength=n_tracks)
+    speed = np.divide(step, dt, out=np.zeros_like(step), where=dt > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_speed = np.bincount(track, weights=speed, minlength=n_tracks) / n_steps
+        straightness = net_displacement / total_distance
+    max_speed = np.zeros(n_tracks)
+    np.maximum.at(max_speed, track, speed)
+
+    angle_track, angles = turning_angles(trajectories)
+    n_angles = np.bincount(angle_track, minlength=n_tracks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        persistence = np.bincount(angle_track, weights=np.cos(angles),
+                                  minlength=n_tracks) / n_angles
+        mean_turning = np.bincount(angle_track, weights=np.abs(angles),
+                                   minlength=n_tracks) / n_angles
+
+    metrics = pd.DataFrame(dict(zip(columns, (
+        n_spots, duration, total_distance, net_displacement, max_displacement,
+        mean_speed, max_speed, straightness, persistence, mean_turning))), columns=columns)
+    metrics.index.name = 'track_id'
+    return metrics[present]
+
+
+def msd(trajectories, max_lag=20):
+    """
+    Mean squared displacement of every track, for lags of 1 to max_lag
+    frames. Gaps in a track are accounted for by using the frame numbers,
+    not the spot order.
+
+    Args:
+        trajectories (Trajectories): The tracks
+        max_lag (int): The largest lag, in frames
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray): The lags
+            in frames, the mean lag times in seconds, the (n_tracks, max_lag)
+            MSD of each track in um^2 (NaN where a track has no pair of spots
+            at that lag), and the MSD over all pairs of all tracks.
+    """
+    track_id, frame = trajectories.track_id, trajectories.frame
+    n_tracks = int(track_id.max()) + 1 if len(track_id) else 0
+    bins = n_tracks * (max_lag + 1)
+    sums = np.zeros(bins)
+    counts = np.zeros(bins)
+    time_sums = np.zeros(max_lag + 1)
+    # A lag of L frames is at most L spots further along the same track
+    for offset in range(1, max_lag + 1):
+        same = track_id[offset:] == track_id[:-offset]
+        lag = (frame[offset:] - frame[:-offset])[same]
+        keep = lag <= max_lag
+        lag = lag[keep]
+        track = track_id[offset:][same][keep]
+        squared = ((trajectories.x[offset:] - trajectories.x[:-offset])[same][keep] ** 2 +
+                   (trajectories.y[offset:] - trajectories.y[:-offset])[same][keep] ** 2)
+        index = track * (max_lag + 1) + lag
+        sums += np.bincount(index, weights=squared, minlength=bins)
+        counts += np.bincount(index, minlength=bins)
+        time_sums += np.bincount(lag, weights=(trajectories.t[offset:] -
+                                               trajectories.t[:-offset])[same][keep],
+                                 minlength=max_lag + 1)
+    sums = sums.reshape(n_tracks, max_lag + 1)[:, 1:]
+    counts = counts.reshape(n_tracks, max_lag + 1)[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_track = sums / counts
+        ensemble = sums.sum(axis=0) / counts.sum(axis=0)
+        lag_times = time_sums[1:] / counts.sum(axis=0)
+    return np.arange(1, max_lag + 1), lag_times, per_track, ensemble
+
+
+def analyze_folder(folder, max_lag=20):
+    """
+    Writes the motility metrics of all trackmate XML files in a folder:
+    All_tracks_motility.csv with the metrics of every filtered track, and
+    All_wells_msd.csv with the MSD curve of every well, the mean of the
+    curves of its tracks.
+
+    Returns:
+        pandas.DataFrame: The per track metrics
+    """
+    from glob import glob
+    trajectories, tracks = read_plate(glob(os.path.join(folder, '*trackmate.xml')))
+    metrics = track_metrics(trajectories)
+    table = tracks.join(metrics, how='inner')
+    table.to_csv(os.path.join(folder, 'All_tracks_motility.csv'), index=False)
+
+    lags, lag_times, per_track, ensemble = msd(trajectories, max_lag)
+    curves = {'lag': lags, 'lag_time': lag_times}
+    for well, rows in tracks.groupby('well').groups.items():
+        with np.errstate(invalid='ignore'):
+            well_sums = np.nansum(per_track[np.asarray(rows)], axis=0)
+            well_counts = np.sum(~np.isnan(per_track[np.asarray(rows)]), axis=0)
+            curves[well] = well_sums / well_counts
+    pd.DataFrame(curves).to_csv(os.path.join(folder, 'All_wells_msd.csv'), index=False)
+    return table
@@ -29,7 +29,8 @@ def get_box_center(box):
     return centerx, centery
 
 
-def filter_boxes(in_boxes, in_scores, _passed_boxes=[], _passed_scores=[]):
+def filter_boxes(in_boxes, in_scores, _passed_boxes=[], _passed_scores=[],
+                 center_distance=20):
     """
     Filters overlapping boxes. Accepts two lists of equal length:
         1. a list of boxes (x1, x2, y1, y2)
@@ -46,6 +47,8 @@ def filter_boxes(in_boxes, in_scores, _passed_boxes=[], _passed_scores=[]):
         in_scores (list): List of scores for each box
         _passed_boxes (list): Pass an empty list to this []
         _passed_scores (list): Pass an empty list to this []
+        center_distance (float): Overlapping boxes whose centers are this
+            far apart or more, in x or y, are kept as two cells
 
     Returns:
         Two lists: passed_boxes (list of tuples), and pased_scores (list).
@@ -72,8 +75,8 @@ def filter_boxes(in_boxes, in_scores, _passed_boxes=[], _passed_scores=[]):
         if overlap_bool:
             # If the centers are more than 20 px apart,
             # there is no tie to break. Likely two big boxes overlapping self.
-            center_bool = (abs(centerx - t_centerx) < 20 and
-                           abs(centery - t_centery) < 20)
+            center_bool = (abs(centerx - t_centerx) < center_distance and
+                           abs(centery - t_centery) < center_distance)
             if center_bool:
                 return True
         else:
@@ -121,6 +124,7 @@ def filter_boxes(in_boxes, in_scores, _passed_boxes=[], _passed_scores=[]):
     if not len(pass_forward_boxes) > 1:  # in case our last boxes are ties
         return _passed_boxes, _passed_scores
     if len(in_boxes) > 1:
-        return filter_boxes(pass_forward_boxes, pass_forward_scores, _passed_boxes, _passed_scores)
+        return filter_boxes(pass_forward_boxes, pass_forward_scores, _passed_boxes, _passed_scores,
+                            center_distance)
     else:
         return _passed_boxes, _passed_scores
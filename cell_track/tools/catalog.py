@@ -0,0 +1,262 @@
+"""
+Catalog of the tracks of many experiments, for queries across them.
+
+Every output folder holds the results of one experiment as XML and CSV
+files, so comparing experiments means parsing all of their XML files again.
+The catalog is a single SQLite database that --make_csv --catalog PATH fills
+with the stacks, tracks and spots of every folder it processes:
+
+    runs    one row per run of the pipeline: experiment, output folder,
+            model and settings
+    stacks  one row per trackmate XML file: experiment, LIF file, folder,
+            well, position, pixel size and frame interval
+    tracks  one row per track: the TrackMate features and the motility
+            metrics of analytics.track_metrics(), as in the Parquet dataset
+    spots   one row per spot of a track: frame, time and position
+
+The stacks are indexed by experiment, well and position, and the spots by
+stack and time. A stack is replaced in one transaction when its XML file
+changed, and skipped otherwise, so the same database can collect all
+experiments of a lab:
+
+    >>> catalog = Catalog('/data/acit_catalog.sqlite')
+    >>> catalog.summary('mean_speed', by=('experiment', 'well'))
+    >>> catalog.tracks(experiment='Exp1', well='Well3', columns=['mean_speed'])
+    >>> catalog.query('SELECT COUNT(*) AS n FROM spots WHERE t < ?', (3600,))
+
+See also utilities/query_catalog.py.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+from cell_track.tools.analytics import METRIC_COLUMNS, parse_trackmate_xml
+from cell_track.tools.dataset import TRACK_FEATURES, stack_name, stack_tables, well_name
+
+TRACK_COLUMNS = (['track_id', 'filtered'] + [feature.lower() for feature in TRACK_FEATURES] +
+                 METRIC_COLUMNS)
+SPOT_COLUMNS = ['track_id', 'filtered', 'frame', 't', 'x', 'y', 'x_px', 'y_px']
+# Columns of the stacks table that tracks() and summary() can filter and group by
+STACK_COLUMNS = ('experiment', 'lif', 'folder', 'well', 'position', 'stack')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    experiment TEXT NOT NULL,
+    out_folder TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL DEFAULT '{}',
+    started REAL
+);
+CREATE TABLE IF NOT EXISTS stacks (
+    stack_id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs (run_id),
+    experiment TEXT NOT NULL,
+    lif TEXT NOT NULL DEFAULT '',
+    folder TEXT NOT NULL DEFAULT '',
+    well TEXT NOT NULL DEFAULT '',
+    position INTEGER,
+    stack TEXT NOT NULL,
+    xml_path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER,
+    size INTEGER,
+    pixel_size REAL,
+    frame_interval REAL,
+    added REAL
+);
+CREATE INDEX IF NOT EXISTS stacks_by_experiment ON stacks (experiment, well, position);
+CREATE INDEX IF NOT EXISTS stacks_by_well ON stacks (well, position);
+CREATE TABLE IF NOT EXISTS tracks (
+    stack_id INTEGER NOT NULL REFERENCES stacks (stack_id),
+    %s,
+    PRIMARY KEY (stack_id, track_id)
+);
+CREATE TABLE IF NOT EXISTS spots (
+    stack_id INTEGER NOT NULL REFERENCES stacks (stack_id),
+    %s
+);
+CREATE INDEX IF NOT EXISTS spots_by_time ON spots (stack_id, t);
+CREATE INDEX IF NOT EXISTS spots_by_track ON spots (stack_id, track_id, frame);
+""" % (',\n    '.join(column + (' INTEGER' if column in ('track_id', 'filtered') else ' REAL')
+                      for column in TRACK_COLUMNS),
+       ',\n    '.join(column + (' INTEGER' if column in ('track_id', 'filtered', 'frame')
+                                else ' REAL')
+                      for column in SPOT_COLUMNS))
+
+
+def position_number(xml_path):
+    """The position of a stack, e.g. 1 for Well3-Pos001, or None."""
+    match = re.search(r'Pos(\d+)', os.path.basename(xml_path))
+    return int(match.group(1)) if match else None
+
+
+class Catalog:
+    """
+    SQLite catalog of the stacks, tracks and spots of many experiments.
+
+    Args:
+        path (str): Path of the database, created if it does not exist
+    """
+    def __init__(self, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        """Closes the database connection."""
+        self._db.close()
+
+    def add_run(self, experiment, out_folder='', model='', params=None):
+        """
+        Records a run of the pipeline.
+
+        Returns:
+            int: The run_id, to pass to add_folder()
+        """
+        cursor = self._db.execute(
+            'INSERT INTO runs (experiment, out_folder, model, params, started) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (experiment, os.path.abspath(out_folder) if out_folder else '', model,
+             json.dumps(params or {}, sort_keys=True), time.time()))
+        self._db.commit()
+        return cursor.lastrowid
+
+    def add_stack(self, xml_path, experiment, lif='', folder='', run_id=None, force=False):
+        """
+        Adds the tracks and spots of a trackmate XML file, replacing those
+        added for the same file before.
+
+        Args:
+            xml_path (str): The trackmate XML file
+            experiment (str): Name of the experiment, e.g. the output folder
+            lif (str): The LIF file of the stack
+            folder (str): The folder of the stack in the output of the LIF file
+            run_id (int): The run, from add_run()
+            force (bool): Add the stack even if its XML file did not change
+
+        Returns:
+            bool: False if the stack was already up to date
+        """
+        path = os.path.abspath(xml_path)
+        stat = os.stat(path)
+        row = self._db.execute('SELECT stack_id, mtime_ns, size FROM stacks '
+                               'WHERE xml_path = ?', (path,)).fetchone()
+        if row and not force and row[1] == stat.st_mtime_ns and row[2] == stat.st_size:
+            return False
+
+        parsed = parse_trackmate_xml(path)
+        tracks, spots = stack_tables(path, parsed)
+        image_data = parsed['image_data']
+        pixel_size = float(image_data.get('pixelwidth', 1.0))
+        frame_interval = float(image_data.get('timeinterval', 1.0))
+        with self._db:
+            if row:
+                for table in ('spots', 'tracks', 'stacks'):
+                    self._db.execute('DELETE FROM ' + table + ' WHERE stack_id = ?', (row[0],))
+            cursor = self._db.execute(
+                'INSERT INTO stacks (run_id, experiment, lif, folder, well, position, stack, '
+                'xml_path, mtime_ns, size, pixel_size, frame_interval, added) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, experiment, lif, folder, well_name(path), position_number(path),
+                 stack_name(path), path, stat.st_mtime_ns, stat.st_size, pixel_size,
+                 frame_interval, time.time()))
+            stack_id = cursor.lastrowid
+            for table, frame, columns in (('tracks', tracks, TRACK_COLUMNS),
+                                          ('spots', spots, SPOT_COLUMNS)):
+                frame = frame[columns].astype({'filtered': int})
+                frame.insert(0, 'stack_id', stack_id)
+                self._db.executemany(
+                    'INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * frame.shape[1])),
+                    frame.astype(object).where(frame.notnull(), None).values.tolist())
+        return True
+
+    def add_folder(self, folder_path, experiment, lif='', folder='', run_id=None):
+        """
+        Adds all trackmate XML files in a folder, see add_stack().
+
+        Returns:
+            int: The number of stacks added or replaced
+        """
+        added = 0
+        for name in sorted(os.listdir(folder_path)):
+            if name.endswith('trackmate.xml'):
+                added += self.add_stack(os.path.join(folder_path, name), experiment,
+                                        lif, folder, run_id)
+        return added
+
+    def query(self, sql, params=()):
+        """Runs an SQL query, returns the rows as a pandas.DataFrame."""
+        return pd.read_sql_query(sql, self._db, params=params)
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column not in STACK_COLUMNS + ('filtered',):
+                raise ValueError('Cannot filter by ' + str(column))
+            table = 'tracks' if column == 'filtered' else 'stacks'
+            clauses.append('%s.%s = ?' % (table, column))
+            params.append(int(value) if column in ('filtered', 'position') else value)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def tracks(self, columns=None, filtered=True, **filters):
+        """
+        The tracks of the catalog, with the experiment, well etc. of their stack.
+
+        Args:
+            columns (list): Track columns to return, see TRACK_COLUMNS, all
+                by default
+            filtered (bool): Only the tracks that passed the track filters,
+                None for all
+            **filters: Values of the stack columns experiment, lif, folder,
+                well, position and stack to select
+
+        Returns:
+            pandas.DataFrame: One row per track
+        """
+        columns = columns or TRACK_COLUMNS
+        for column in columns:
+            if column not in TRACK_COLUMNS:
+                raise ValueError('Unknown track column: ' + str(column))
+        where, params = self._where(dict(filters, filtered=filtered))
+        sql = ('SELECT ' + ', '.join('stacks.' + column for column in STACK_COLUMNS) + ', ' +
+               ', '.join('tracks.' + column for column in columns) +
+               ' FROM tracks JOIN stacks USING (stack_id)' + where)
+        return self.query(sql, params)
+
+    def summary(self, column='mean_speed', by=('experiment', 'well'), filtered=True, **filters):
+        """
+        Count, mean, min and max of a track column per group of stacks.
+
+        Args:
+            column (str): The track column, see TRACK_COLUMNS
+            by (tuple): Stack columns to group by
+            filtered (bool): Only the tracks that passed the track filters,
+                None for all
+            **filters: As for tracks()
+
+        Returns:
+            pandas.DataFrame: One row per group, with the columns of by and
+                n, mean, min and max
+        """
+        if column not in TRACK_COLUMNS:
+            raise ValueError('Unknown track column: ' + str(column))
+        for group in by:
+            if group not in STACK_COLUMNS:
+                raise ValueError('Cannot group by ' + str(group))
+        where, params = self._where(dict(filters, filtered=filtered))
+        groups = ', '.join('stacks.' + group for group in by)
+        sql = ('SELECT %s, COUNT(tracks.%s) AS n, AVG(tracks.%s) AS mean, '
+               'MIN(tracks.%s) AS min, MAX(tracks.%s) AS max '
+               'FROM tracks JOIN stacks USING (stack_id)%s GROUP BY %s ORDER BY %s'
+               % (groups, column, column, column, column, where, groups, groups))
+        return self.query(sql, params)
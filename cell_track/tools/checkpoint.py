@@ -0,0 +1,137 @@
+"""
+Checkpointing of the detection stage, so interrupted series can be resumed.
+
+Every frame's raw detections are appended to a per-series log and flushed to
+disk as soon as the frame is done. When a series is processed again, the
+frames in the log are not sent through the network a second time.
+
+The final outputs are written with atomic_write(), so a file with the final
+name is always complete; a crash leaves at most a stray temporary file.
+"""
+import json
+import os
+from contextlib import contextmanager
+
+DETECTION_LOG_EXT = '.detections.jsonl'
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Context manager to write a file that appears under its name only when complete.
+
+    The data is written to a temporary file next to path, flushed to disk and
+    then renamed to path. If an exception is raised the temporary file is
+    removed and path is left untouched.
+
+    Args:
+        path (str): The final path of the file
+        mode (str): 'w' for text or 'wb' for binary files
+
+    Examples:
+        >>> with atomic_write('Well1-Pos001.tif.xml') as f:
+        >>>     f.write(xml_text)
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_path(path):
+    """
+    Returns the temporary path for outputs that are not written by a file object.
+
+    Write to the returned path, then os.replace() it to path when done.
+    """
+    return path + '.tmp'
+
+
+class DetectionLog:
+    """
+    Append-only log of the raw detections of an image series, one line per frame.
+
+    Each line is a JSON object with the frame number, and the boxes and scores
+    returned by the network (before filtering). Lines are flushed to disk
+    after every frame. A line that was only partly written when the process
+    died is ignored when the log is read back.
+
+    The log is kept after the series is finished; it is a cache of the raw
+    detections that can be re-filtered without running the network again.
+
+    Args:
+        path (str): Path of the log file, usually the image stack path with
+            DETECTION_LOG_EXT appended.
+
+    Examples:
+        >>> log = DetectionLog('Well1-Pos001.tif' + DETECTION_LOG_EXT)
+        >>> done = log.read()
+        >>> if frame_num not in done:
+        >>>     log.append(frame_num, boxes, scores)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def read(self):
+        """
+        Reads the frames that were completed.
+
+        Returns:
+            dict: {frame (int): (boxes (list), scores (list))}
+        """
+        frames = {}
+        if not os.path.exists(self.path):
+            return frames
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # truncated by a crash, everything after it is lost
+                frames[entry['frame']] = (entry['boxes'], entry['scores'])
+        return frames
+
+    def append(self, frame, boxes, scores):
+        """
+        Adds the detections of one frame and flushes them to disk.
+
+        Args:
+            frame (int): The frame number
+            boxes (list): Boxes in the form (x1, y1, x2, y2)
+            scores (list): The score of each box
+
+        Returns:
+            None
+        """
+        if self._file is None:
+            self._truncate_partial_line()
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps({'frame': frame,
+                                     'boxes': boxes,
+                                     'scores': scores}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _truncate_partial_line(self):
+        # Drop the tail of a line that was cut off by a crash, so the next
+        # entry starts on a line of its own.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def close(self):
+        """Closes the log file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
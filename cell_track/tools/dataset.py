@@ -0,0 +1,213 @@
+"""
+Long-format Parquet dataset with the tracks and spots of a run.
+
+The wide CSV files of a folder hold one column per well, padded with empty
+cells, and a single feature each. The dataset holds every feature of every
+track and spot as one row, in two tables under <out_folder>/acit_dataset:
+
+    tracks/lif=<lif>/folder=<folder>/well=<well>/<stack>.parquet
+    spots/lif=<lif>/folder=<folder>/well=<well>/<stack>.parquet
+
+Both are partitioned by LIF file, folder and well (hive style), so a reader
+only opens the files of the partitions it asks for, and Parquet is columnar,
+so only the columns it asks for are read:
+
+    >>> speeds = load_table('/data/results/acit_dataset', 'tracks',
+    ...                     columns=['well', 'track_id', 'mean_speed'],
+    ...                     filters=[('folder', '=', 'Group1'), ('filtered', '=', True)])
+
+A track row has the track features computed by TrackMate and the motility
+metrics of analytics.track_metrics(). A spot row has the position of a spot
+in microns and pixels. Rows are written per stack, in one call per table,
+so a stack that is tracked again replaces its own files only, and stacks
+whose files are newer than their XML file are skipped.
+
+pyarrow is needed to write or read the dataset, it is optional otherwise.
+"""
+import glob
+import os
+import re
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from cell_track.tools.analytics import (build_trajectories, parse_trackmate_xml,
+                                        track_metrics)
+from cell_track.tools.checkpoint import atomic_path
+
+DATASET_FOLDER = 'acit_dataset'
+
+# TrackMate track features kept in the tracks table, in the units of the XML
+# file. Features missing from a file are left empty, so all files of the
+# dataset have the same columns.
+TRACK_FEATURES = ['NUMBER_SPOTS', 'NUMBER_GAPS', 'LONGEST_GAP', 'TRACK_DURATION',
+                  'TRACK_START', 'TRACK_STOP', 'TRACK_DISPLACEMENT',
+                  'TRACK_X_LOCATION', 'TRACK_Y_LOCATION', 'TRACK_MEAN_SPEED',
+                  'TRACK_MAX_SPEED', 'TRACK_MIN_SPEED', 'TRACK_MEDIAN_SPEED',
+                  'TRACK_STD_SPEED', 'TOTAL_DISTANCE_TRAVELED',
+                  'MAX_DISTANCE_TRAVELED', 'CONFINMENT_RATIO', 'MEAN_STRAIGHT_LINE_SPEED',
+                  'LINEARITY_OF_FORWARD_PROGRESSION', 'MEAN_DIRECTIONAL_CHANGE_RATE']
+
+
+def dataset_available():
+    """Whether pyarrow is installed, so the dataset can be written."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def stack_name(xml_path):
+    """The name of the stack of a trackmate XML file, e.g. Well1-Pos001."""
+    name = os.path.basename(xml_path)
+    for ext in ('.trackmate.xml', '.xml', '.tif', '.zarr'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def well_name(xml_path):
+    """The well of a stack, e.g. Well1, or an empty string."""
+    match = re.search('(Well[0-9]*)', os.path.basename(xml_path))
+    return match.group(0) if match else ''
+
+
+def stack_tables(xml_path, parsed=None):
+    """
+    Builds the rows of a trackmate XML file.
+
+    Args:
+        xml_path (str): The trackmate XML file
+        parsed (dict): The file as from analytics.parse_trackmate_xml(), if
+            it was parsed already
+
+    Returns:
+        (pandas.DataFrame, pandas.DataFrame): The tracks table, one row per
+            track with the columns stack, track_id, filtered, the lower case
+            TRACK_FEATURES and the columns of analytics.track_metrics(); and
+            the spots table, one row per spot of a track with the columns
+            stack, track_id, filtered, frame, t, x, y (microns) and x_px, y_px.
+    """
+    parsed = parsed or parse_trackmate_xml(xml_path)
+    trajectories, names = build_trajectories(parsed, filtered_only=False)
+    image_data = parsed['image_data']
+    pixel_size = float(image_data.get('pixelwidth', 1.0))
+    stack = stack_name(xml_path)
+
+    track_ids = np.array(names, dtype=np.int64)
+    filtered = np.array([name in parsed['filtered'] for name in names], dtype=bool)
+    tracks = pd.DataFrame({'stack': stack, 'track_id': track_ids, 'filtered': filtered},
+                          columns=['stack', 'track_id', 'filtered'])
+    attributes = [track[0] for track in parsed['tracks']]
+    for feature in TRACK_FEATURES:
+        tracks[feature.lower()] = pd.to_numeric(
+            pd.Series([attrib.get(feature) for attrib in attributes], dtype=object),
+            errors='coerce').astype(np.float64).values
+    metrics = track_metrics(trajectories).reindex(np.arange(len(names)))
+    for column in metrics.columns:
+        tracks[column] = metrics[column].values
+
+    spots = pd.DataFrame({'stack': stack,
+                          'track_id': track_ids[trajectories.track_id],
+                          'filtered': filtered[trajectories.track_id],
+                          'frame': trajectories.frame,
+                          't': trajectories.t,
+                          'x': trajectories.x,
+                          'y': trajectories.y,
+                          'x_px': trajectories.x / pixel_size,
+                          'y_px': trajectories.y / pixel_size},
+                         columns=['stack', 'track_id', 'filtered', 'frame', 't',
+                                  'x', 'y', 'x_px', 'y_px'])
+    return tracks, spots
+
+
+def partition_path(root, table, lif, folder, well):
+    """The folder of a partition of a table, with the values URI encoded."""
+    return os.path.join(root, table, 'lif=' + quote(lif, safe=''),
+                        'folder=' + quote(folder, safe=''),
+                        'well=' + quote(well, safe=''))
+
+
+def write_stack(root, xml_path, lif, folder):
+    """
+    Writes the tracks and spots of a trackmate XML file to the dataset,
+    replacing those written for the stack before.
+
+    Args:
+        root (str): The dataset folder
+        xml_path (str): The trackmate XML file
+        lif (str): The LIF file of the stack
+        folder (str): The folder of the stack, relative to the output folder
+            of the LIF file
+
+    Returns:
+        (int, int): The number of tracks and spots written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = stack_tables(xml_path)
+    for table, frame in zip(('tracks', 'spots'), tables):
+        out_folder = partition_path(root, table, lif, folder, well_name(xml_path))
+        os.makedirs(out_folder, exist_ok=True)
+        path = os.path.join(out_folder, stack_name(xml_path) + '.parquet')
+        tmp_path = atomic_path(path)
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+    return len(tables[0]), len(tables[1])
+
+
+def stack_is_current(root, xml_path, lif, folder):
+    """Whether both tables of a stack were written after its XML file was."""
+    xml_mtime = os.path.getmtime(xml_path)
+    for table in ('tracks', 'spots'):
+        path = os.path.join(partition_path(root, table, lif, folder, well_name(xml_path)),
+                            stack_name(xml_path) + '.parquet')
+        if not os.path.exists(path) or os.path.getmtime(path) < xml_mtime:
+            return False
+    return True
+
+
+def write_folder(root, folder_path, lif, folder, overwrite=False):
+    """
+    Writes the tracks and spots of all trackmate XML files in a folder to
+    the dataset, see write_stack(). Stacks that were written after their XML
+    file was are skipped, unless overwrite.
+
+    Returns:
+        (int, int): The number of tracks and spots written
+    """
+    n_tracks, n_spots = 0, 0
+    for xml_path in sorted(glob.glob(os.path.join(folder_path, '*trackmate.xml'))):
+        if not overwrite and stack_is_current(root, xml_path, lif, folder):
+            continue
+        tracks, spots = write_stack(root, xml_path, lif, folder)
+        n_tracks += tracks
+        n_spots += spots
+    return n_tracks, n_spots
+
+
+def load_table(root, table='tracks', columns=None, filters=None):
+    """
+    Loads a table of the dataset.
+
+    Args:
+        root (str): The dataset folder
+        table (str): 'tracks' or 'spots'
+        columns (list): The columns to read, including the partition columns
+            lif, folder and well; all columns by default
+        filters (list): Row filters in the pyarrow.parquet form, e.g.
+            [('well', '=', 'Well1')]. Filters on the partition columns skip
+            the files of the other partitions.
+
+    Returns:
+        pandas.DataFrame: The rows
+    """
+    import pyarrow.parquet as pq
+
+    if table not in ('tracks', 'spots'):
+        raise ValueError('Unknown table: ' + str(table))
+    data = pq.read_table(os.path.join(root, table), columns=columns, filters=filters)
+    return data.to_pandas()
@@ -0,0 +1,298 @@
+"""
+Linking of detected spots into tracks in Python, without ImageJ.
+
+This does what the TrackMate script in cell_track/ImageJ does with the XML
+files written by track_image: spots are linked frame to frame, track segments
+are joined over gaps of a few frames, the track features used downstream are
+computed, and the tracks are filtered. The result is written as a
+.trackmate.xml file that Track, process_imagestack() and drawTrackmateVideo()
+read like the one TrackMate writes.
+
+TrackMate solves the linking as a linear assignment problem. Here the links
+are assigned greedily, shortest first, which gives the same links unless
+cells come within the linking distance of each other. Tracks do not split or
+merge; TrackMate's tracks with splits are removed by the NUMBER_SPLITS filter
+anyway. It is meant for when Fiji is not available, e.g. for benchmarks and
+parameter sweeps, not as a replacement.
+"""
+import math
+import os
+import statistics
+from xml.etree import ElementTree as ET
+
+import numpy as np
+
+from cell_track.tools.checkpoint import atomic_write
+
+# The tracker settings of the TrackMate script
+LINKING_MAX_DISTANCE = 40.0
+GAP_CLOSING_MAX_DISTANCE = 30.0
+MAX_FRAME_GAP = 4
+# The track filters of the TrackMate script, (feature, value, is_above)
+TRACK_FILTERS = (('NUMBER_SPOTS', 31, True), ('NUMBER_SPLITS', 0.5, False))
+
+
+def read_spots(root):
+    """
+    Reads the spots of a TrackMate XML tree.
+
+    Args:
+        root (xml.etree.ElementTree.Element): The root of the XML tree
+
+    Returns:
+        dict: frame: list of (id, x, y, t, quality) of the spots in the frame
+    """
+    frames = {}
+    for spots_in_frame in root.findall('Model/AllSpots/SpotsInFrame'):
+        frame = int(spots_in_frame.get('frame'))
+        frames[frame] = [(spot.get('ID'), float(spot.get('POSITION_X')),
+                          float(spot.get('POSITION_Y')),
+                          float(spot.get('POSITION_T', frame)),
+                          float(spot.get('QUALITY', 0)))
+                         for spot in spots_in_frame.findall('Spot')]
+    return frames
+
+
+def _greedy_pairs(sources, targets, max_distance):
+    """
+    Pairs sources with targets, shortest distance first.
+
+    Args:
+        sources (numpy.ndarray): (n, 2) positions
+        targets (numpy.ndarray): (m, 2) positions
+        max_distance (float): Longest allowed distance
+
+    Returns:
+        list: (source index, target index, distance)
+    """
+    if not len(sources) or not len(targets):
+        return []
+    distances = np.hypot(sources[:, np.newaxis, 0] - targets[np.newaxis, :, 0],
+                         sources[:, np.newaxis, 1] - targets[np.newaxis, :, 1])
+    candidates = np.argwhere(distances <= max_distance)
+    order = np.argsort(distances[candidates[:, 0], candidates[:, 1]], kind='stable')
+    used_sources, used_targets, pairs = set(), set(), []
+    for source, target in candidates[order]:
+        if source in used_sources or target in used_targets:
+            continue
+        used_sources.add(source)
+        used_targets.add(target)
+        pairs.append((int(source), int(target), float(distances[source, target])))
+    return pairs
+
+
+def link_spots(frames, linking_max_distance=LINKING_MAX_DISTANCE,
+               gap_closing_max_distance=GAP_CLOSING_MAX_DISTANCE,
+               max_frame_gap=MAX_FRAME_GAP):
+    """
+    Links spots into tracks.
+
+    Args:
+        frames (dict): frame: list of spots, as from read_spots()
+        linking_max_distance (float): Longest link between consecutive frames
+        gap_closing_max_distance (float): Longest link over a gap
+        max_frame_gap (int): Largest frame difference of a link over a gap
+
+    Returns:
+        list: Tracks, each a list of (frame, spot) in order of frame, with
+            at least two spots
+    """
+    # Frame to frame: each segment is a list of (frame, spot)
+    segments = []
+    open_segments = {}  # index in the previous frame: segment
+    previous_frame, previous_spots = None, []
+    for frame in sorted(frames):
+        spots = frames[frame]
+        next_open = {}
+        if previous_frame is not None and frame == previous_frame + 1:
+            pairs = _greedy_pairs(np.array([s[1:3] for s in previous_spots]).reshape(-1, 2),
+                                  np.array([s[1:3] for s in spots]).reshape(-1, 2),
+                                  linking_max_distance)
+            for source, target, distance in pairs:
+                segment = open_segments[source]
+                segment.append((frame, spots[target]))
+                next_open[target] = segment
+        for index, spot in enumerate(spots):
+            if index not in next_open:
+                segment = [(frame, spot)]
+                segments.append(segment)
+                next_open[index] = segment
+        open_segments = next_open
+        previous_frame, previous_spots = frame, spots
+
+    # Gap closing: join segment ends to segment starts a few frames later
+    if max_frame_gap >= 2 and len(segments) > 1:
+        ends = np.array([segment[-1][1][1:3] for segment in segments])
+        starts = np.array([segment[0][1][1:3] for segment in segments])
+        end_frames = np.array([segment[-1][0] for segment in segments])
+        start_frames = np.array([segment[0][0] for segment in segments])
+        gaps = start_frames[np.newaxis, :] - end_frames[:, np.newaxis]
+        distances = np.hypot(ends[:, np.newaxis, 0] - starts[np.newaxis, :, 0],
+                             ends[:, np.newaxis, 1] - starts[np.newaxis, :, 1])
+        allowed = (gaps >= 2) & (gaps <= max_frame_gap) & \
+            (distances <= gap_closing_max_distance)
+        candidates = np.argwhere(allowed)
+        order = np.argsort(distances[candidates[:, 0], candidates[:, 1]], kind='stable')
+        following = {}
+        used_starts = set()
+        for end, start in candidates[order]:
+            if end in following or start in used_starts:
+                continue
+            following[int(end)] = int(start)
+            used_starts.add(start)
+        tracks = []
+        for index, segment in enumerate(segments):
+            if index in used_starts:
+                continue  # part of an earlier track
+            track = list(segment)
+            while index in following:
+                index = following[index]
+                track.extend(segments[index])
+            tracks.append(track)
+    else:
+        tracks = segments
+    return [track for track in tracks if len(track) > 1]
+
+
+def track_features(track, track_id):
+    """
+    Computes the TrackMate track features of a track.
+
+    Distances are in the units of the spot positions, speeds in those units
+    per unit of POSITION_T, as TrackMate computes them.
+
+    Args:
+        track (list): (frame, spot) in order of frame, as from link_spots()
+        track_id (int): The ID of the track
+
+    Returns:
+        dict: feature: value
+    """
+    positions = [(spot[1], spot[2]) for frame, spot in track]
+    times = [spot[3] for frame, spot in track]
+    qualities = [spot[4] for frame, spot in track]
+    frame_steps = [b[0] - a[0] for a, b in zip(track[:-1], track[1:])]
+    steps = [math.hypot(x2 - x1, y2 - y1)
+             for (x1, y1), (x2, y2) in zip(positions[:-1], positions[1:])]
+    speeds = [step / (t2 - t1) if t2 != t1 else 0.0
+              for step, t1, t2 in zip(steps, times[:-1], times[1:])]
+    x0, y0 = positions[0]
+    displacement = math.hypot(positions[-1][0] - x0, positions[-1][1] - y0)
+    total = sum(steps)
+    return {
+        'TRACK_ID': track_id, 'TRACK_INDEX': track_id,
+        'NUMBER_SPOTS': len(track),
+        'NUMBER_GAPS': sum(step > 1 for step in frame_steps),
+        'LONGEST_GAP': max(frame_steps) - 1,
+        'NUMBER_SPLITS': 0, 'NUMBER_MERGES': 0, 'NUMBER_COMPLEX': 0,
+        'TRACK_DURATION': times[-1] - times[0],
+        'TRACK_START': times[0], 'TRACK_STOP': times[-1],
+        'TRACK_DISPLACEMENT': displacement,
+        'TRACK_X_LOCATION': statistics.mean(x for x, y in positions),
+        'TRACK_Y_LOCATION': statistics.mean(y for x, y in positions),
+        'TRACK_Z_LOCATION': 0.0,
+        'TRACK_MEAN_SPEED': statistics.mean(speeds),
+        'TRACK_MAX_SPEED': max(speeds),
+        'TRACK_MIN_SPEED': min(speeds),
+        'TRACK_MEDIAN_SPEED': statistics.median(speeds),
+        'TRACK_STD_SPEED': statistics.pstdev(speeds),
+        'TRACK_MEAN_QUALITY': statistics.mean(qualities),
+        'TRACK_MAX_QUALITY': max(qualities),
+        'TRACK_MIN_QUALITY': min(qualities),
+        'TRACK_MEDIAN_QUALITY': statistics.median(qualities),
+        'TRACK_STD_QUALITY': statistics.pstdev(qualities),
+        'TOTAL_DISTANCE_TRAVELED': total,
+        'MAX_DISTANCE_TRAVELED': max(math.hypot(x - x0, y - y0) for x, y in positions),
+        'CONFINMENT_RATIO': displacement / total if total > 0 else 0.0,
+    }
+
+
+def passes_filters(features, filters=TRACK_FILTERS):
+    """
+    Applies TrackMate feature filters: a track passes a filter
+    (feature, value, is_above) if its feature is >= value for is_above, and
+    <= value otherwise.
+    """
+    for feature, value, is_above in filters:
+        if (features[feature] < value) if is_above else (features[feature] > value):
+            return False
+    return True
+
+
+def _format(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def link_xml(xml_path, out_path=None, linking_max_distance=LINKING_MAX_DISTANCE,
+             gap_closing_max_distance=GAP_CLOSING_MAX_DISTANCE,
+             max_frame_gap=MAX_FRAME_GAP, filters=TRACK_FILTERS):
+    """
+    Tracks the spots of an XML file written by track_image, like the
+    TrackMate script does.
+
+    Args:
+        xml_path (str): The XML file with the detected spots, '<stack>.xml'
+        out_path (str): Where to write the result, defaults to
+            '<stack>.trackmate.xml'
+        linking_max_distance (float): See link_spots()
+        gap_closing_max_distance (float): See link_spots()
+        max_frame_gap (int): See link_spots()
+        filters (tuple): Track filters, see passes_filters()
+
+    Returns:
+        str: The path of the .trackmate.xml file
+    """
+    if out_path is None:
+        out_path = xml_path[:-len('.xml')] + '.trackmate.xml'
+    tree = ET.parse(xml_path)
+    root = tree.getroot()
+    model = root.find('Model')
+    tracks = link_spots(read_spots(root), linking_max_distance,
+                        gap_closing_max_distance, max_frame_gap)
+
+    for tag in ('AllTracks', 'FilteredTracks'):
+        old = model.find(tag)
+        if old is not None:
+            model.remove(old)
+    all_tracks = ET.SubElement(model, 'AllTracks')
+    filtered_tracks = ET.SubElement(model, 'FilteredTracks')
+    for track_id, track in enumerate(tracks):
+        features = track_features(track, track_id)
+        track_element = ET.SubElement(all_tracks, 'Track', name='Track_' + str(track_id),
+                                      **{key: _format(value) for key, value in features.items()})
+        for (frame1, spot1), (frame2, spot2) in zip(track[:-1], track[1:]):
+            distance = math.hypot(spot2[1] - spot1[1], spot2[2] - spot1[2])
+            dt = spot2[3] - spot1[3]
+            ET.SubElement(track_element, 'Edge', SPOT_SOURCE_ID=spot1[0],
+                          SPOT_TARGET_ID=spot2[0], LINK_COST=repr(distance ** 2),
+                          EDGE_TIME=repr((spot1[3] + spot2[3]) / 2),
+                          EDGE_X_LOCATION=repr((spot1[1] + spot2[1]) / 2),
+                          EDGE_Y_LOCATION=repr((spot1[2] + spot2[2]) / 2),
+                          EDGE_Z_LOCATION='0.0',
+                          VELOCITY=repr(distance / dt if dt else 0.0),
+                          DISPLACEMENT=repr(distance))
+        if passes_filters(features, filters):
+            ET.SubElement(filtered_tracks, 'TrackID', TRACK_ID=str(track_id))
+
+    with atomic_write(out_path, 'wb') as f:
+        tree.write(f, encoding='UTF-8', xml_declaration=True)
+    return out_path
+
+
+def link_folder(root_folder):
+    """
+    Tracks every XML file written by track_image in the subfolders of
+    root_folder, and removes them afterwards, like the TrackMate script.
+
+    Returns:
+        list: Paths of the .trackmate.xml files
+    """
+    written = []
+    for folder, subfolders, files in os.walk(root_folder):
+        for name in sorted(files):
+            if name.endswith('.xml') and not (name.endswith('trackmate.xml') or
+                                              name.endswith('ISBI.xml')):
+                xml_path = os.path.join(folder, name)
+                written.append(link_xml(xml_path))
+                os.remove(xml_path)
+    return written
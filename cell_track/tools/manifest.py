@@ -0,0 +1,277 @@
+"""
+Run manifest, recording the state of every stage of every image series.
+
+The manifest is a SQLite database in the output folder. For each
+(lif, series, stage) it stores the hash of the stage's input, the model
+hash, the parameters, the timings and the status. The orchestrator asks it
+what still has to be done instead of walking the output tree, and a stage
+is only run again when something it depends on has changed.
+
+Each stage works on the output of the stage in DEPENDS. When a stage is run
+with a different input, model or parameters than last time, the records of
+the stages that depend on it are dropped, so they are run again as well.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+MANIFEST_NAME = 'acit_manifest.sqlite'
+STAGES = ('detect', 'track', 'csv', 'video')
+# The stage whose output each stage works on
+DEPENDS = {'track': 'detect', 'csv': 'track', 'video': 'track'}
+
+
+def downstream_stages(stage):
+    """Returns the stage and all stages that depend on it, directly or not."""
+    stages = [stage]
+    for later in STAGES:
+        if DEPENDS.get(later) in stages:
+            stages.append(later)
+    return tuple(stages)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    lif TEXT NOT NULL,
+    series TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    input_hash TEXT NOT NULL DEFAULT '',
+    model_hash TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL DEFAULT '{}',
+    started REAL,
+    finished REAL,
+    duration REAL,
+    PRIMARY KEY (lif, series, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_by_status ON stages (lif, stage, status);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT
+);
+"""
+
+
+def file_fingerprint(path, block_size=1024 * 1024):
+    """
+    Cheap fingerprint of a (large) file.
+
+    Hashes the size, the first and the last block of the file. This changes
+    whenever a LIF file is replaced or appended to, without reading it all.
+
+    Args:
+        path (str): Path to the file
+        block_size (int): Number of bytes hashed at each end
+
+    Returns:
+        str: Hex digest
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def params_hash(params):
+    """Stable string for a dict of parameters."""
+    return json.dumps(params or {}, sort_keys=True)
+
+
+class RunManifest:
+    """
+    SQLite backed record of the pipeline stages in an output folder.
+
+    Args:
+        out_folder (str): The output folder of the run. The database is
+            created there as MANIFEST_NAME.
+
+    Examples:
+        >>> manifest = RunManifest(out_folder)
+        >>> state = manifest.check(lif, series, 'detect', lif_hash, model_hash)
+        >>> if state != 'current':
+        >>>     with manifest.run(lif, series, 'detect', lif_hash, model_hash):
+        >>>         ...
+        >>> manifest.pending('track', lif)
+    """
+    def __init__(self, out_folder):
+        if not os.path.exists(out_folder):
+            os.makedirs(out_folder)
+        self.path = os.path.join(out_folder, MANIFEST_NAME)
+        self._db = sqlite3.connect(self.path, timeout=60)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        """Closes the database connection."""
+        self._db.close()
+
+    def model_hash(self, model_path):
+        """
+        md5 of a model file. The hash is cached by path, size and mtime, so
+        the 149 MB model is only read when it changes.
+
+        Args:
+            model_path (str): Path to the model file
+
+        Returns:
+            str: Hex digest
+        """
+        stat = os.stat(model_path)
+        path = os.path.abspath(model_path)
+        row = self._db.execute('SELECT size, mtime_ns, hash FROM file_hashes '
+                               'WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = hashlib.md5()
+        with open(model_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        self._db.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                         (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+        self._db.commit()
+        return digest.hexdigest()
+
+    def get(self, lif, series, stage):
+        """
+        Returns the record of a stage as a dict, or None if there is none.
+        """
+        cursor = self._db.execute('SELECT * FROM stages WHERE lif = ? AND '
+                                  'series = ? AND stage = ?', (lif, series, stage))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def check(self, lif, series, stage, input_hash='', model_hash='', params=None):
+        """
+        Compares a stage with what was recorded for it.
+
+        If the stage was done with other inputs, it and all stages of the
+        series that depend on it are invalidated.
+
+        Args:
+            lif (str): Name of the LIF file
+            series (str): Path of the series in the LIF file
+            stage (str): One of STAGES
+            input_hash (str): Hash of the input of the stage
+            model_hash (str): Hash of the model, for the detect stage
+            params (dict): Parameters that affect the output of the stage
+
+        Returns:
+            str: 'current' if the stage is done with the same inputs, 'stale'
+                if it was done with different inputs, and 'new' if it was
+                never finished.
+        """
+        record = self.get(lif, series, stage)
+        if record is None or record['status'] != 'done':
+            return 'new'
+        if (record['input_hash'] == input_hash and
+                record['model_hash'] == model_hash and
+                record['params'] == params_hash(params)):
+            return 'current'
+        self.invalidate(lif, series, stage)
+        return 'stale'
+
+    def invalidate(self, lif, series, stage):
+        """Drops the records of a stage and of all stages depending on it."""
+        later = downstream_stages(stage)
+        self._db.execute('DELETE FROM stages WHERE lif = ? AND series = ? AND '
+                         'stage IN (%s)' % ','.join('?' * len(later)),
+                         (lif, series) + later)
+        self._db.commit()
+
+    def start(self, lif, series, stage, input_hash='', model_hash='', params=None):
+        """Records that a stage was started."""
+        self._db.execute('INSERT OR REPLACE INTO stages (lif, series, stage, '
+                         'status, input_hash, model_hash, params, started) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (lif, series, stage, 'running', input_hash,
+                          model_hash, params_hash(params), time.time()))
+        self._db.commit()
+
+    def finish(self, lif, series, stage, status='done'):
+        """Records that a stage was finished, with status 'done' or 'failed'."""
+        now = time.time()
+        self._db.execute('UPDATE stages SET status = ?, finished = ?, '
+                         'duration = ? - COALESCE(started, ?) WHERE lif = ? '
+                         'AND series = ? AND stage = ?',
+                         (status, now, now, now, lif, series, stage))
+        self._db.commit()
+
+    def mark_done(self, lif, series, stage, input_hash='', model_hash='', params=None):
+        """Records a stage as done without timing it, e.g. for existing outputs."""
+        self.start(lif, series, stage, input_hash, model_hash, params)
+        self.finish(lif, series, stage)
+
+    @contextmanager
+    def run(self, lif, series, stage, input_hash='', model_hash='', params=None):
+        """
+        Context manager recording the start, end and outcome of a stage.
+
+        The stage is recorded as 'failed' if an exception is raised.
+        """
+        self.start(lif, series, stage, input_hash, model_hash, params)
+        try:
+            yield
+        except BaseException:
+            self.finish(lif, series, stage, status='failed')
+            raise
+        self.finish(lif, series, stage)
+
+    def upstream_hash(self, lif, series, stage):
+        """
+        Hash to use as input_hash of the stages that depend on this one.
+
+        It changes whenever this stage is redone with different inputs.
+
+        Returns:
+            str: Hex digest, or '' if the stage is not done
+        """
+        record = self.get(lif, series, stage)
+        if record is None or record['status'] != 'done':
+            return ''
+        key = '|'.join([record['input_hash'], record['model_hash'], record['params']])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def series(self, lif, stage, status='done'):
+        """
+        Lists the series of a LIF file that have a stage in the given status.
+
+        Returns:
+            list: Series paths
+        """
+        rows = self._db.execute('SELECT series FROM stages WHERE lif = ? AND '
+                                'stage = ? AND status = ? ORDER BY series',
+                                (lif, stage, status))
+        return [row[0] for row in rows]
+
+    def pending(self, stage, lif):
+        """
+        Lists the series for which the stage this one depends on is done, but
+        this stage is not (or was done with the output of an earlier run of
+        the stage it depends on).
+
+        Args:
+            stage (str): One of STAGES, except 'detect'
+            lif (str): Name of the LIF file
+
+        Returns:
+            list: Series paths
+        """
+        previous = DEPENDS[stage]
+        pending = []
+        for series in self.series(lif, previous):
+            record = self.get(lif, series, stage)
+            if (record is None or record['status'] != 'done' or
+                    record['input_hash'] != self.upstream_hash(lif, series, previous)):
+                pending.append(series)
+        return pending
@@ -0,0 +1,122 @@
+"""
+Memory accounting, and the memory budget of --max-memory.
+
+On Linux the resident memory (RSS) and its peak are read from /proc, and the
+peak is reset at the start of every stage, so each stage gets its own peak.
+Elsewhere only the peak of the whole process is known, from the resource
+module, or on Windows from psutil if it is installed (0 otherwise).
+"""
+import os
+import re
+import sys
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(text):
+    """
+    Parses a size like '512M', '8G' or '8GB' to bytes.
+
+    Raises:
+        ValueError: If the size can not be parsed
+    """
+    match = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$', str(text), re.IGNORECASE)
+    if match is None:
+        raise ValueError('Can not parse memory size: ' + str(text))
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def _lifetime_peak_rss():
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return 0
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Resident memory of this process in bytes (the peak so far if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return _lifetime_peak_rss()
+
+
+def peak_rss():
+    """Peak resident memory in bytes, since the last reset_peak_rss()."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _lifetime_peak_rss()
+
+
+def reset_peak_rss():
+    """
+    Resets the peak of peak_rss() to the current RSS (Linux only).
+
+    Returns:
+        bool: False if the peak could not be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class MemoryBudget:
+    """
+    A limit on the memory of the pipeline, see --max-memory.
+
+    With a budget, the stages use their streaming variants, which keep only
+    a few frames in memory, and concurrent workers are limited to what fits
+    in the memory still free under the limit.
+
+    Args:
+        limit (int or str): The limit in bytes, or a size like '8G'
+
+    Examples:
+        >>> budget = MemoryBudget('8G')
+        >>> workers = budget.workers(frame_bytes, 4)
+    """
+    def __init__(self, limit):
+        self.limit = parse_size(limit) if isinstance(limit, str) else int(limit)
+
+    def headroom(self):
+        """Bytes left under the limit."""
+        return self.limit - current_rss()
+
+    def workers(self, bytes_per_worker, requested):
+        """
+        Number of workers that fit in the headroom, at least 1.
+
+        Args:
+            bytes_per_worker (int): Memory each worker holds
+            requested (int): The number of workers wanted
+
+        Returns:
+            int: Between 1 and requested
+        """
+        if bytes_per_worker <= 0:
+            return requested
+        return max(1, min(requested, self.headroom() // bytes_per_worker))
+
+    def check(self, stage):
+        """Warns if the peak memory of a stage went over the limit."""
+        peak = peak_rss()
+        if peak > self.limit:
+            print('Warning: %s used %.0f MB, more than the --max-memory limit of %.0f MB'
+                  % (stage, peak / 1024 ** 2, self.limit / 1024 ** 2))
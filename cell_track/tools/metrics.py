@@ -0,0 +1,299 @@
+"""
+Timing and throughput metrics of the pipeline stages.
+
+The stages record into the module level registry METRICS:
+
+    >>> from cell_track.tools.metrics import METRICS
+    >>> with METRICS.timer('detect.inference'):
+    >>>     model.predict_on_batch(batch)
+    >>> METRICS.count('detect.frames')
+
+Timers and observe() feed histograms, count() feeds counters, and memory()
+records the memory use of a stage. At the end of a
+run the registry is written as a JSON summary, and optionally as a Prometheus
+textfile (for node_exporter's textfile collector), so runs can be compared
+and graphed. Metric names are '<stage>.<step>', e.g. 'detect.decode'.
+"""
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from cell_track.tools.checkpoint import atomic_write
+from cell_track.tools.memory import current_rss, peak_rss, reset_peak_rss
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0,
+           float('inf'))
+
+
+class Histogram:
+    """
+    Count, sum, min, max and bucket counts of observed values.
+
+    Attributes:
+        count (int): Number of values
+        sum (float): Sum of the values
+        min (float): Smallest value
+        max (float): Largest value
+        buckets (list): Number of values <= each of BUCKETS
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        """Adds a value."""
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def merge(self, other):
+        """Adds the values of another Histogram."""
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def summary(self):
+        """Returns the histogram as a dict."""
+        if not self.count:
+            return {'count': 0, 'sum': 0.0}
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count,
+                'min': self.min, 'max': self.max}
+
+
+class Metrics:
+    """
+    Registry of counters and histograms. It is safe to use from several threads.
+
+    Attributes:
+        counters (dict): name: value
+        histograms (dict): name: Histogram
+        memory_stats (dict): stage: memory use, see memory()
+        started (float): time.time() when the registry was (re)set
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops all recorded values, e.g. at the start of a run."""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.memory_stats = {}
+            self.started = time.time()
+
+    def count(self, name, value=1):
+        """Adds value to the counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Adds value to the histogram name."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def merge(self, counters, histograms):
+        """
+        Adds the counters and histograms of another Metrics, e.g. of a worker
+        process. The throughput of a stage is then that of a single worker.
+        """
+        with self._lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in histograms.items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager observing the seconds its block took in the histogram name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def memory(self, stage, trace=False):
+        """
+        Context manager recording the memory use of a stage: the RSS at its
+        start and end and its peak RSS, in MB. If the peak can not be reset
+        (not on Linux), it is the peak of the process so far.
+
+        With trace, the peak of the memory allocated by Python and the lines
+        that allocated the most are recorded too, using tracemalloc. This
+        slows the stage down.
+        """
+        own_peak = reset_peak_rss()
+        stats = {'rss_start_mb': current_rss() / 1024 ** 2}
+        if trace:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.clear_traces()
+        try:
+            yield
+        finally:
+            stats['rss_end_mb'] = current_rss() / 1024 ** 2
+            stats['rss_peak_mb'] = peak_rss() / 1024 ** 2
+            stats['peak_is_process_peak'] = not own_peak
+            if trace:
+                stats['python_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+                stats['top_allocations'] = ['%s: %.1f MB' % (stat.traceback, stat.size / 1024 ** 2)
+                                            for stat in top]
+                if started_tracing:
+                    tracemalloc.stop()
+            with self._lock:
+                self.memory_stats[stage] = stats
+
+    def timed_iter(self, iterable, name):
+        """
+        Iterates over iterable, observing the time each item took to produce.
+
+        Useful for lazily decoded frames, e.g. timed_iter(frames, 'detect.decode').
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def summary(self):
+        """
+        Summary of the run, with the throughput of every stage.
+
+        The throughput of a stage is <stage>.frames divided by the total time of
+        its timers.
+
+        Returns:
+            dict: With keys 'started', 'duration', 'counters', 'timers',
+                'frames_per_second' and 'memory'
+        """
+        with self._lock:
+            timers = {name: histogram.summary()
+                      for name, histogram in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+            memory = dict(self.memory_stats)
+        fps = {}
+        for name, frames in counters.items():
+            stage, _, what = name.partition('.')
+            seconds = sum(timer['sum'] for timer_name, timer in timers.items()
+                          if timer_name.startswith(stage + '.'))
+            if what == 'frames' and seconds > 0:
+                fps[stage] = frames / seconds
+        return {'started': self.started, 'duration': time.time() - self.started,
+                'counters': counters, 'timers': timers, 'frames_per_second': fps,
+                'memory': memory}
+
+    def write_json(self, path):
+        """Writes summary() to a JSON file."""
+        with atomic_write(path) as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_prometheus(self, path, prefix='acit_'):
+        """
+        Writes the metrics in the Prometheus text format.
+
+        Counters become '<prefix><name>_total' and timers become histograms
+        '<prefix><name>_seconds', with the dots in names replaced by
+        underscores. The file is replaced atomically, as node_exporter's
+        textfile collector requires.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = prefix + name.replace('.', '_') + '_total'
+                lines += ['# TYPE ' + metric + ' counter', metric + ' ' + repr(value)]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = prefix + name.replace('.', '_') + '_seconds'
+                lines.append('# TYPE ' + metric + ' histogram')
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(metric + '_bucket{le="' + le + '"} ' + str(count))
+                lines += [metric + '_sum ' + repr(histogram.sum),
+                          metric + '_count ' + str(histogram.count)]
+            for stage, stats in sorted(self.memory_stats.items()):
+                metric = prefix + stage + '_peak_rss_bytes'
+                lines += ['# TYPE ' + metric + ' gauge',
+                          metric + ' ' + str(int(stats['rss_peak_mb'] * 1024 ** 2))]
+        with atomic_write(path) as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+# The registry the pipeline records into
+METRICS = Metrics()
+
+
+class Progress:
+    """
+    A single console line showing the progress of a stage.
+
+    On a terminal the line is rewritten in place. Otherwise, e.g. when the
+    output goes to a log file, a line is printed every 10 percent.
+
+    Args:
+        label (str): What is being processed
+        total (int): Number of items, e.g. frames
+        unit (str): Name of the items
+    """
+    def __init__(self, label, total, unit='frames'):
+        self.label = label
+        self.total = max(int(total), 1)
+        self.unit = unit
+        self.done = 0
+        self.extra = ''
+        self._start = time.time()
+        self._last_step = -1
+        self._tty = sys.stdout.isatty()
+
+    def update(self, done=None, extra=''):
+        """
+        Shows the progress.
+
+        Args:
+            done (int): Number of items done, defaults to one more than before
+            extra (str): Shown after the rate, e.g. '812 cells'
+        """
+        self.done = self.done + 1 if done is None else done
+        self.extra = extra
+        step = 10 * self.done // self.total
+        if self._tty:
+            sys.stdout.write('\r' + self._line())
+            sys.stdout.flush()
+        elif step != self._last_step and self.done < self.total:
+            print(self._line())  # the last line is printed by close()
+        self._last_step = step
+
+    def _line(self):
+        elapsed = time.time() - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = '%s: %d/%d %s, %.2f %s/s' % (self.label, self.done, self.total,
+                                            self.unit, rate, self.unit)
+        return line + (', ' + self.extra if self.extra else '')
+
+    def close(self):
+        """Ends the line, with the total time."""
+        line = self._line() + ', %.1f s' % (time.time() - self._start)
+        if self._tty:
+            sys.stdout.write('\r' + line + '\n')
+        else:
+            print(line)
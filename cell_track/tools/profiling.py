@@ -0,0 +1,202 @@
+"""
+Profiling of the pipeline stages, for --profile.
+
+Every stage run inside StageProfiler.stage() is profiled twice at once:
+
+    <stage>.prof       cProfile dump, for pstats, snakeviz, etc.
+    <stage>.txt        The 40 functions with the most cumulative time
+    <stage>.collapsed  Stacks sampled every few milliseconds in the collapsed
+                       format of flamegraph.pl, speedscope and inferno
+
+cProfile counts every Python call exactly, but slows down code with many
+small calls, like filter_boxes or the XML building. The sampled stacks are
+not slowed down, and show time spent in C code (PIL, numpy, cv2, waiting for
+ffmpeg or ImageJ) under the Python function that called it.
+
+For the inference step, TimelineModel records the tensorflow timeline of the
+first calls of the model, which can be opened in chrome://tracing.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of a thread at a fixed interval.
+
+    Samples accumulate over several start()/stop() periods.
+
+    Args:
+        interval (float): Seconds between two samples
+        thread_id (int): The thread to sample, defaults to the thread that
+            calls start()
+
+    Attributes:
+        stacks (collections.Counter): Number of samples of each stack, as
+            'outermost;...;innermost' frame names
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts sampling in a background thread."""
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        """Writes the stacks in the collapsed ('stack count' per line) format."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(stack + ' ' + str(count) + '\n')
+
+
+class StageProfiler:
+    """
+    Profiles named pipeline stages, see the module documentation.
+
+    Profiles of a stage that is run several times, e.g. in --watch mode,
+    accumulate, and the files are rewritten after every run.
+
+    Args:
+        out_dir (str): Where to write the profiles. Profiling is disabled if
+            this is None, and stage() does nothing.
+        interval (float): Seconds between two stack samples
+
+    Examples:
+        >>> profiler = StageProfiler('/data/results/acit_profile')
+        >>> with profiler.stage('video'):
+        >>>     drawTrackmateVideo(stack_path, csv_path)
+    """
+    def __init__(self, out_dir=None, interval=0.005):
+        self.out_dir = out_dir
+        self.interval = interval
+        self._profiles = {}
+        self._samplers = {}
+        if out_dir is not None and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+    @property
+    def enabled(self):
+        return self.out_dir is not None
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager profiling its block as the stage name."""
+        if not self.enabled:
+            yield
+            return
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        sampler = self._samplers.setdefault(name, SamplingProfiler(self.interval))
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            self._dump(name)
+
+    def _dump(self, name):
+        path = os.path.join(self.out_dir, name)
+        self._profiles[name].dump_stats(path + '.prof')
+        with open(path + '.txt', 'w') as f:
+            stats = pstats.Stats(self._profiles[name], stream=f)
+            stats.sort_stats('cumulative').print_stats(40)
+        self._samplers[name].write_collapsed(path + '.collapsed')
+        print('Profile of ' + name + ' written to ' + path + '.prof/.txt/.collapsed')
+
+    def wrap_model(self, model, max_traces=3):
+        """
+        Returns the model, wrapped in a TimelineModel if profiling is enabled
+        and the model is a local keras model.
+        """
+        if not self.enabled:
+            return model
+        if not hasattr(model, 'predict_function'):
+            print('Not recording the tensorflow timeline, the model is not '
+                  'loaded in this process')
+            return model
+        return TimelineModel(model, self.out_dir, max_traces)
+
+
+class TimelineModel:
+    """
+    Wraps a keras model, writing the tensorflow timeline of the first calls
+    of predict_on_batch() to inference_timeline_<n>.json.
+
+    The first call includes the set up of the graph, so a few calls are
+    recorded. Tracing is switched off after that, as it slows inference down.
+
+    Args:
+        model (keras.models.Model): The loaded model
+        out_dir (str): Where to write the timelines
+        max_traces (int): Number of calls to record
+    """
+    def __init__(self, model, out_dir, max_traces=3):
+        import tensorflow as tf
+        self.model = model
+        self.out_dir = out_dir
+        self.max_traces = max_traces
+        self.traces = 0
+        self._run_metadata = tf.compat.v1.RunMetadata()
+        self._set_function_kwargs({
+            'options': tf.compat.v1.RunOptions(
+                trace_level=tf.compat.v1.RunOptions.FULL_TRACE),
+            'run_metadata': self._run_metadata})
+
+    def _set_function_kwargs(self, kwargs):
+        # keras passes these to session.run(), the predict function is
+        # rebuilt with them on the next call.
+        self.model._function_kwargs = kwargs
+        self.model.predict_function = None
+
+    def predict_on_batch(self, batch):
+        """Same as keras.models.Model.predict_on_batch()."""
+        result = self.model.predict_on_batch(batch)
+        if self.traces < self.max_traces:
+            from tensorflow.python.client import timeline
+            trace = timeline.Timeline(self._run_metadata.step_stats)
+            path = os.path.join(self.out_dir,
+                                'inference_timeline_' + str(self.traces) + '.json')
+            with open(path, 'w') as f:
+                f.write(trace.generate_chrome_trace_format())
+            self.traces += 1
+            if self.traces == self.max_traces:
+                self._set_function_kwargs({})
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
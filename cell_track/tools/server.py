@@ -0,0 +1,309 @@
+"""
+Resident inference server, keeping a loaded model between runs.
+
+Importing tensorflow, creating the session and loading the model takes longer
+than many small jobs. The server does this once and then answers requests
+from the command line tools over a local socket (a Unix socket, or a named
+pipe on Windows). Clients get a RemoteModel, which has the same
+predict_on_batch() method as the keras model, so the tracking functions do
+not need to know whether the model is local or not.
+
+Requests are pickled, so only the user that started the server may talk to
+it. The socket and a random key are kept in a folder only that user can
+open (runtime_dir()), client and server prove to each other that they know
+the key before anything is unpickled, and clients do not connect to sockets
+owned by other users.
+
+Start a server with:
+    python cell_track/utilities/inference_server.py --model model.h5
+"""
+import os
+import sys
+import tempfile
+import threading
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from queue import Queue
+
+KEY_FILE = 'inference.key'
+# Seconds the server waits before accepting again after an error, doubled
+# up to the maximum while the error persists
+ACCEPT_RETRY_DELAY = 0.1
+ACCEPT_MAX_DELAY = 5.0
+
+
+def _user():
+    return os.environ.get('USER') or os.environ.get('USERNAME') or 'acit'
+
+
+def _check_private(path):
+    """Raises RuntimeError if path is not owned by, and only open to, this user."""
+    if not hasattr(os, 'getuid'):
+        return  # Windows, the temporary folder is per user
+    stat = os.lstat(path)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise RuntimeError(str(path) + ' is not private to this user, refusing to use it')
+
+
+def runtime_dir():
+    """
+    The folder of the socket and key of the server, created if needed so
+    that only this user can open it.
+
+    This can be changed with the ACIT_RUNTIME_DIR environment variable.
+
+    Raises:
+        RuntimeError: If the folder is owned by or open to other users
+    """
+    folder = os.environ.get('ACIT_RUNTIME_DIR')
+    if not folder:
+        base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+        folder = os.path.join(base, 'acit-' + _user())
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    _check_private(folder)
+    return folder
+
+
+def auth_key(create=False):
+    """
+    The key client and server authenticate each other with, a random key
+    in a file only this user can read.
+
+    Args:
+        create (bool): Create the key if there is none yet, as the server does
+
+    Returns:
+        bytes: The key, or None if there is none
+    """
+    path = os.path.join(runtime_dir(), KEY_FILE)
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32))
+    if not os.path.exists(path):
+        return None
+    _check_private(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def default_address():
+    """
+    The socket address used when none is given.
+
+    This can be changed with the ACIT_SERVER environment variable.
+
+    Returns:
+        str: Path of the Unix socket, or name of the pipe on Windows
+    """
+    if os.environ.get('ACIT_SERVER'):
+        return os.environ['ACIT_SERVER']
+    if sys.platform.startswith('win'):
+        return r'\\.\pipe\acit-inference-' + _user()
+    return os.path.join(runtime_dir(), 'inference.sock')
+
+
+def _family(address):
+    return 'AF_PIPE' if address.startswith('\\\\') else 'AF_UNIX'
+
+
+class RemoteModel:
+    """
+    Client side stand-in for a model held by an InferenceServer.
+
+    Args:
+        address (str): Address of the server
+        model_path (str): Path of the model loaded by the server
+        authkey (bytes): Key of the server, see auth_key()
+
+    Attributes:
+        model_path (str): Path of the model loaded by the server
+    """
+    def __init__(self, address, model_path=None, authkey=None):
+        self.address = address
+        self.model_path = model_path
+        self._conn = Client(address, family=_family(address),
+                            authkey=authkey or auth_key())
+
+    def _request(self, *request):
+        self._conn.send(request)
+        status, result = self._conn.recv()
+        if status == 'error':
+            raise RuntimeError('Inference server error:\n' + result)
+        return result
+
+    def predict_on_batch(self, batch):
+        """Same as keras.models.Model.predict_on_batch(), run on the server."""
+        return self._request('predict', batch)
+
+    def run_job(self, job, *args, **kwargs):
+        """
+        Runs a whole job on the server, e.g. 'track_tiff_folder' or 'track_lif'.
+
+        The paths in the arguments must be valid on the server, which runs on
+        the same machine.
+
+        Args:
+            job (str): Name of the job, one of InferenceServer.jobs
+            *args: Positional arguments of the job, after the model
+            **kwargs: Keyword arguments of the job
+        """
+        return self._request('job', job, args, kwargs)
+
+    def close(self):
+        """Closes the connection to the server."""
+        self._conn.close()
+
+
+def connect(model_path=None, address=None):
+    """
+    Connects to a running inference server.
+
+    Args:
+        model_path (str): If given, only connect if the server has loaded
+            this model.
+        address (str): Address of the server, see default_address()
+
+    Returns:
+        RemoteModel: or None if no (matching) server is running
+    """
+    address = address or default_address()
+    if _family(address) == 'AF_UNIX':
+        if not os.path.exists(address):
+            return None
+        if hasattr(os, 'getuid') and os.lstat(address).st_uid != os.getuid():
+            print('Warning: ' + address + ' belongs to another user, not connecting')
+            return None
+    authkey = auth_key()
+    if authkey is None:
+        return None
+    try:
+        model = RemoteModel(address, authkey=authkey)
+        server_model = model._request('ping')
+    except (OSError, EOFError, AuthenticationError):
+        return None
+    if model_path is not None and \
+            os.path.abspath(model_path) != os.path.abspath(server_model):
+        model.close()
+        return None
+    model.model_path = server_model
+    return model
+
+
+class InferenceServer:
+    """
+    Holds a loaded model and serves requests from RemoteModel clients.
+
+    Each client connection is read in its own thread, but the model is only
+    used from the thread that calls serve_forever(), as the keras/tensorflow
+    session is bound to it.
+
+    Args:
+        model (keras.models.Model): The loaded model
+        model_path (str): Path the model was loaded from
+        address (str): Address to listen on, see default_address()
+
+    Attributes:
+        jobs (tuple): Names of the functions in cell_track.tools.track_image
+            clients can run as whole-stack jobs
+    """
+    jobs = ('track_lif', 'track_tiff_folder')
+
+    def __init__(self, model, model_path, address=None):
+        self.model = model
+        self.model_path = os.path.abspath(model_path)
+        self.address = address or default_address()
+        self._requests = Queue()
+        self._closed = threading.Event()
+
+    def _read_requests(self, conn):
+        # Runs in a thread per client, hands requests to the model thread.
+        replies = Queue()
+        try:
+            while True:
+                request = conn.recv()
+                self._requests.put((request, replies))
+                conn.send(replies.get())
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _handle(self, request):
+        kind = request[0]
+        if kind == 'ping':
+            return self.model_path
+        if kind == 'predict':
+            return self.model.predict_on_batch(request[1])
+        if kind == 'job':
+            job, args, kwargs = request[1:]
+            if job not in self.jobs:
+                raise ValueError('Unknown job: ' + str(job))
+            from cell_track.tools import track_image
+            # All jobs take the model as the last positional argument
+            return getattr(track_image, job)(*args, self.model, **kwargs)
+        raise ValueError('Unknown request: ' + str(kind))
+
+    def _accept(self, listener):
+        delay = 0
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError):
+                continue  # a client without the key, or one that dropped mid-handshake
+            except OSError as error:
+                if self._closed.is_set():
+                    return
+                # e.g. too many open files, wait for it to clear up
+                delay = min(max(2 * delay, ACCEPT_RETRY_DELAY), ACCEPT_MAX_DELAY)
+                print('Accepting a client failed (' + str(error) + '), retrying in ' +
+                      str(delay) + ' s')
+                if self._closed.wait(delay):
+                    return
+                continue
+            delay = 0
+            threading.Thread(target=self._read_requests, args=(conn,),
+                             daemon=True).start()
+
+    def shutdown(self):
+        """Makes serve_forever() return, e.g. from another thread."""
+        self._closed.set()
+        self._requests.put((None, None))
+
+    def serve_forever(self):
+        """Serves requests until interrupted (Ctrl-C) or shut down."""
+        family = _family(self.address)
+        if family == 'AF_UNIX' and os.path.exists(self.address):
+            if connect(address=self.address) is not None:
+                raise RuntimeError('An inference server is already running at ' +
+                                   self.address)
+            os.remove(self.address)  # left over from a server that died
+
+        authkey = auth_key(create=True)
+        self._closed.clear()
+        old_umask = os.umask(0o077)
+        try:
+            listener = Listener(self.address, family=family, authkey=authkey)
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        print('Serving ' + self.model_path + ' at ' + self.address)
+        try:
+            while True:
+                request, replies = self._requests.get()
+                if request is None:
+                    break
+                try:
+                    replies.put(('ok', self._handle(request)))
+                except Exception:
+                    replies.put(('error', traceback.format_exc()))
+        except KeyboardInterrupt:
+            print('Stopping inference server')
+        finally:
+            self._closed.set()
+            listener.close()  # also removes the Unix socket
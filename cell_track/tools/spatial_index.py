@@ -0,0 +1,183 @@
+"""
+Spatial-temporal index of the spots and tracks of a stack, for region and
+time window queries such as "the tracks that passed through this region
+between frames 20 and 40".
+
+The spots are binned in a grid of square cells per frame, and sorted by
+(frame, cell row, cell column). The cells of a row of the grid are then
+next to each other in the sorted keys, so a query looks up one range of
+keys per frame and row of the region with a binary search, and only checks
+the exact positions of the spots in those cells. Track bounding boxes (in
+space and time) are kept as arrays for coarse queries.
+
+Examples:
+    >>> index = SpotIndex.from_xml('Well3-Pos001.tif.trackmate.xml')
+    >>> index.tracks_in(200, 200, 400, 300, 20, 40)
+    ['12', '57']
+    >>> for track, spots in index.query(200, 200, 400, 300, 20, 40):
+    ...     print(track, index.trajectories.frame[spots])
+"""
+import numpy as np
+
+from cell_track.tools.analytics import Trajectories, read_trajectories
+
+
+class SpotIndex:
+    """
+    Grid index of the spots of a set of tracks.
+
+    Positions are in the units of the trajectories, pixels for from_xml()
+    and from_tracks(). Regions include their edges and frame ranges both
+    ends.
+
+    Args:
+        trajectories (Trajectories): The spots, sorted by track and frame
+        names (list): The TRACK_ID of each track_id, defaults to the track_id
+        cell_size (float): Side of the grid cells, by default so that a cell
+            holds about 4 spots per frame
+
+    Attributes:
+        trajectories (Trajectories): The spots, the spot indices returned by
+            queries index its arrays
+        names (list): The TRACK_ID of each track_id
+        bounds (numpy.ndarray): (n_tracks, 6) bounding boxes of the tracks,
+            x_min, y_min, x_max, y_max, first frame, last frame
+    """
+    def __init__(self, trajectories, names=None, cell_size=None):
+        self.trajectories = trajectories
+        track_id, frame = trajectories.track_id, trajectories.frame
+        x, y = trajectories.x, trajectories.y
+        n_tracks = int(track_id.max()) + 1 if len(track_id) else 0
+        self.names = list(names) if names is not None else list(range(n_tracks))
+        n_tracks = len(self.names)
+
+        counts = np.bincount(track_id, minlength=n_tracks)
+        self._track_start = np.zeros(n_tracks + 1, dtype=np.int64)
+        self._track_start[1:] = np.cumsum(counts)
+        self.bounds = np.full((n_tracks, 6), np.nan)
+        if len(track_id):
+            first = self._track_start[:-1][counts > 0]
+            for column, values in ((0, x), (1, y), (4, frame)):
+                self.bounds[counts > 0, column] = np.minimum.reduceat(values, first)
+            for column, values in ((2, x), (3, y), (5, frame)):
+                self.bounds[counts > 0, column] = np.maximum.reduceat(values, first)
+
+        if not len(track_id):
+            self._origin = (0.0, 0.0, 0)
+            self._shape = (0, 1, 1)
+            self.cell_size = cell_size or 1.0
+            self._keys = self._order = np.zeros(0, dtype=np.int64)
+            return
+        x0, y0, f0 = x.min(), y.min(), int(frame.min())
+        n_frames = int(frame.max()) - f0 + 1
+        if cell_size is None:
+            area = max((x.max() - x0) * (y.max() - y0), 1.0)
+            cell_size = max(np.sqrt(4 * area * n_frames / len(x)), 1e-9)
+        self.cell_size = float(cell_size)
+        cx = ((x - x0) // self.cell_size).astype(np.int64)
+        cy = ((y - y0) // self.cell_size).astype(np.int64)
+        self._origin = (x0, y0, f0)
+        self._shape = (n_frames, int(cy.max()) + 1, int(cx.max()) + 1)
+        keys = ((frame - f0) * self._shape[1] + cy) * self._shape[2] + cx
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+    @classmethod
+    def from_xml(cls, xml_path, filtered_only=True, cell_size=None):
+        """Indexes the tracks of a trackmate XML file, in pixels and frames."""
+        trajectories, names = read_trajectories(xml_path, filtered_only, pixel_size=1.0,
+                                                frame_interval=1.0)
+        return cls(trajectories, names, cell_size)
+
+    @classmethod
+    def from_tracks(cls, tracks, cell_size=None):
+        """
+        Indexes Track or FilteredTrack objects of trackmate, e.g. as
+        read for drawTrackmateVideo().
+        """
+        rows = [(track_id, spot.frame, spot.x, spot.y)
+                for track_id, track in enumerate(tracks) for spot in track.spot_objs]
+        table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        table = table[np.lexsort((table[:, 1], table[:, 0]))]
+        frames = table[:, 1].astype(np.int64)
+        trajectories = Trajectories(track_id=table[:, 0].astype(np.int64), frame=frames,
+                                    t=frames.astype(np.float64), x=table[:, 2], y=table[:, 3])
+        return cls(trajectories, [track.id for track in tracks], cell_size)
+
+    def track_slice(self, track_id):
+        """The slice of the trajectories arrays with the spots of a track_id."""
+        return slice(int(self._track_start[track_id]), int(self._track_start[track_id + 1]))
+
+    def spots_in(self, x_min, y_min, x_max, y_max, first_frame=None, last_frame=None):
+        """
+        The spots inside a region, in a range of frames.
+
+        Args:
+            x_min, y_min, x_max, y_max (float): The region
+            first_frame, last_frame (int): The frames, all by default
+
+        Returns:
+            numpy.ndarray: Sorted indices of the spots in the trajectories
+        """
+        if not len(self._keys):
+            return np.zeros(0, dtype=np.int64)
+        x0, y0, f0 = self._origin
+        n_frames, n_rows, n_columns = self._shape
+        first = 0 if first_frame is None else max(int(first_frame) - f0, 0)
+        last = n_frames - 1 if last_frame is None else min(int(last_frame) - f0, n_frames - 1)
+        column_min = max(int((x_min - x0) // self.cell_size), 0)
+        column_max = min(int((x_max - x0) // self.cell_size), n_columns - 1)
+        row_min = max(int((y_min - y0) // self.cell_size), 0)
+        row_max = min(int((y_max - y0) // self.cell_size), n_rows - 1)
+        if first > last or column_min > column_max or row_min > row_max:
+            return np.zeros(0, dtype=np.int64)
+
+        # One range of keys per frame and row of cells
+        rows = (np.arange(first, last + 1)[:, None] * n_rows +
+                np.arange(row_min, row_max + 1)[None, :]).ravel() * n_columns
+        starts = np.searchsorted(self._keys, rows + column_min, 'left')
+        lengths = np.searchsorted(self._keys, rows + column_max, 'right') - starts
+        starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        spots = self._order[offsets + np.arange(len(offsets))]
+
+        x, y = self.trajectories.x[spots], self.trajectories.y[spots]
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return np.sort(spots[inside])
+
+    def query(self, x_min, y_min, x_max, y_max, first_frame=None, last_frame=None):
+        """
+        The tracks with spots inside a region in a range of frames, see
+        spots_in().
+
+        Returns:
+            list: (TRACK_ID, spot indices) for each track, the indices of its
+                spots that are inside, sorted by frame
+        """
+        spots = self.spots_in(x_min, y_min, x_max, y_max, first_frame, last_frame)
+        if not len(spots):
+            return []
+        track_id = self.trajectories.track_id[spots]
+        breaks = np.flatnonzero(np.diff(track_id)) + 1
+        return [(self.names[track_id[start]], group)
+                for start, group in zip(np.r_[0, breaks], np.split(spots, breaks))]
+
+    def tracks_in(self, x_min, y_min, x_max, y_max, first_frame=None, last_frame=None):
+        """The TRACK_ID of the tracks with spots inside a region, see spots_in()."""
+        spots = self.spots_in(x_min, y_min, x_max, y_max, first_frame, last_frame)
+        return [self.names[track_id] for track_id in np.unique(self.trajectories.track_id[spots])]
+
+    def tracks_overlapping(self, x_min, y_min, x_max, y_max, first_frame=None, last_frame=None):
+        """
+        The TRACK_ID of the tracks whose bounding box overlaps a region and
+        range of frames. Faster and coarser than tracks_in(), a track can
+        pass around the region.
+        """
+        bounds = self.bounds
+        first = -np.inf if first_frame is None else first_frame
+        last = np.inf if last_frame is None else last_frame
+        with np.errstate(invalid='ignore'):
+            overlap = ((bounds[:, 0] <= x_max) & (bounds[:, 2] >= x_min) &
+                       (bounds[:, 1] <= y_max) & (bounds[:, 3] >= y_min) &
+                       (bounds[:, 4] <= last) & (bounds[:, 5] >= first))
+        return [self.names[track_id] for track_id in np.flatnonzero(overlap)]
@@ -0,0 +1,130 @@
+"""
+Intensity features of the detected spots, as TrackMate's spot analyzers
+compute them, from the frame the network already ran on.
+
+All boxes of a frame are measured at once. Sums over boxes come from the
+integral images of the frame and of its square (one pass over the frame),
+so the total, mean and standard deviation of a box, and the mean of the ring
+around it, take four lookups each whatever the size of the box. The order
+statistics (min, median, max) come from one sort of the pixels of all boxes,
+cropped into a padded (boxes, height, width) array.
+
+TrackMate measures a disc of the spot radius, and compares it to the ring
+out to twice the radius for the contrast and SNR. Here the box is the spot
+and the ring is the box grown by half its size on each side, positions and
+sizes in pixels, as in the XML files of the detector.
+"""
+import cv2
+import numpy as np
+
+# The spot features, in the order of the arrays of box_features()
+SPOT_FEATURES = ('MEAN_INTENSITY', 'MEDIAN_INTENSITY', 'MIN_INTENSITY', 'MAX_INTENSITY',
+                 'TOTAL_INTENSITY', 'STANDARD_DEVIATION', 'ESTIMATED_DIAMETER', 'RADIUS',
+                 'SNR', 'CONTRAST')
+# Largest number of pixels in the padded crops of one sort
+_CHUNK_PIXELS = 1 << 22
+
+
+def _as_gray(frame):
+    frame = np.asarray(frame)
+    if frame.ndim == 3:  # RGB, the mean of the channels
+        frame = frame.mean(axis=2, dtype=np.float32)
+    if frame.dtype not in (np.uint8, np.uint16, np.int16, np.float32, np.float64):
+        frame = frame.astype(np.float64)
+    return frame
+
+
+def _clip_boxes(boxes, height, width):
+    """Rounded (x1, y1, x2, y2) of the boxes inside the frame, at least one pixel each."""
+    boxes = np.round(np.asarray(boxes, dtype=np.float64).reshape(-1, 4)).astype(np.int64)
+    x1 = np.clip(boxes[:, 0], 0, width - 1)
+    y1 = np.clip(boxes[:, 1], 0, height - 1)
+    x2 = np.clip(boxes[:, 2], x1 + 1, width)
+    y2 = np.clip(boxes[:, 3], y1 + 1, height)
+    return x1, y1, x2, y2
+
+
+def _box_sums(integral, x1, y1, x2, y2):
+    return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+
+
+def _order_statistics(frame, x1, y1, x2, y2):
+    """min, median and max of the pixels of each box."""
+    n = len(x1)
+    heights, widths = y2 - y1, x2 - x1
+    result = np.empty((3, n))
+    order = np.argsort(heights * widths, kind='stable')
+    start = 0
+    while start < n:
+        # Boxes of similar size share a chunk, to keep the padding small
+        stop = start + 1
+        max_h, max_w = heights[order[start]], widths[order[start]]
+        while stop < n:
+            h = max(max_h, heights[order[stop]])
+            w = max(max_w, widths[order[stop]])
+            if (stop - start + 1) * h * w > _CHUNK_PIXELS:
+                break
+            max_h, max_w = h, w
+            stop += 1
+        chunk = order[start:stop]
+        rows = y1[chunk, None] + np.arange(max_h)
+        columns = x1[chunk, None] + np.arange(max_w)
+        inside = ((rows < y2[chunk, None])[:, :, None] &
+                  (columns < x2[chunk, None])[:, None, :])
+        crops = frame[np.minimum(rows, frame.shape[0] - 1)[:, :, None],
+                      np.minimum(columns, frame.shape[1] - 1)[:, None, :]]
+        crops = np.where(inside, crops, np.inf).reshape(len(chunk), -1)
+        crops.sort(axis=1)
+        count = heights[chunk] * widths[chunk]
+        index = np.arange(len(chunk))
+        result[0, chunk] = crops[:, 0]
+        result[1, chunk] = (crops[index, (count - 1) // 2] + crops[index, count // 2]) / 2
+        result[2, chunk] = crops[index, count - 1]
+        start = stop
+    return result
+
+
+def box_features(frame, boxes):
+    """
+    Measures the spot features of boxes in a frame.
+
+    Args:
+        frame (numpy.ndarray): (y, x) grayscale or (y, x, 3) RGB frame
+        boxes (list): Boxes in the form (x1, y1, x2, y2), in pixels
+
+    Returns:
+        dict: feature: numpy.ndarray with the value of each box, for the
+            features of SPOT_FEATURES
+    """
+    frame = _as_gray(frame)
+    height, width = frame.shape
+    x1, y1, x2, y2 = _clip_boxes(boxes, height, width)
+    if not len(x1):
+        return {feature: np.zeros(0) for feature in SPOT_FEATURES}
+    sums, squares = cv2.integral2(frame, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    area = ((x2 - x1) * (y2 - y1)).astype(np.float64)
+    total = _box_sums(sums, x1, y1, x2, y2)
+    mean = total / area
+    std = np.sqrt(np.maximum(_box_sums(squares, x1, y1, x2, y2) / area - mean ** 2, 0))
+
+    # The ring around the box, out to twice its size
+    half_w, half_h = (x2 - x1 + 1) // 2, (y2 - y1 + 1) // 2
+    outer = (np.maximum(x1 - half_w, 0), np.maximum(y1 - half_h, 0),
+             np.minimum(x2 + half_w, width), np.minimum(y2 + half_h, height))
+    ring_area = (outer[2] - outer[0]) * (outer[3] - outer[1]) - area
+    ring_total = _box_sums(sums, *outer) - total
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ring_mean = np.where(ring_area > 0, ring_total / np.maximum(ring_area, 1), mean)
+        contrast = np.where(mean + ring_mean > 0,
+                            (mean - ring_mean) / (mean + ring_mean), 0.0)
+        snr = np.where(std > 0, (mean - ring_mean) / std, 0.0)
+
+    minimum, median, maximum = _order_statistics(frame, x1, y1, x2, y2)
+    # The radius of the disc of the same area as the box
+    radius = np.sqrt(area / np.pi)
+    return {'MEAN_INTENSITY': mean, 'MEDIAN_INTENSITY': median,
+            'MIN_INTENSITY': minimum, 'MAX_INTENSITY': maximum,
+            'TOTAL_INTENSITY': total, 'STANDARD_DEVIATION': std,
+            'ESTIMATED_DIAMETER': 2 * radius, 'RADIUS': radius,
+            'SNR': snr, 'CONTRAST': contrast}
@@ -0,0 +1,708 @@
+"""
+Readers and writers for the image stacks produced by the tracking tools.
+
+TIFF stacks are written by PIL as a single LZW compressed file, which has to
+be decoded from the start to reach any frame. Zarr stores keep every frame in
+its own compressed chunk, so frames can be read in any order and in parallel.
+
+The FrameSource classes give the downstream stages one way of reading frames
+by index, whether they come from a TIFF stack, a Zarr store or straight from
+the series in the original LIF file.
+
+lif_calibration() and tiff_calibration() read the frame size, pixel size and
+frame interval of an image series from its metadata, for the XML files.
+
+zarr and numcodecs are only needed when a Zarr store is written or read.
+"""
+import abc
+import os
+import re
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ZARR_EXT = '.zarr'
+TIFF_EXT = '.tif'
+
+
+def is_zarr_stack(path):
+    """Returns True if path points to a Zarr image store."""
+    return str(path).rstrip('/\\').endswith(ZARR_EXT)
+
+
+class ZarrStackWriter:
+    """
+    Incrementally writes a time-lapse to a chunked, compressed Zarr store.
+
+    Each frame is stored as one chunk in the array '0' of a Zarr group. The
+    group carries OME-Zarr 'multiscales' metadata for single channel frames,
+    so the store can also be opened by OME-Zarr aware viewers.
+
+    Args:
+        path (str): Path of the .zarr store to create. An existing store at
+            this path is overwritten.
+        compressor (numcodecs.abc.Codec): Compressor for the chunks, defaults
+            to Blosc zstd with bit shuffling.
+
+    Attributes:
+        path (str): Path of the .zarr store
+        nframes (int): Number of frames written so far
+
+    Examples:
+        >>> writer = ZarrStackWriter('Well1-Pos001.zarr')
+        >>> for frame in image.get_iter_t():
+        >>>     writer.append(frame)
+    """
+    def __init__(self, path, compressor=None):
+        self.path = path
+        self.compressor = compressor
+        self.nframes = 0
+        self._array = None
+
+    def _create(self, frame):
+        import zarr
+        compressor = self.compressor
+        if compressor is None:
+            from numcodecs import Blosc
+            compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+
+        root = zarr.open_group(self.path, mode='w')
+        self._array = root.create_dataset('0',
+                                          shape=(0,) + frame.shape,
+                                          chunks=(1,) + frame.shape,
+                                          dtype=frame.dtype,
+                                          compressor=compressor)
+        if frame.ndim == 2:
+            root.attrs['multiscales'] = [{
+                'version': '0.4',
+                'name': os.path.basename(self.path),
+                'axes': [{'name': 't', 'type': 'time'},
+                         {'name': 'y', 'type': 'space'},
+                         {'name': 'x', 'type': 'space'}],
+                'datasets': [{'path': '0',
+                              'coordinateTransformations': [
+                                  {'type': 'scale', 'scale': [1.0, 1.0, 1.0]}]}],
+            }]
+
+    def append(self, frame):
+        """
+        Appends one frame to the end of the store.
+
+        Args:
+            frame (numpy.ndarray or PIL.Image): The frame to write. All frames
+                must have the same shape and data type.
+
+        Returns:
+            None
+        """
+        frame = np.asarray(frame)
+        if self._array is None:
+            self._create(frame)
+        self._array.append(frame[np.newaxis], axis=0)
+        self.nframes += 1
+
+
+class TiffStackWriter:
+    """
+    Writes a time-lapse to an LZW compressed TIFF stack one frame at a time.
+
+    This writes the same file as PIL's save(..., save_all=True,
+    append_images=...), without keeping all frames in memory first.
+
+    Args:
+        path (str): Path of the TIFF file to create, overwritten if it exists
+
+    Attributes:
+        path (str): Path of the TIFF file
+        nframes (int): Number of frames written so far
+
+    Examples:
+        >>> with TiffStackWriter('Well1-Pos001.tif') as writer:
+        >>>     for frame in image.get_iter_t():
+        >>>         writer.append(frame)
+    """
+    def __init__(self, path):
+        from PIL import TiffImagePlugin
+        self.path = path
+        self.nframes = 0
+        self._tiff = TiffImagePlugin.AppendingTiffWriter(path, True)
+
+    def append(self, frame):
+        """
+        Appends one frame to the end of the stack.
+
+        Args:
+            frame (numpy.ndarray or PIL.Image): The frame to write
+        """
+        from PIL import Image
+        if not isinstance(frame, Image.Image):
+            frame = Image.fromarray(np.asarray(frame))
+        frame.save(self._tiff, format='tiff', compression='tiff_lzw')
+        self._tiff.newFrame()
+        self.nframes += 1
+
+    def close(self):
+        """Finishes the file."""
+        self._tiff.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_zarr_stack(path):
+    """
+    Opens a Zarr image store for reading.
+
+    Args:
+        path (str): Path to the .zarr store
+
+    Returns:
+        zarr.Array: Array of shape (t, y, x), indexable by frame
+    """
+    import zarr
+    return zarr.open_group(path, mode='r')['0']
+
+
+def iter_zarr_frames(path, workers=4):
+    """
+    Iterates over all frames in a Zarr image store, in order.
+
+    Chunks are decompressed in a small thread pool ahead of the consumer,
+    so decoding overlaps with whatever is done with the previous frame.
+
+    Args:
+        path (str): Path to the .zarr store
+        workers (int): Number of frames decoded concurrently
+
+    Returns:
+        generator: numpy.ndarray for each frame
+    """
+    array = open_zarr_stack(path)
+    nframes = array.shape[0]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(array.__getitem__, t)
+                   for t in range(min(workers, nframes))]
+        for t in range(nframes):
+            frame = pending.pop(0).result()
+            if t + workers < nframes:
+                pending.append(pool.submit(array.__getitem__, t + workers))
+            yield frame
+
+
+def to_rgb8(frame):
+    """
+    Converts a frame into an 8-bit RGB array, as PIL's convert('RGB') does.
+
+    Values above 255 are clipped, which is what PIL does for 16-bit images.
+
+    Args:
+        frame (numpy.ndarray): A (y, x) grayscale or (y, x, 3) RGB frame
+
+    Returns:
+        numpy.ndarray: (y, x, 3) uint8 array
+    """
+    frame = np.asarray(frame)
+    if frame.dtype != np.uint8:
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+    if frame.ndim == 2:
+        frame = np.repeat(frame[:, :, np.newaxis], 3, axis=2)
+    return frame
+
+
+class FrameSource(abc.ABC):
+    """
+    Random access to the frames of one image series.
+
+    Subclasses implement __len__ and get_frame(). Frames are returned as
+    numpy arrays in the data type of the source, (y, x) for single channel
+    images and (y, x, 3) for RGB images.
+
+    Examples:
+        >>> frames = open_frame_source('Well1-Pos001.tif')
+        >>> for i, frame in enumerate(frames):
+        >>>     rgb = to_rgb8(frame)
+    """
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    @abc.abstractmethod
+    def get_frame(self, t):
+        """
+        Reads a single frame.
+
+        Args:
+            t (int): Index of the frame, starting at 0
+
+        Returns:
+            numpy.ndarray
+        """
+
+    def __getitem__(self, t):
+        if not 0 <= t < len(self):
+            raise IndexError('frame ' + str(t) + ' out of range')
+        return self.get_frame(t)
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self.get_frame(t)
+
+
+class TiffFrameSource(FrameSource):
+    """
+    Frames of a (multi-page) TIFF stack, read with PIL.
+
+    Args:
+        path (str): Path to the .tif file
+    """
+    # Modes that numpy can represent without going through PIL's convert()
+    _native_modes = ('L', 'I;16', 'I;16B', 'I', 'F', 'RGB')
+
+    def __init__(self, path):
+        from PIL import Image
+        self.path = path
+        self._image = Image.open(path)
+        self._nframes = getattr(self._image, 'n_frames', 1)
+
+    def __len__(self):
+        return self._nframes
+
+    def _to_array(self, page):
+        if page.mode not in self._native_modes:
+            page = page.convert('RGB')
+        return np.asarray(page)
+
+    def get_frame(self, t):
+        self._image.seek(t)
+        return self._to_array(self._image)
+
+    def __iter__(self):
+        from PIL import ImageSequence
+        for page in ImageSequence.Iterator(self._image):
+            yield self._to_array(page)
+
+
+class ZarrFrameSource(FrameSource):
+    """
+    Frames of a Zarr image store written by ZarrStackWriter.
+
+    Iteration decodes chunks ahead of the consumer, see iter_zarr_frames().
+
+    Args:
+        path (str): Path to the .zarr store
+        workers (int): Number of frames decoded concurrently when iterating
+    """
+    def __init__(self, path, workers=4):
+        self.path = path
+        self.workers = workers
+        self._array = open_zarr_stack(path)
+
+    def __len__(self):
+        return self._array.shape[0]
+
+    @property
+    def frame_nbytes(self):
+        """Size of one decoded frame in bytes."""
+        return int(np.prod(self._array.shape[1:])) * self._array.dtype.itemsize
+
+    def get_frame(self, t):
+        return self._array[t]
+
+    def __iter__(self):
+        return iter_zarr_frames(self.path, workers=self.workers)
+
+
+class LifFrameSource(FrameSource):
+    """
+    Frames of one image series, read directly from a LIF file with readlif.
+
+    This lets the downstream stages work on the pixels in the original LIF
+    file, so no intermediate TIFF stack has to be written.
+
+    Args:
+        lif (str or readlif.reader.LifFile): Path to the .lif file, or an
+            already opened LifFile
+        series (int): Index of the image series in the LIF file
+        z (int): z slice to read
+        c (int): Channel to read
+    """
+    def __init__(self, lif, series, z=0, c=0):
+        if isinstance(lif, str):
+            from readlif.reader import LifFile
+            lif = LifFile(lif)
+        self.series = series
+        self.z = z
+        self.c = c
+        self._image = lif.get_image(series)
+
+    def __len__(self):
+        return int(self._image.nt)
+
+    def get_frame(self, t):
+        return np.asarray(self._image.get_frame(z=self.z, t=t, c=self.c))
+
+
+# Sizes of the TIFF field types, by type id
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4,
+                    10: 8, 11: 4, 12: 8, 16: 8}
+_TIFF_TYPE_FORMATS = {1: 'B', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i',
+                      11: 'f', 12: 'd', 16: 'Q'}
+_TIFF_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def _read_tiff_ifds(path, max_pages=None):
+    """
+    Reads the tags of every IFD (page) of a classic TIFF file.
+
+    Only numeric tags and the ImageDescription are decoded, which is all
+    that is needed to locate uncompressed pixel data.
+
+    Args:
+        path (str): Path to the .tif file
+        max_pages (int): Stop after this many pages, all by default
+
+    Returns:
+        (str, list): The byte order ('<' or '>') and a list of
+            {tag: value} dicts, one per page. Returns (None, None) for files
+            that are not classic TIFF files, e.g. BigTIFF.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(8)
+        if header[:4] == b'II*\x00':
+            order = '<'
+        elif header[:4] == b'MM\x00*':
+            order = '>'
+        else:
+            return None, None
+        offset = struct.unpack(order + 'I', header[4:8])[0]
+
+        pages = []
+        seen = set()
+        while offset and offset not in seen and len(pages) != max_pages:
+            seen.add(offset)
+            f.seek(offset)
+            count = struct.unpack(order + 'H', f.read(2))[0]
+            entries = f.read(12 * count)
+            tags = {}
+            for n in range(count):
+                tag, ftype, nvalues, raw = struct.unpack(
+                    order + 'HHI4s', entries[12 * n:12 * (n + 1)])
+                size = _TIFF_TYPE_SIZES.get(ftype)
+                if size is None:
+                    continue
+                nbytes = size * nvalues
+                if nbytes > 4:
+                    here = f.tell()
+                    f.seek(struct.unpack(order + 'I', raw)[0])
+                    data = f.read(nbytes)
+                    f.seek(here)
+                else:
+                    data = raw[:nbytes]
+                if ftype == 2:
+                    tags[tag] = data.rstrip(b'\x00').decode('latin-1')
+                elif ftype in _TIFF_TYPE_FORMATS:
+                    values = struct.unpack(
+                        order + _TIFF_TYPE_FORMATS[ftype] * nvalues, data)
+                    tags[tag] = values
+                elif ftype in (5, 10):
+                    values = struct.unpack(
+                        order + ('I' if ftype == 5 else 'i') * 2 * nvalues, data)
+                    tags[tag] = tuple(values[i] / values[i + 1] if values[i + 1] else 0.0
+                                      for i in range(0, len(values), 2))
+            pages.append(tags)
+            offset = struct.unpack(order + 'I', f.read(4))[0]
+    return order, pages
+
+
+def _tiff_page_layout(order, tags):
+    """
+    Works out where the pixels of an uncompressed TIFF page are.
+
+    Returns:
+        dict: shape, dtype, and either 'offset' (one contiguous block of
+            pixel data) or 'tiles' (tile offsets and tile size). None if the
+            page is compressed or laid out in a way that needs decoding.
+    """
+    if tags.get(259, (1,))[0] != 1:  # Compression
+        return None
+    if tags.get(284, (1,))[0] != 1:  # PlanarConfiguration, only chunky
+        return None
+    if tags.get(262, (1,))[0] not in (1, 2):  # BlackIsZero or RGB
+        return None
+    width, height = tags[256][0], tags[257][0]
+    samples = tags.get(277, (1,))[0]
+    bits = set(tags.get(258, (1,)))
+    kinds = set(tags.get(339, (1,)))
+    if len(bits) != 1 or len(kinds) != 1:
+        return None
+    bits, kind = bits.pop(), _TIFF_SAMPLE_KINDS.get(kinds.pop())
+    if bits not in (8, 16, 32, 64) or kind is None:
+        return None
+
+    dtype = np.dtype(order + kind + str(bits // 8))
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    layout = {'shape': shape, 'dtype': dtype}
+
+    if 324 in tags:  # TileOffsets
+        layout['tiles'] = tags[324]
+        layout['tile_shape'] = (tags[323][0], tags[322][0])
+        return layout
+
+    offsets, counts = tags.get(273), tags.get(279)
+    if not offsets or not counts:
+        return None
+    for n in range(len(offsets) - 1):
+        if offsets[n] + counts[n] != offsets[n + 1]:
+            return None  # strips are not stored back to back
+    if sum(counts) < int(np.prod(shape)) * dtype.itemsize:
+        return None
+    layout['offset'] = offsets[0]
+    return layout
+
+
+class MmapTiffFrameSource(FrameSource):
+    """
+    Frames of an uncompressed TIFF stack, read through a memory map.
+
+    Pages stored as one contiguous block of pixels are returned as read-only
+    numpy views into the memory map, so reading a frame costs no decoding and
+    no copy; the operating system pages the data in from disk as it is used.
+    Tiled pages are assembled from their tiles with a single copy.
+
+    ImageJ writes stacks larger than 4 GB with a single IFD, followed by all
+    frames back to back. Those are recognised from the 'images=' entry in the
+    ImageJ description.
+
+    Use open_tiff_frames() to get this reader when the file allows it and a
+    TiffFrameSource otherwise.
+
+    Args:
+        path (str): Path to the .tif file
+
+    Raises:
+        ValueError: The file is compressed or otherwise can not be read
+            without decoding.
+    """
+    def __init__(self, path):
+        self.path = path
+        order, pages = _read_tiff_ifds(path)
+        if not pages:
+            raise ValueError(str(path) + ' is not a classic TIFF file')
+        layouts = [_tiff_page_layout(order, tags) for tags in pages]
+        if any(layout is None for layout in layouts):
+            raise ValueError(str(path) + ' has compressed or unsupported pages')
+
+        description = pages[0].get(270, '')
+        images = re.search(r'images=([0-9]+)', description) \
+            if isinstance(description, str) and description.startswith('ImageJ') else None
+        if len(layouts) == 1 and images and 'offset' in layouts[0]:
+            first = layouts[0]
+            frame_bytes = int(np.prod(first['shape'])) * first['dtype'].itemsize
+            layouts = [dict(first, offset=first['offset'] + t * frame_bytes)
+                       for t in range(int(images.group(1)))]
+
+        self._layouts = layouts
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def get_frame(self, t):
+        layout = self._layouts[t]
+        shape, dtype = layout['shape'], layout['dtype']
+        if 'offset' in layout:
+            return np.ndarray(shape, dtype=dtype, buffer=self._map,
+                              offset=layout['offset'])
+
+        tile_h, tile_w = layout['tile_shape']
+        height, width = shape[:2]
+        tile_shape = (tile_h, tile_w) + shape[2:]
+        tiles_across = -(-width // tile_w)
+        frame = np.empty(shape, dtype=dtype)
+        for n, offset in enumerate(layout['tiles']):
+            y, x = (n // tiles_across) * tile_h, (n % tiles_across) * tile_w
+            tile = np.ndarray(tile_shape, dtype=dtype, buffer=self._map,
+                              offset=offset)
+            frame[y:y + tile_h, x:x + tile_w] = tile[:height - y, :width - x]
+        return frame
+
+
+def open_tiff_frames(path):
+    """
+    Opens a TIFF stack with the fastest reader that can handle it.
+
+    Uncompressed stacks are memory-mapped (MmapTiffFrameSource), compressed
+    stacks are decoded with PIL (TiffFrameSource).
+
+    Args:
+        path (str): Path to the .tif file
+
+    Returns:
+        FrameSource
+    """
+    try:
+        return MmapTiffFrameSource(path)
+    except (ValueError, KeyError, IndexError, struct.error):
+        return TiffFrameSource(path)
+
+
+def open_frame_source(path, series=None):
+    """
+    Opens the right FrameSource for a path.
+
+    Args:
+        path (str): A .tif file, a .zarr store or a .lif file
+        series (int): Index of the image series, required for .lif files
+
+    Returns:
+        FrameSource
+    """
+    if is_zarr_stack(path):
+        return ZarrFrameSource(path)
+    if str(path).lower().endswith('.lif'):
+        if series is None:
+            raise ValueError('A series index is required to read frames '
+                             'from a LIF file.')
+        return LifFrameSource(path, series)
+    return open_tiff_frames(path)
+
+
+# The camera and interval of the microscope the tools were written for,
+# used for what an image does not tell
+DEFAULT_CALIBRATION = (1392, 1040, 1.843, 1.843, 300.0)
+
+ImageCalibration = namedtuple('ImageCalibration',
+                              'width height pixel_width pixel_height frame_interval')
+ImageCalibration.__doc__ = """
+Size and calibration of the frames of an image series, None where unknown.
+
+Attributes:
+    width, height (int): Frame size in pixels
+    pixel_width, pixel_height (float): Microns per pixel
+    frame_interval (float): Seconds between frames
+"""
+
+# Microns per unit, and seconds per unit, of the units found in metadata
+_LENGTH_UNITS = {'nm': 1e-3, 'nanometer': 1e-3, 'um': 1.0, 'micron': 1.0, 'microns': 1.0,
+                 '\u00b5m': 1.0, '\u03bcm': 1.0, '\\u00b5m': 1.0, 'mm': 1e3, 'cm': 1e4,
+                 'm': 1e6}
+_TIME_UNITS = {'ms': 1e-3, 's': 1.0, 'sec': 1.0, 'min': 60.0, 'h': 3600.0}
+# Pixels larger than this are display resolutions (72 dpi is 353 microns),
+# not a calibration
+_MAX_PIXEL_SIZE = 100.0
+
+
+def lif_calibration(image):
+    """
+    The calibration of a LIF image series, from the dimensions and scale
+    that readlif reads from the LIF metadata.
+
+    Args:
+        image (readlif.reader.LifImage): The image series
+
+    Returns:
+        ImageCalibration
+    """
+    # A namedtuple (x, y, z, t, m), or a plain (x, y, z, t) tuple in older readlif
+    dims = getattr(image, 'dims', None)
+    width = int(dims[0]) if dims is not None else None
+    height = int(dims[1]) if dims is not None else None
+    # Pixels per micron in x, y and z, and frames per second
+    scale = tuple(getattr(image, 'scale', None) or ()) + (None,) * 4
+    pixel_width, pixel_height, frame_interval = [1.0 / value if value else None
+                                                 for value in (scale[0], scale[1], scale[3])]
+    return ImageCalibration(width, height, pixel_width, pixel_height, frame_interval)
+
+
+def tiff_calibration(path):
+    """
+    The calibration of a TIFF stack, from the tags of its first page.
+
+    The pixel size comes from the OME-XML or ImageJ description, or the
+    XResolution and YResolution tags in centimeters or inches; the frame
+    interval from the OME-XML TimeIncrement or ImageJ finterval.
+
+    Args:
+        path (str): Path to the .tif file
+
+    Returns:
+        ImageCalibration
+    """
+    try:
+        _, pages = _read_tiff_ifds(path, max_pages=1)
+    except (OSError, struct.error):
+        pages = None
+    if not pages:
+        return ImageCalibration(None, None, None, None, None)
+    tags = pages[0]
+    width = tags[256][0] if 256 in tags else None
+    height = tags[257][0] if 257 in tags else None
+    description = tags.get(270, '')
+    description = description if isinstance(description, str) else ''
+    pixel_width = pixel_height = frame_interval = None
+
+    if '<OME' in description:
+        sizes = []
+        for axis in ('X', 'Y'):
+            size = re.search(r'PhysicalSize' + axis + r'="([^"]+)"', description)
+            unit = re.search(r'PhysicalSize' + axis + r'Unit="([^"]+)"', description)
+            factor = _LENGTH_UNITS.get(unit.group(1).lower() if unit else 'um')
+            sizes.append(float(size.group(1)) * factor if size and factor else None)
+        pixel_width, pixel_height = sizes
+        increment = re.search(r'TimeIncrement="([^"]+)"', description)
+        unit = re.search(r'TimeIncrementUnit="([^"]+)"', description)
+        factor = _TIME_UNITS.get(unit.group(1) if unit else 's')
+        if increment and factor:
+            frame_interval = float(increment.group(1)) * factor
+    elif 282 in tags and 283 in tags:
+        # Pixels per unit
+        resolution_unit = tags.get(296, (2,))[0]
+        factor = {2: 25400.0, 3: 1e4}.get(resolution_unit)
+        if description.startswith('ImageJ'):
+            unit = re.search(r'^unit=(.+)$', description, re.MULTILINE)
+            factor = _LENGTH_UNITS.get(unit.group(1).strip().lower()) if unit else None
+        if factor:
+            pixel_width, pixel_height = [factor / tags[tag][0] if tags[tag][0] else None
+                                         for tag in (282, 283)]
+    if description.startswith('ImageJ'):
+        interval = re.search(r'^finterval=([0-9.eE+-]+)$', description, re.MULTILINE)
+        if interval:
+            frame_interval = float(interval.group(1))
+
+    if not (pixel_width and pixel_width <= _MAX_PIXEL_SIZE):
+        pixel_width = pixel_height = None
+    return ImageCalibration(width, height, pixel_width, pixel_height or pixel_width,
+                            frame_interval or None)
+
+
+def complete_calibration(calibration, name=''):
+    """
+    Fills in what a calibration is missing from DEFAULT_CALIBRATION, with a
+    warning, as positions and speeds in the XML files are then only right
+    for the default microscope.
+
+    Args:
+        calibration (ImageCalibration): From lif_calibration() or
+            tiff_calibration(), or None
+        name (str): The image, for the warning
+
+    Returns:
+        ImageCalibration: Without None values
+    """
+    calibration = calibration or ImageCalibration(None, None, None, None, None)
+    missing = [field for field, value in zip(calibration._fields, calibration)
+               if value is None]
+    if not missing:
+        return calibration
+    filled = ImageCalibration(*[default if value is None else value
+                                for value, default in zip(calibration, DEFAULT_CALIBRATION)])
+    if set(missing) & {'pixel_width', 'pixel_height', 'frame_interval'}:
+        print('Warning: ' + str(name) + ' has no ' + ', '.join(missing) + ' in its metadata, '
+              'using ' + ', '.join(field + ' ' + str(getattr(filled, field))
+                                   for field in missing))
+    return filled
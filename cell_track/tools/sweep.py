@@ -0,0 +1,258 @@
+"""
+Parameter sweeps over the cached raw detections, `python -m cell_track sweep`.
+
+Detection keeps the raw boxes and scores of every frame in the
+.detections.jsonl log next to the image stack (see checkpoint.DetectionLog).
+The settings after the network (the score cutoff, the center distance of
+box.filter_boxes() and the linking distances of the tracker) can therefore
+be tried without running the network again. For every point of a grid of
+these settings, the sweep filters the logged detections, links them with
+the Python tracker of linking, applies the track filters, and summarizes
+the tracks:
+
+    python -m cell_track sweep -f /data/results/Exp1 --score 0.1,0.2,0.3 --linking 30,40,50
+
+The grid points are run in a pool of worker processes. Each worker reads
+the logs once, and gets all points with the same score cutoff and center
+distance in one job, so it filters the detections once for them.
+"""
+import glob
+import itertools
+import multiprocessing
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from cell_track.tools.analytics import Trajectories, track_metrics
+from cell_track.tools.box import get_box_center
+from cell_track.tools.checkpoint import DETECTION_LOG_EXT, DetectionLog
+from cell_track.tools.linking import (GAP_CLOSING_MAX_DISTANCE, LINKING_MAX_DISTANCE,
+                                      MAX_FRAME_GAP, TRACK_FILTERS, link_spots,
+                                      passes_filters, track_features)
+from cell_track.tools.metrics import METRICS
+from cell_track.tools.stack_io import DEFAULT_CALIBRATION
+
+# The settings of the pipeline, and the order of the grid columns
+DEFAULT_PARAMS = {'score_threshold': 0.2, 'center_distance': 20,
+                  'linking_max_distance': LINKING_MAX_DISTANCE,
+                  'gap_closing_max_distance': GAP_CLOSING_MAX_DISTANCE,
+                  'max_frame_gap': MAX_FRAME_GAP}
+
+
+def default_grid():
+    """The grid of python -m cell_track sweep, around the settings of the pipeline."""
+    return {'score_threshold': [0.1, 0.2, 0.3], 'center_distance': [10, 20, 30],
+            'linking_max_distance': [20.0, 40.0, 60.0]}
+
+
+def grid_points(grid):
+    """
+    The points of a grid, ordered so that points with the same box
+    filtering settings follow each other.
+
+    Args:
+        grid (dict): parameter: list of values, see DEFAULT_PARAMS for the
+            parameters. Missing parameters keep their default.
+
+    Returns:
+        list: A dict of all parameters for each point
+    """
+    for name in grid:
+        if name not in DEFAULT_PARAMS:
+            raise ValueError('Unknown sweep parameter: ' + str(name))
+    names = list(DEFAULT_PARAMS)
+    values = [list(grid.get(name) or [DEFAULT_PARAMS[name]]) for name in names]
+    return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+
+def stack_calibration(log_path):
+    """
+    The pixel size (microns) and frame interval (seconds) of the stack of a
+    detection log, from the ImageData of the XML file the detector wrote
+    next to it, or of the .trackmate.xml file that replaces it once Fiji has
+    tracked the stack. Falls back to those of stack_io.DEFAULT_CALIBRATION.
+    """
+    stack_path = log_path[:-len(DETECTION_LOG_EXT)]
+    pixel_size, frame_interval = DEFAULT_CALIBRATION[2], DEFAULT_CALIBRATION[4]
+    for xml_path in (stack_path + '.xml', stack_path + '.trackmate.xml'):
+        if os.path.exists(xml_path):
+            break
+    else:
+        print('Warning: no XML file next to ' + log_path + ', using the default calibration')
+        return pixel_size, frame_interval
+    # The ImageData is in the settings at the end of the file
+    with open(xml_path, 'rb') as f:
+        f.seek(max(os.path.getsize(xml_path) - 16384, 0))
+        tail = f.read().decode('utf-8', 'replace')
+    image_data = re.search(r'<ImageData\s([^>]*)>', tail)
+    if image_data:
+        attributes = dict(re.findall(r'(\w+)="([^"]*)"', image_data.group(1)))
+        pixel_size = float(attributes.get('pixelwidth', pixel_size))
+        frame_interval = float(attributes.get('timeinterval', frame_interval))
+    return pixel_size, frame_interval
+
+
+def detection_spots(detections, score_threshold=0.2, center_distance=20,
+                    frame_interval=DEFAULT_CALIBRATION[4]):
+    """
+    Filters logged detections like detection does, and turns the passed
+    boxes into spots as the detector writes them to the XML file.
+
+    Args:
+        detections (dict): frame: (boxes, scores), as from DetectionLog.read()
+        score_threshold (float): Minimum score of a detection
+        center_distance (float): See box.filter_boxes()
+        frame_interval (float): Seconds per frame, for POSITION_T
+
+    Returns:
+        dict: frame: list of (id, x, y, t, quality), as from linking.read_spots()
+    """
+    from cell_track.tools.track_image import filter_detections
+    frames = {}
+    spot_id = 0
+    for frame in sorted(detections):
+        boxes, scores = detections[frame]
+        passed_boxes, passed_scores = filter_detections(boxes, scores, score_threshold,
+                                                        center_distance)
+        spots = []
+        for box, score in zip(passed_boxes, passed_scores):
+            x, y = get_box_center(box)
+            spots.append((str(spot_id), float(x), float(y), frame * frame_interval,
+                          float(score)))
+            spot_id += 1
+        frames[frame] = spots
+    return frames
+
+
+def summarize_tracks(frames, params, filters=TRACK_FILTERS,
+                     pixel_size=DEFAULT_CALIBRATION[2], frame_interval=DEFAULT_CALIBRATION[4]):
+    """
+    Links the spots of a stack and summarizes the tracks that pass the
+    track filters.
+
+    Returns:
+        (dict, Trajectories): The counts n_spots, n_tracks and n_filtered,
+            and the spots of the filtered tracks in microns and seconds
+    """
+    tracks = link_spots(frames, params['linking_max_distance'],
+                        params['gap_closing_max_distance'], params['max_frame_gap'])
+    kept = [track for track_id, track in enumerate(tracks)
+            if passes_filters(track_features(track, track_id), filters)]
+    rows = [(track_id, frame, spot[1], spot[2])
+            for track_id, track in enumerate(kept) for frame, spot in track]
+    table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    frame_numbers = table[:, 1].astype(np.int64)
+    trajectories = Trajectories(track_id=table[:, 0].astype(np.int64), frame=frame_numbers,
+                                t=frame_numbers * frame_interval,
+                                x=table[:, 2] * pixel_size, y=table[:, 3] * pixel_size)
+    counts = {'n_spots': sum(len(spots) for spots in frames.values()),
+              'n_tracks': len(tracks), 'n_filtered': len(kept)}
+    return counts, trajectories
+
+
+# Per worker process: the detections and calibration of every log, and the
+# spots of the last box filtering settings
+_detections = {}
+_calibrations = {}
+_spots = {}
+
+
+def _load_logs(log_paths):
+    _detections.clear()
+    _spots.clear()
+    for path in log_paths:
+        _detections[path] = DetectionLog(path).read()
+        _calibrations[path] = stack_calibration(path)
+
+
+def run_point(params, filters=TRACK_FILTERS, pixel_size=None, frame_interval=None):
+    """
+    Runs one grid point over the logs loaded in this process.
+
+    Args:
+        params (dict): The grid point, see grid_points()
+        filters (tuple): Track filters, see linking.passes_filters()
+        pixel_size (float): Microns per pixel, by default that of each stack,
+            see stack_calibration()
+        frame_interval (float): Seconds per frame, by default that of each stack
+
+    Returns:
+        dict: The parameters, the counts of summarize_tracks() summed over
+            the stacks, and the median speed (um/s), straightness, max
+            displacement (um) and number of spots of the filtered tracks
+    """
+    calibrations = {path: (pixel_size or calibration[0], frame_interval or calibration[1])
+                    for path, calibration in _calibrations.items()}
+    key = (params['score_threshold'], params['center_distance'])
+    if key not in _spots:
+        _spots.clear()
+        _spots[key] = {path: detection_spots(detections, key[0], key[1],
+                                             calibrations[path][1])
+                       for path, detections in _detections.items()}
+    totals = {'n_spots': 0, 'n_tracks': 0, 'n_filtered': 0}
+    metrics = []
+    for path in sorted(_spots[key]):
+        counts, trajectories = summarize_tracks(_spots[key][path], params, filters,
+                                                *calibrations[path])
+        for name, value in counts.items():
+            totals[name] += value
+        metrics.append(track_metrics(trajectories))
+    metrics = pd.concat(metrics) if metrics else pd.DataFrame()
+    result = dict(params, **totals)
+    for column, name in (('mean_speed', 'median_speed'), ('straightness', 'median_straightness'),
+                         ('max_displacement', 'median_max_displacement'),
+                         ('n_spots', 'median_track_spots')):
+        result[name] = float(metrics[column].median()) if len(metrics) else float('nan')
+    return result
+
+
+def _sweep_worker(args):
+    points, filters, pixel_size, frame_interval = args
+    return [run_point(params, filters, pixel_size, frame_interval) for params in points]
+
+
+def find_logs(folder):
+    """The detection logs in a folder and its subfolders."""
+    return sorted(glob.glob(os.path.join(folder, '**', '*' + DETECTION_LOG_EXT),
+                            recursive=True))
+
+
+def sweep(log_paths, grid, workers=None, filters=TRACK_FILTERS, pixel_size=None,
+          frame_interval=None):
+    """
+    Runs every point of a grid over the detection logs.
+
+    Args:
+        log_paths (list): The .detections.jsonl files
+        grid (dict): parameter: list of values, see grid_points()
+        workers (int): Number of processes, defaults to the number of cores
+        filters (tuple): Track filters, see linking.passes_filters()
+        pixel_size (float): Microns per pixel, by default that of each stack
+        frame_interval (float): Seconds per frame, by default that of each stack
+
+    Returns:
+        pandas.DataFrame: One row per grid point, see run_point()
+    """
+    if not log_paths:
+        raise ValueError('No detection logs to sweep over')
+    points = grid_points(grid)
+    # One job per box filtering setting, so the detections are filtered once
+    # for all of its points
+    jobs = [(list(group), tuple(filters), pixel_size, frame_interval)
+            for key, group in itertools.groupby(
+                points, lambda point: (point['score_threshold'], point['center_distance']))]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    with METRICS.timer('sweep'):
+        if workers > 1:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(workers, initializer=_load_logs,
+                              initargs=(list(log_paths),)) as pool:
+                results = pool.map(_sweep_worker, jobs, chunksize=1)
+        else:
+            _load_logs(log_paths)
+            results = [_sweep_worker(job) for job in jobs]
+    results = [result for job_results in results for result in job_results]
+    METRICS.count('sweep.points', len(points))
+    return pd.DataFrame(results, columns=list(results[0]))
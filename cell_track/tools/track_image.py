@@ -1,37 +1,399 @@
+import multiprocessing
 import os
+import queue
+import shutil
 import numpy as np
-import time
 from cell_track.tools.trackmate import trackmateXML
 from cell_track.tools.box import filter_boxes
-from keras_retinanet.utils.image import preprocess_image, resize_image
-import keras
-from readlif.reader import LifFile
+from cell_track.tools.spot_features import box_features
+from cell_track.tools.checkpoint import DetectionLog, DETECTION_LOG_EXT, atomic_path
+from cell_track.tools.manifest import file_fingerprint
+from cell_track.tools.metrics import METRICS, Progress
+from cell_track.tools.stack_io import (TiffStackWriter, ZarrStackWriter, ZARR_EXT,
+                                       TIFF_EXT, complete_calibration, lif_calibration,
+                                       open_tiff_frames, tiff_calibration)
+import cv2
 
-#Todo: Reduce code redundancy between the functions
-def track_lif(lif_path: str, out_path: str , model: keras.models.Model) -> None:
+# Per channel (BGR) means subtracted by keras_retinanet's 'caffe' preprocessing
+BGR_MEANS = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+# Rough memory of a detection worker for --max-memory: the tensorflow runtime,
+# plus the input and activations of the network for each frame of a batch
+# (800 x 1333 after resizing).
+TF_RUNTIME_BYTES = 512 * 1024 ** 2
+FRAME_INFERENCE_BYTES = 1024 ** 3
+
+
+def detection_worker_bytes(model_path, batch_size=1):
+    """
+    Estimates the memory of a detection worker process.
+
+    Args:
+        model_path (str): Path of the model the worker loads
+        batch_size (int): Frames per call of the network
+
+    Returns:
+        int: Bytes
+    """
+    # The weights are held twice while the model is loaded
+    return (2 * os.path.getsize(model_path) + TF_RUNTIME_BYTES +
+            batch_size * FRAME_INFERENCE_BYTES)
+
+
+def compute_resize_scale(shape, min_side=800, max_side=1333):
+    """
+    Computes the scale keras_retinanet.utils.image.resize_image would use.
+
+    Args:
+        shape (tuple): Shape of the image, (rows, cols, ...)
+        min_side (int): Target size of the smallest side
+        max_side (int): Maximum size of the largest side
+
+    Returns:
+        float: The resize scale
+    """
+    rows, cols = shape[:2]
+    scale = min_side / min(rows, cols)
+    if max(rows, cols) * scale > max_side:
+        scale = max_side / max(rows, cols)
+    return scale
+
+
+class BatchBuffer:
+    """
+    Reusable float32 input batch for model.predict_on_batch().
+
+    The buffer is only reallocated when the image size or batch size
+    changes, so a stack of equally sized frames reuses the same memory.
+
+    Attributes:
+        array (numpy.ndarray): The (batch, y, x, 3) input batch
+    """
+    def __init__(self):
+        self.array = None
+
+    def get(self, batch_size, height, width):
+        """Returns the (batch_size, height, width, 3) buffer, reallocating if needed."""
+        shape = (batch_size, height, width, 3)
+        if self.array is None or self.array.shape != shape:
+            self.array = np.empty(shape, dtype=np.float32)
+        return self.array
+
+
+def preprocess_frame(frame, buffer=None, index=0, batch_size=1):
+    """
+    Prepares a frame for the network, in as few passes over it as possible.
+
+    This gives the same result as converting the frame with PIL to RGB,
+    flipping it to BGR and calling keras_retinanet's preprocess_image() and
+    resize_image(). Phase contrast frames are single channel, so instead of
+    expanding them to three channels first, the single channel is converted
+    to float32 and resized, and the channel means are subtracted while
+    broadcasting it into the three channels of the (reusable) input batch.
+
+    Args:
+        frame (numpy.ndarray): (y, x) grayscale or (y, x, 3) RGB frame.
+            Values outside 0-255 are clipped, as PIL's convert('RGB') does.
+        buffer (BatchBuffer): Where to write the preprocessed frame.
+            A new buffer is used if None.
+        index (int): Position of the frame in the batch
+        batch_size (int): Number of frames in the batch
+
+    Returns:
+        (numpy.ndarray, float): The input batch and the resize scale
+    """
+    if buffer is None:
+        buffer = BatchBuffer()
+    frame = np.asarray(frame)
+    if frame.dtype != np.uint8:
+        frame = np.clip(frame, 0, 255)
+    if frame.ndim == 3:
+        frame = frame[:, :, ::-1]  # RGB to BGR, a view
+    scale = compute_resize_scale(frame.shape)
+    resized = cv2.resize(frame.astype(np.float32), None, fx=scale, fy=scale)
+    batch = buffer.get(batch_size, resized.shape[0], resized.shape[1])
+    if resized.ndim == 2:
+        resized = resized[:, :, np.newaxis]
+    np.subtract(resized, BGR_MEANS, out=batch[index])
+    return batch, scale
+
+
+def predict_frame(model, frame, buffer=None, min_score=0.05):
+    """
+    Runs the network on a single frame and returns the raw detections.
+
+    Args:
+        model (keras.models.Model): A trained keras.models.Model object
+        frame (numpy.ndarray): (y, x) grayscale or (y, x, 3) RGB frame
+        buffer (BatchBuffer): Reusable input batch, see preprocess_frame()
+        min_score (float): Detections below this score are dropped, this
+            also drops the padding in the network output.
+
+    Returns:
+        Two lists: boxes (list of boxes in frame coordinates), and scores (list)
+    """
+    return predict_frames(model, [frame], buffer, min_score)[0]
+
+
+def predict_frames(model, frames, buffer=None, min_score=0.05):
+    """
+    Runs the network on a batch of frames and returns the raw detections.
+
+    Args:
+        model (keras.models.Model): A trained keras.models.Model object
+        frames (list): Frames of the same size, see predict_frame()
+        buffer (BatchBuffer): Reusable input batch, see preprocess_frame()
+        min_score (float): Detections below this score are dropped
+
+    Returns:
+        list: (boxes, scores) for each frame, as from predict_frame()
+    """
+    if buffer is None:
+        buffer = BatchBuffer()
+    # preprocess images for network
+    scales = []
+    with METRICS.timer('detect.preprocess'):
+        for index, frame in enumerate(frames):
+            batch, scale = preprocess_frame(frame, buffer, index, len(frames))
+            scales.append(scale)
+
+    # process images
+    with METRICS.timer('detect.inference'):
+        boxes, scores, labels = model.predict_on_batch(batch)
+
+    detections = []
+    for index, scale in enumerate(scales):
+        keep = scores[index] >= min_score
+        # correct for image scale
+        detections.append(((boxes[index][keep] / scale).tolist(),
+                           scores[index][keep].tolist()))
+    return detections
+
+
+def detect_frames(model, frames, done_frames, detection_log, batch_size=1,
+                  buffer=None):
+    """
+    Runs the network on the frames of a stack in batches, skipping the frames
+    detected before an interruption.
+
+    Args:
+        model (keras.models.Model): A trained keras.models.Model object
+        frames (iterable): (i, frame) for every frame, in order. frame may be
+            None if i is in done_frames.
+        done_frames (dict): i: (boxes, scores) of the frames detected
+            before, see checkpoint.DetectionLog.read()
+        detection_log (checkpoint.DetectionLog): New detections are logged here
+        batch_size (int): Number of frames sent to the network at once
+        buffer (BatchBuffer): Reusable input batch, see preprocess_frame()
+
+    Returns:
+        generator: (i, boxes, scores) for every frame, in order
+    """
+    pending = []
+    todo = []
+    for i, frame in frames:
+        pending.append(i)
+        if i not in done_frames:
+            todo.append((i, frame))
+        # Frames detected before are passed on at once, unless they wait
+        # behind frames of an unfinished batch
+        if todo and len(todo) < batch_size:
+            continue
+        for item in _detect_pending(model, pending, todo, done_frames,
+                                    detection_log, buffer):
+            yield item
+        pending, todo = [], []
+    for item in _detect_pending(model, pending, todo, done_frames,
+                                detection_log, buffer):
+        yield item
+
+
+def _detect_pending(model, pending, todo, done_frames, detection_log, buffer):
+    detections = {}
+    if todo:
+        results = predict_frames(model, [frame for i, frame in todo], buffer)
+        for (i, frame), (boxes, scores) in zip(todo, results):
+            detection_log.append(i, boxes, scores)
+            detections[i] = (boxes, scores)
+    for i in pending:
+        boxes, scores = detections[i] if i in detections else done_frames[i]
+        yield i, boxes, scores
+
+
+def _keep_frames(frames, kept):
+    """Yields (i, frame) of frames, keeping each frame in kept by i until it is taken out."""
+    for i, frame in frames:
+        kept[i] = frame
+        yield i, frame
+
+
+def frame_features(frame, boxes):
+    """
+    The spot features of the passed boxes of a frame, see
+    spot_features.box_features(), or None without the frame.
+    """
+    if frame is None:
+        return None
+    with METRICS.timer('detect.features'):
+        return box_features(frame, boxes)
+
+
+def filter_detections(boxes, scores, score_threshold=0.2, center_distance=20):
+    """
+    Filters raw detections by score and removes overlapping boxes.
+
+    Args:
+        boxes (list): Boxes in the form (x1, y1, x2, y2)
+        scores (list): The score of each box
+        score_threshold (float): Minimum score of a detection
+        center_distance (float): See box.filter_boxes()
+
+    Returns:
+        Two lists: passed_boxes (list of boxes), and passed_scores (list),
+            after filtering with box.filter_boxes.
+    """
+    pre_passed_boxes = []
+    pre_passed_scores = []
+    for box, score in zip(boxes, scores):
+        if score >= score_threshold:
+            pre_passed_boxes.append(box)
+            pre_passed_scores.append(score)
+
+    return filter_boxes(
+        in_boxes=pre_passed_boxes, in_scores=pre_passed_scores,
+        _passed_boxes=[], _passed_scores=[],  # These are necessary
+        center_distance=center_distance)
+
+
+def detect_frame(model, frame, buffer=None, score_threshold=0.2):
+    """
+    Finds the cells in a single frame.
+
+    Args:
+        model (keras.models.Model): A trained keras.models.Model object
+        frame (numpy.ndarray): (y, x) grayscale or (y, x, 3) RGB frame
+        buffer (BatchBuffer): Reusable input batch, see preprocess_frame()
+        score_threshold (float): Minimum score of a detection
+
+    Returns:
+        Two lists: passed_boxes (list of boxes), and passed_scores (list),
+            after filtering with box.filter_boxes.
+    """
+    boxes, scores = predict_frame(model, frame, buffer)
+    return filter_detections(boxes, scores, score_threshold)
+
+
+def iter_lif_series(lif_data):
+    """
+    Iterates over the image series in a LIF file, with their output paths.
+
+    The output path mirrors the folder structure inside the LIF file, without
+    the name of the LIF file itself. It has no extension, the image stack and
+    the trackmate XML files are named by adding one.
+
+    Args:
+        lif_data (readlif.reader.LifFile): The opened LIF file
+
+    Returns:
+        generator: (index, image, folder_path, path) for every series, where
+            index is the series index, image the readlif LifImage, folder_path
+            the output folder and path the output file path without extension.
+            Both paths are relative to the output directory.
+    """
+    for index, image in enumerate(lif_data.get_iter_image()):
+        folder_path = "/".join(str(image.path).strip("/").split('/')[1:])
+        path = folder_path + "/" + str(image.name)
+        yield index, image, folder_path, path
+
+
+def _read_lif_frames(image, stack_writer):
+    """Yields (i, frame) for the frames of a LIF series, adding them to the stack_writer."""
+    for i in range(1, int(image.nt) + 1):
+        # Frames detected before the last interruption are decoded too, the
+        # spot features are measured on them.
+        with METRICS.timer('detect.decode'):
+            frame = image.get_frame(t=i - 1)
+        if stack_writer is not None:
+            with METRICS.timer('detect.write'):
+                stack_writer.append(frame)
+        yield i, frame
+
+
+def track_lif(lif_path: str, out_path: str , model: 'keras.models.Model',
+              out_format: str = 'tiff', manifest=None,
+              model_hash: str = '', series=None, low_memory: bool = False,
+              batch_size: int = 1) -> None:
     """
     Applies ML model (model object) to everything in the lif file.
 
     This will write a trackmate xml file via the method tm_xml.write_xml(),
-    and save output tiff image stacks from the lif file.
+    and save output image stacks from the lif file.
 
     Args:
         lif_path (str): Path to the lif file
         out_path (str): Path to output directory
         model (str): A trained keras.models.Model object
+        out_format (str): 'tiff' writes each series as an LZW compressed
+            TIFF stack. 'zarr' writes each series as a chunked Zarr store
+            with one chunk per frame, see stack_io.ZarrStackWriter. 'none'
+            writes no image stack, the XML files are still named as if there
+            was a TIFF stack. Downstream stages then read the frames from the
+            LIF file, see stack_io.LifFrameSource.
+        manifest (manifest.RunManifest): If given, the 'detect' stage of every
+            series is recorded in it, and a series is only skipped if it was
+            detected from the same LIF file, with the same model and
+            settings. Otherwise a series is skipped if its XML file exists.
+        model_hash (str): Hash of the model, recorded in the manifest
+        series (list): If given, only the series with these paths (as from
+            iter_lif_series) are processed, e.g. a unit of a work_queue.
+        low_memory (bool): Write the TIFF stack frame by frame, and keep the
+            XML body in a temporary file, instead of holding the whole series
+            in memory until it is written. Used with --max-memory.
+        batch_size (int): Number of frames sent to the network at once, see
+            tuning.
 
     Returns: None
     """
+    if out_format not in ('tiff', 'zarr', 'none'):
+        raise ValueError("out_format must be 'tiff', 'zarr' or 'none'")
+    stack_ext = ZARR_EXT if out_format == 'zarr' else TIFF_EXT
+
+    from readlif.reader import LifFile
     print("loading LIF")
     lif_data = LifFile(lif_path)
+    lif_name = os.path.basename(lif_path)
+    if manifest is not None:
+        lif_hash = file_fingerprint(lif_path)
+        params = {'out_format': out_format, 'score_threshold': 0.2}
     print("Iterating over lif")
-    for image in lif_data.get_iter_image():
-        folder_path = "/".join(str(image.path).strip("/").split('/')[1:])
-        path = folder_path + "/" + str(image.name)
+    for index, image, folder_path, path in iter_lif_series(lif_data):
+        if series is not None and path not in series:
+            continue
         name = image.name
+        stack_path = os.path.join(out_path, path + stack_ext)
+        xml_done = os.path.exists(stack_path + '.xml') \
+            or os.path.exists(stack_path + '.trackmate.xml')
 
-        if os.path.exists(os.path.join(out_path, path + '.tif.xml')) \
-           or os.path.exists(os.path.join(out_path, path + '.tif.trackmate.xml')):
+        if manifest is not None:
+            state = manifest.check(lif_name, path, 'detect', lif_hash,
+                                   model_hash, params)
+            if state == 'new' and xml_done:
+                # Finished before the manifest was used, adopt the outputs
+                manifest.mark_done(lif_name, path, 'detect', lif_hash,
+                                   model_hash, params)
+                state = 'current'
+            if state == 'current':
+                print(str(path) + ' is up to date, skipping')
+                continue
+            if state == 'stale':
+                print(str(path) + ' changed since the last run, redoing it')
+                for old_output in (stack_path + '.xml',
+                                   stack_path + '.trackmate.xml',
+                                   stack_path + DETECTION_LOG_EXT):
+                    if os.path.exists(old_output):
+                        os.remove(old_output)
+            manifest.start(lif_name, path, 'detect', lif_hash, model_hash, params)
+        elif xml_done:
             print(str(path) + '.xml' + ' exists, skipping')
             continue
 
@@ -39,62 +401,170 @@ def track_lif(lif_path: str, out_path: str , model: keras.models.Model) -> None:
         if not os.path.exists(make_dirs):
             os.makedirs(make_dirs)
 
-        print("Processing " + str(path))
-        start = time.time()
+        detection_log = DetectionLog(stack_path + DETECTION_LOG_EXT)
+        done_frames = detection_log.read()
+        if done_frames:
+            print("Resuming " + str(path) + " after frame " + str(max(done_frames)))
+        progress = Progress(str(path), image.nt)
+        cells = 0
         # initialize XML creation for this file
-        tm_xml = trackmateXML()
-        i = 1
-        image_out = image.get_frame()  # Initialize the output image
-        images_to_append = []
-        for frame in image.get_iter_t():
-            images_to_append.append(frame)
-            np_image = np.asarray(frame.convert('RGB'))
-            image_array = np_image[:, :, ::-1].copy()
-
-            tm_xml.filename = name + '.tif'
+        tm_xml = trackmateXML(spill_to_disk=low_memory,
+                              calibration=complete_calibration(lif_calibration(image), path))
+        buffer = BatchBuffer()
+        stack_writer = None
+        if out_format == 'zarr':
+            stack_writer = ZarrStackWriter(atomic_path(stack_path))
+        elif out_format == 'tiff' and low_memory:
+            stack_writer = TiffStackWriter(atomic_path(stack_path))
+        elif out_format == 'tiff':
+            image_out = image.get_frame()  # Initialize the output image
+            images_to_append = stack_writer = []
+        kept = {}
+        frames = _keep_frames(_read_lif_frames(image, stack_writer), kept)
+        for i, boxes, scores in detect_frames(model, frames, done_frames, detection_log,
+                                              batch_size, buffer):
+            tm_xml.filename = name + stack_ext
             tm_xml.imagepath = os.path.join(out_path, folder_path)
             if tm_xml.nframes < i:  # set nframes to the maximum i
                 tm_xml.nframes = i
             tm_xml.frame = i
-            # preprocess image for network
-            image_array = preprocess_image(image_array)
-            image_array, scale = resize_image(image_array)
+            with METRICS.timer('detect.filter'):
+                passed_boxes, passed_scores = filter_detections(boxes, scores)
+            cells += len(passed_boxes)
+            METRICS.count('detect.frames')
+            METRICS.count('detect.cells', len(passed_boxes))
+            progress.update(i, str(cells) + ' cells')
 
-            # process image
-            boxes, scores, labels = model.predict_on_batch(np.expand_dims(image_array, axis=0))
+            # tell the trackmate writer to add the passed_boxes to the final output xml
+            tm_xml.add_frame_spots(passed_boxes, passed_scores,
+                                   frame_features(kept.pop(i), passed_boxes))
+        detection_log.close()
+        # The XML file marks the series as done, so it is written last.
+        with METRICS.timer('detect.write'):
+            if out_format == 'tiff' and low_memory:
+                stack_writer.close()
+                os.replace(atomic_path(stack_path), stack_path)
+            elif out_format == 'tiff':
+                image_out.save(atomic_path(stack_path),
+                               format="tiff",
+                               append_images=images_to_append[1:],
+                               save_all=True,
+                               compression='tiff_lzw')
+                os.replace(atomic_path(stack_path), stack_path)
+            elif out_format == 'zarr':
+                if os.path.exists(stack_path):
+                    shutil.rmtree(stack_path)
+                os.replace(atomic_path(stack_path), stack_path)
+            tm_xml.write_xml()
+        progress.close()
+        METRICS.count('detect.series')
+        if manifest is not None:
+            manifest.finish(lif_name, path, 'detect')
 
-            # correct for image scale
-            boxes /= scale
 
-            # filter the detection boxes
-            pre_passed_boxes = []
-            pre_passed_scores = []
-            for box, score, label in zip(boxes[0], scores[0], labels[0]):
-                if score >= 0.2:
-                    pre_passed_boxes.append(box.tolist())
-                    pre_passed_scores.append(score.tolist())
+def _detection_worker(model_path, units, results, kwargs, cpus=None, budget=None):
+    from cell_track.tools import load_model
+    tuning = None
+    if cpus is not None:
+        from cell_track.tools.affinity import pin_to_cpus, replica_tuning
+        pin_to_cpus(cpus)
+        tuning = replica_tuning(cpus)
+    model = load_model(model_path, use_server=False, tuning=tuning)
+    for lif_path, out_path, path in iter(units.get, None):
+        track_lif(lif_path, out_path, model, series=[path], **kwargs)
+        if budget is not None:
+            budget.check(path)
+    results.put((METRICS.counters, METRICS.histograms))
 
-            passed_boxes, passed_scores = filter_boxes(
-                in_boxes=pre_passed_boxes, in_scores=pre_passed_scores,
-                _passed_boxes=[], _passed_scores=[])  # These are necessary
 
-            print("found " + str(len(passed_boxes)) + " cells in " +
-                  str(path) + " frame " + str(i))
+def track_lifs_parallel(jobs, model_path, workers, pin=False, budget=None, **kwargs):
+    """
+    Detects the series of LIF files in several worker processes, each with
+    its own copy of the model, see tuning.
 
-            # tell the trackmate writer to add the passed_boxes to the final output xml
-            tm_xml.add_frame_spots(passed_boxes, passed_scores)
-            i += 1
-        # write the image to trackmate, prepare for next image
-        print("processing time: ", time.time() - start)
-        tm_xml.write_xml()
-        image_out.save(os.path.join(out_path, path + '.tif'),
-                       format="tiff",
-                       append_images=images_to_append[1:],
-                       save_all=True,
-                       compression='tiff_lzw')
+    With pin, every worker runs on its own cores of one NUMA node, with as
+    many tensorflow threads as it has cores, see affinity.
+
+    With a memory budget, no more workers are started than fit in the memory
+    still free under the limit (see detection_worker_bytes()), and the
+    workers stream the frames (low_memory) and share the limit equally.
+
+    Series with an XML file are skipped. The workers don't record what they
+    did in a manifest, track_lif() adopts their outputs when it is run with
+    the manifest afterwards, and detects whatever a failed worker left.
+
+    Args:
+        jobs (list): (lif_path, out_path) of each LIF file, as for track_lif()
+        model_path (str): Path of the model, loaded by every worker
+        workers (int): Number of worker processes
+        pin (bool): Pin the workers to disjoint sets of cores
+        budget (memory.MemoryBudget): Memory limit of all workers together
+        **kwargs: out_format, low_memory and batch_size for track_lif()
+
+    Returns:
+        int: The number of series given to the workers
+    """
+    from readlif.reader import LifFile
+    stack_ext = ZARR_EXT if kwargs.get('out_format') == 'zarr' else TIFF_EXT
+    context = multiprocessing.get_context('spawn')
+    units = context.Queue()
+    results = context.Queue()
+    queued = 0
+    for lif_path, out_path in jobs:
+        for index, image, folder_path, path in iter_lif_series(LifFile(lif_path)):
+            stack_path = os.path.join(out_path, path + stack_ext)
+            if not (os.path.exists(stack_path + '.xml') or
+                    os.path.exists(stack_path + '.trackmate.xml')):
+                units.put((lif_path, out_path, path))
+                queued += 1
+    if not queued:
+        return 0
 
+    workers = min(workers, queued)
+    worker_budget = None
+    if budget is not None:
+        from cell_track.tools.memory import MemoryBudget
+        worker_bytes = detection_worker_bytes(model_path, kwargs.get('batch_size', 1))
+        fitting = budget.workers(worker_bytes, workers)
+        if fitting < workers:
+            print('Using %d instead of %d detection workers to stay under --max-memory'
+                  % (fitting, workers))
+            workers = fitting
+        worker_budget = MemoryBudget(budget.limit // workers)
+        kwargs['low_memory'] = True
+    cpu_sets = [(None, None)] * workers
+    if pin:
+        from cell_track.tools.affinity import format_cpulist, replica_cpu_sets
+        cpu_sets = replica_cpu_sets(workers)
+        for worker, (node, cpus) in enumerate(cpu_sets):
+            print('Worker ' + str(worker) + ': node ' + str(node) +
+                  ', cpus ' + format_cpulist(cpus))
+    processes = [context.Process(target=_detection_worker,
+                                 args=(model_path, units, results, kwargs, cpus,
+                                       worker_budget))
+                 for node, cpus in cpu_sets]
+    for process in processes:
+        units.put(None)
+        process.start()
+    print('Detecting ' + str(queued) + ' series in ' + str(len(processes)) +
+          ' worker processes')
+    merged = 0
+    while merged < len(processes):
+        try:
+            METRICS.merge(*results.get(timeout=5))
+            merged += 1
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            print('A detection worker failed with exit code ' + str(process.exitcode))
+    return queued
 
-def track_tiff_folder(tiff_folder: str, model: keras.models.Model) -> None:
+
+def track_tiff_folder(tiff_folder: str, model: 'keras.models.Model',
+                      low_memory: bool = False, batch_size: int = 1) -> None:
     """
     Applies ML model (model object) to every tiff file in the directory.
 
@@ -105,10 +575,13 @@ def track_tiff_folder(tiff_folder: str, model: keras.models.Model) -> None:
         lif_path (str): Path to the lif file
         out_path (str): Path to output directory
         model (keras.models.Model): A trained keras.models.Model object
+        low_memory (bool): Keep the XML body in a temporary file instead of
+            in memory. Used with --max-memory.
+        batch_size (int): Number of frames sent to the network at once, see
+            tuning.
 
     Returns: None
     """
-    from PIL import Image, ImageSequence
     for file in os.listdir(tiff_folder):
         if file.endswith(".tif"):
             filepath = os.path.join(tiff_folder, file)
@@ -116,52 +589,42 @@ def track_tiff_folder(tiff_folder: str, model: keras.models.Model) -> None:
                 print(str(file) + '.xml' + ' exists, skipping')
             else:
 
-                # load image
-                PIL_image = Image.open(filepath)
-                print("Processing " + str(filepath))
-                start = time.time()
+                # load image, uncompressed stacks are memory-mapped
+                frames = open_tiff_frames(filepath)
+                detection_log = DetectionLog(filepath + DETECTION_LOG_EXT)
+                done_frames = detection_log.read()
+                progress = Progress(str(file), len(frames))
+                cells = 0
                 # initialize XML creation for this file
-                tm_xml = trackmateXML()
-                # i is the frame, page is the PIL image object
-                for i, page in enumerate(ImageSequence.Iterator(PIL_image)):
-                    # this is the read BGR thing
-                    np_image = np.asarray(page.convert('RGB'))
-                    image = np_image[:, :, ::-1].copy()
-
+                tm_xml = trackmateXML(spill_to_disk=low_memory,
+                                      calibration=complete_calibration(
+                                          tiff_calibration(filepath), file))
+                buffer = BatchBuffer()
+                # i is the frame, frame is the numpy array of the page
+                kept = {}
+                numbered = _keep_frames(enumerate(METRICS.timed_iter(frames, 'detect.decode')),
+                                        kept)
+                for i, boxes, scores in detect_frames(model, numbered, done_frames,
+                                                      detection_log, batch_size, buffer):
                     tm_xml.filename = file
                     tm_xml.imagepath = tiff_folder
                     if tm_xml.nframes < i:  # set nframes to the maximum i
                         tm_xml.nframes = i
                     tm_xml.frame = i
-                    # preprocess image for network
-                    image = preprocess_image(image)
-                    image, scale = resize_image(image)
-
-                    # process image
-                    boxes, scores, labels = model.predict_on_batch(np.expand_dims(image, axis=0))
-
-                    # correct for image scale
-                    boxes /= scale
-
-                    # filter the detection boxes
-                    pre_passed_boxes = []
-                    pre_passed_scores = []
-                    for box, score, label in zip(boxes[0], scores[0], labels[0]):
-                        if score >= 0.2:
-                            pre_passed_boxes.append(box.tolist())
-                            pre_passed_scores.append(score.tolist())
-
-                    passed_boxes, passed_scores = filter_boxes(
-                        in_boxes=pre_passed_boxes, in_scores=pre_passed_scores,
-                        _passed_boxes=[], _passed_scores=[])  # These are necessary
-
-                    print("found " + str(len(passed_boxes)) + " cells in " +
-                          str(file) + " frame " + str(i))
+                    with METRICS.timer('detect.filter'):
+                        passed_boxes, passed_scores = filter_detections(boxes, scores)
+                    cells += len(passed_boxes)
+                    METRICS.count('detect.frames')
+                    METRICS.count('detect.cells', len(passed_boxes))
+                    progress.update(i + 1, str(cells) + ' cells')
 
                     # tell the trackmate writer to add the passed_boxes to the final output xml
-                    tm_xml.add_frame_spots(passed_boxes, passed_scores)
+                    tm_xml.add_frame_spots(passed_boxes, passed_scores,
+                                           frame_features(kept.pop(i), passed_boxes))
 
-                # write the image to trackmate, prepare for next image
-                print("processing time: ", time.time() - start)
-                tm_xml.write_xml()
+                detection_log.close()
+                with METRICS.timer('detect.write'):
+                    tm_xml.write_xml()
+                progress.close()
+                METRICS.count('detect.series')
 
@@ -1,11 +1,23 @@
 import glob
+import json
+import multiprocessing
 import os
 import re
+import shutil
+import tempfile
+import time
+from collections import namedtuple
 from xml.etree import ElementTree as ET
 
+import numpy as np
 import pandas as pd
 
 from cell_track.tools.box import get_box_center
+from cell_track.tools.checkpoint import atomic_write
+from cell_track.tools.linking import TRACK_FILTERS
+from cell_track.tools.metrics import METRICS, Progress
+from cell_track.tools.stack_io import (DEFAULT_CALIBRATION, ImageCalibration, complete_calibration,
+                                      open_frame_source, to_rgb8)
 
 
 class Track:
@@ -136,74 +148,173 @@ class Track:
             self.lines.append(Line(start, end))
 
 
-def drawTrackmateVideo(infile, out_csv):
+TrackSpot = namedtuple('TrackSpot', 'id frame x y')
+TrackLine = namedtuple('TrackLine', 'x1y1 x2y2')
+FilteredTrack = namedtuple('FilteredTrack', 'id spot_objs lines')
+
+
+def read_filtered_tracks(inxml):
+    """
+    Reads the filtered tracks of a trackmate XML file, for drawing them.
+
+    This is a light version of building a Track for every track in the file:
+    the file is parsed incrementally and only the positions of the spots are
+    kept, so the whole XML tree is never in memory. The tracks have the id,
+    spot_objs and lines of Track, in the same order.
+
+    Args:
+        inxml (str): Path to the trackmate XML file
+
+    Returns:
+        list: A FilteredTrack for each track that passed the trackmate
+            filters, in the order of the file.
+    """
+    spots = {}  # ID: (order in the file, TrackSpot)
+    track_edges = {}
+    include = set()
+    edges = None
+    for event, elem in ET.iterparse(inxml, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'Track':
+                edges = []
+            continue
+        if elem.tag == 'Spot':
+            spot_id = elem.get('ID')
+            spots[spot_id] = (len(spots), TrackSpot(
+                spot_id, int(round(float(elem.get('FRAME')))),
+                int(round(float(elem.get('POSITION_X')))),
+                int(round(float(elem.get('POSITION_Y'))))))
+            elem.clear()
+        elif elem.tag == 'Edge':
+            edges.append((elem.get('SPOT_SOURCE_ID'), elem.get('SPOT_TARGET_ID')))
+            elem.clear()
+        elif elem.tag == 'Track':
+            track_edges[elem.get('TRACK_ID')] = edges
+            elem.clear()
+        elif elem.tag == 'TrackID':
+            include.add(elem.get('TRACK_ID'))
+        elif elem.tag in ('SpotsInFrame', 'AllTracks'):
+            elem.clear()
+
+    tracks = []
+    for track_id, edges in track_edges.items():
+        if track_id not in include:
+            continue
+        in_track = set(spot_id for pair in edges for spot_id in pair)
+        spot_objs = [spots[spot_id][1]
+                     for spot_id in sorted(in_track, key=lambda s: spots[s][0])]
+        lines = [TrackLine((spots[source][1].x, spots[source][1].y),
+                           (spots[target][1].x, spots[target][1].y))
+                 for source, target in edges]
+        tracks.append(FilteredTrack(track_id, spot_objs, lines))
+    return tracks
+
+
+def draw_track_overlay(page, frame_num, tracks, lines):
     """
-    Takes a tif file, with a matching trackmate file, and makes a mp4 video
-    of the tracked output. This will draw a spot ID, and a trail on the video.
+    Draws the track lines and the IDs of the spots in a frame on an image.
+
+    Args:
+        page (numpy.ndarray): (y, x, 3) uint8 RGB image of the frame
+        frame_num (int): The frame number, spots of this frame are labelled
+        tracks (list): Track objects to label
+        lines (list): Line objects (Track.lines) to draw
+
+    Returns:
+        numpy.ndarray: The (y, x, 3) image with the overlay, channels swapped
+            for the video writer.
+    """
+    import cv2
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    fontScale = 0.5
+    fontColor = (255, 100, 255)
+    lineType = 1
+    page = cv2.cvtColor(page, cv2.COLOR_BGR2RGB)
+    for line in lines:
+        cv2.line(page, line.x1y1, line.x2y2, (255, 255, 255), 1)
+
+    for track_obj in tracks:
+        for spot in track_obj.spot_objs:
+            if spot.frame == frame_num:
+                bottomLeftCornerOfText = (spot.x + 2, spot.y)
+                cv2.putText(page, track_obj.id,
+                            bottomLeftCornerOfText,
+                            font,
+                            fontScale,
+                            fontColor,
+                            lineType)
+    return page
+
+
+def drawTrackmateVideo(infile, out_csv, frames=None, budget=None):
+    """
+    Takes a tif file or zarr store, with a matching trackmate file, and makes
+    a mp4 video of the tracked output. This will draw a spot ID, and a trail
+    on the video.
 
     This will also write a csv file containing the x position, y position,
     spot frame, and track id. This can be used later to draw lines using
 
     Args:
-        infile (str): .tif filename to convert
+        infile (str): .tif filename or .zarr store to convert. The trackmate
+            file and the video are named after it.
         out_csv (str): The csv file to write to. This is opened in append mode.
+        frames (stack_io.FrameSource): Where to read the frames from. By
+            default they are read from infile, pass a LifFrameSource to
+            read them from the original LIF file instead.
+        budget (memory.MemoryBudget): If given, the tracks are read with
+            read_filtered_tracks(), and fewer Zarr frames are decoded ahead
+            if the memory under the budget is short.
 
     Returns:
         None: This does not return any value, but will write a .mp4 file and
             .csv file.
 
     """
-    import cv2
-    import numpy as np
     import skvideo.io
-    from PIL import Image, ImageSequence
     # infile = '../tracking_demo_image/Well1-Pos001.tif'
+    infile = infile.rstrip('/\\')
     inxml = infile + '.trackmate.xml'
     out_video = infile + '.mp4'
     # out_csv = '../tracking_demo_image/out.csv'
-    PIL_image = Image.open(infile)
-    width, height = PIL_image.size
-    print('Converting ' + os.path.basename(infile))
+    if frames is None:
+        frames = open_frame_source(infile)
+    if budget is not None and hasattr(frames, 'workers'):
+        frames.workers = budget.workers(frames.frame_nbytes, frames.workers)
+    progress = Progress('Converting ' + os.path.basename(infile), len(frames))
     writer = skvideo.io.FFmpegWriter(out_video, outputdict={
                                      '-vcodec': 'libx264',
                                      '-pix_fmt': 'yuv420p',
                                      '-r': '8',
                                      })
 
-    tree = ET.parse(inxml)
-    root = tree.getroot()
+    with METRICS.timer('video.parse'):
+        if budget is not None:
+            filt_tracks = read_filtered_tracks(inxml)
+        else:
+            tree = ET.parse(inxml)
+            root = tree.getroot()
 
-    tracks = [Track(xml_track, root) for xml_track in root.findall('Model/AllTracks/Track')]
+            tracks = [Track(xml_track, root) for xml_track in root.findall('Model/AllTracks/Track')]
+            filt_tracks = [x for x in tracks if x.include]
 
-    filt_tracks = [x for x in tracks if x.include]
-    edge_nest = [x.lines for x in tracks if x.include]
+    edge_nest = [x.lines for x in filt_tracks]
     line_list = [item for sublist in edge_nest for item in sublist]
 
-    # i is the frame, page is the PIL image object
-    for i, img in enumerate(ImageSequence.Iterator(PIL_image)):
-        page = np.asarray(img.convert('RGB'))
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        fontScale = 0.5
-        fontColor = (255, 100, 255)
-        lineType = 1
-        page = cv2.cvtColor(page, cv2.COLOR_BGR2RGB)
-        for line in line_list:
-            cv2.line(page, line.x1y1, line.x2y2, (255, 255, 255), 1)
-
-        for track_obj in filt_tracks:
-            for spot in track_obj.spot_objs:
-                if spot.frame == i:
-                    bottomLeftCornerOfText = (spot.x + 2, spot.y)
-                    cv2.putText(page, track_obj.id,
-                                bottomLeftCornerOfText,
-                                font,
-                                fontScale,
-                                fontColor,
-                                lineType)
-
-        writer.writeFrame(page)
-
-    writer.close()
+    # i is the frame, page is the RGB image array
+    for i, frame in enumerate(METRICS.timed_iter(frames, 'video.decode')):
+        draw_start = time.perf_counter()
+        page = draw_track_overlay(to_rgb8(frame), i, filt_tracks, line_list)
+        METRICS.observe('video.draw', time.perf_counter() - draw_start)
+
+        with METRICS.timer('video.encode'):
+            writer.writeFrame(page)
+        METRICS.count('video.frames')
+        progress.update(i + 1)
+
+    with METRICS.timer('video.encode'):
+        writer.close()
+    progress.close()
 
     with open(out_csv, 'a') as f:
         for track in filt_tracks:
@@ -216,15 +327,27 @@ def drawTrackmateVideo(infile, out_csv):
                         )
 
 
+# Spot features written when they were not measured, see spot_features
+_PLACEHOLDER_FEATURES = {'MAX_INTENSITY': '100', 'MEDIAN_INTENSITY': '60.0',
+                         'MEAN_INTENSITY': '50', 'TOTAL_INTENSITY': '21000',
+                         'ESTIMATED_DIAMETER': '20', 'RADIUS': '10.0', 'SNR': '0.5',
+                         'STANDARD_DEVIATION': '20', 'CONTRAST': '0.2', 'MIN_INTENSITY': '0.0'}
+
+
 class trackmateXML:
     """
     Class for constructing, and writing the trackmate XML from the ML tracking tools.
 
-    Note, this currently has a hard-coded frame duration of 300 seconds.
-    Todo: Update the hardcoded frame duration.
+    Spot positions are written in pixels, POSITION_T in seconds. The frame
+    size, pixel size and frame interval of the ImageData and BasicSettings
+    come from the calibration of the image series.
 
     Args:
-        None
+        spill_to_disk (bool): Keep the body in a temporary file instead of in
+            memory, for --max-memory. content stays empty.
+        calibration (stack_io.ImageCalibration): Size and calibration of the
+            frames, see stack_io.lif_calibration() and tiff_calibration().
+            Missing values are taken from stack_io.DEFAULT_CALIBRATION.
 
     Attributes:
         spot_id (int): The ID of the spot being added. This will auto increment.
@@ -238,15 +361,20 @@ class trackmateXML:
         footer1 (str): First trackmate footer
         footer2 (str): Second trackmate footer
         footer3 (str): Third trackmate footer
+        calibration (stack_io.ImageCalibration): Size and calibration of the
+            frames
 
     """
-    def __init__(self):
+    def __init__(self, spill_to_disk=False, calibration=None):
+        self.calibration = complete_calibration(calibration) if calibration else \
+            ImageCalibration(*DEFAULT_CALIBRATION)
         self.spot_id = 1
         self.frame = 0
         self.total_spots = 0
         self.nframes = 0
         self.filename = 'default.xml'
         self.content = ''
+        self._spill = tempfile.TemporaryFile('w+') if spill_to_disk else None
         self.imagepath = ''
         self.header = """<?xml version="1.0" encoding="UTF-8"?>
   <TrackMate version="3.8.0">
@@ -317,8 +445,7 @@ class trackmateXML:
         <FilteredTracks />
       </Model>
       <Settings>"""
-        self.footer3 = """<BasicSettings xstart="0" xend="1391" ystart="0" yend="1039" zstart="0" zend="0" tstart="0" tend="60" />
-    <DetectorSettings DETECTOR_NAME="LOG_DETECTOR" TARGET_CHANNEL="1" RADIUS="20.0" THRESHOLD="0.2" DO_MEDIAN_FILTERING="true" DO_SUBPIXEL_LOCALIZATION="false" />
+        self.footer3 = """<DetectorSettings DETECTOR_NAME="LOG_DETECTOR" TARGET_CHANNEL="1" RADIUS="20.0" THRESHOLD="0.2" DO_MEDIAN_FILTERING="true" DO_SUBPIXEL_LOCALIZATION="false" />
     <InitialSpotFilter feature="QUALITY" value="0.0" isabove="true" />
     <SpotFilterCollection />
     <TrackerSettings />
@@ -351,7 +478,13 @@ class trackmateXML:
   </GUIState>
 </TrackMate>"""  # noqa
 
-    def _add_spots(self, box, score):
+    def _append(self, text):
+        if self._spill is None:
+            self.content += text
+        else:
+            self._spill.write(text)
+
+    def _add_spots(self, box, score, features=None):
         """
         Used to add one or more spots to the trackmate object. This is needs to be called
         from the add_frame_spots, and not called directly. (PRIVATE)
@@ -360,6 +493,9 @@ class trackmateXML:
             box (list): List of tuples in the form (x1, x2, y1, y2) of boxes to add.
             score (list): List of scores to accompany the boxes. THe score is stored
                 in the 'QUALITY' attribute of the trackmate XML.
+            features (dict): feature: value of the intensity features of the
+                spot, see spot_features.SPOT_FEATURES. Placeholder values are
+                written if None.
 
         Returns:
             None
@@ -368,25 +504,34 @@ class trackmateXML:
         spot_num = int(len(box))
         self.total_spots += spot_num
         centerx, centery = get_box_center(box)
-        self.content += ('\t\t\t\t<Spot ID="' + str(self.spot_id) + '" '
-                         'name="ID' + str(self.spot_id) + ''
-                         '" QUALITY="' + str(score) + '" '
-                         'POSITION_T="' + str(self.frame * 300) + '" '
-                         'MAX_INTENSITY="100" FRAME="' + str(self.frame) + '" '
-                         'MEDIAN_INTENSITY="60.0" VISIBILITY="1" '
-                         'MEAN_INTENSITY="50" '
-                         'TOTAL_INTENSITY="21000" '
-                         'ESTIMATED_DIAMETER="20" RADIUS="10.0" '
-                         'SNR="0.5" '
-                         'POSITION_X="' + str(centerx) + '" '
-                         'POSITION_Y="' + str(centery) + '" '
-                         'STANDARD_DEVIATION="20" '
-                         'CONTRAST="0.2" '
-                         'MANUAL_COLOR="-10921639" MIN_INTENSITY="0.0" '
-                         'POSITION_Z="0.0" />\n')
+        values = _PLACEHOLDER_FEATURES
+        if features is not None:
+            values = dict(values)
+            values.update((name, format(value, '.10g' if name == 'TOTAL_INTENSITY' else '.6g'))
+                          for name, value in features.items())
+        self._append('\t\t\t\t<Spot ID="' + str(self.spot_id) + '" '
+                     'name="ID' + str(self.spot_id) + ''
+                     '" QUALITY="' + str(score) + '" '
+                     'POSITION_T="' + format(self.frame * self.calibration.frame_interval,
+                                             '.10g') + '" '
+                     'MAX_INTENSITY="' + values['MAX_INTENSITY'] + '" '
+                     'FRAME="' + str(self.frame) + '" '
+                     'MEDIAN_INTENSITY="' + values['MEDIAN_INTENSITY'] + '" VISIBILITY="1" '
+                     'MEAN_INTENSITY="' + values['MEAN_INTENSITY'] + '" '
+                     'TOTAL_INTENSITY="' + values['TOTAL_INTENSITY'] + '" '
+                     'ESTIMATED_DIAMETER="' + values['ESTIMATED_DIAMETER'] + '" '
+                     'RADIUS="' + values['RADIUS'] + '" '
+                     'SNR="' + values['SNR'] + '" '
+                     'POSITION_X="' + str(centerx) + '" '
+                     'POSITION_Y="' + str(centery) + '" '
+                     'STANDARD_DEVIATION="' + values['STANDARD_DEVIATION'] + '" '
+                     'CONTRAST="' + values['CONTRAST'] + '" '
+                     'MANUAL_COLOR="-10921639" '
+                     'MIN_INTENSITY="' + values['MIN_INTENSITY'] + '" '
+                     'POSITION_Z="0.0" />\n')
         self.spot_id += 1
 
-    def add_frame_spots(self, box, scores):
+    def add_frame_spots(self, box, scores, features=None):
         """
         This is the public method to add spots to the trackmate xml. This will
         add the required header to tell trackmate which frame the spots belong to.
@@ -400,112 +545,376 @@ class trackmateXML:
             box (list): List of tuples in the form (x1, x2, y1, y2) of boxes to add.
             score (list): List of scores to accompany the boxes. THe score is stored
                 in the 'QUALITY' attribute of the trackmate XML.
+            features (dict): feature: array with a value per box of the
+                intensity features, as from spot_features.box_features().
+                Placeholder values are written if None.
 
         Returns:
 
         """
-        self.content += '\t\t\t<SpotsInFrame frame="' + str(self.frame) + '">\n'
-        for spot, score in zip(box, scores):
-            self._add_spots(spot, score)
-        self.content += '\t\t\t</SpotsInFrame>\n'
+        self._append('\t\t\t<SpotsInFrame frame="' + str(self.frame) + '">\n')
+        if features is not None:
+            columns = {name: np.asarray(values, dtype=np.float64).tolist()
+                       for name, values in features.items()}
+        for index, (spot, score) in enumerate(zip(box, scores)):
+            spot_features = None
+            if features is not None:
+                spot_features = {name: values[index] for name, values in columns.items()}
+            self._add_spots(spot, score, spot_features)
+        self._append('\t\t\t</SpotsInFrame>\n')
 
     def write_xml(self):
         """
         This method writes the trackmate XML with all of the spot data.
 
         The location that it is written to is the 'imagepath' + 'filename' with
-        .xml appended to the end.
+        .xml appended to the end. The file is written atomically, it never
+        exists in a half-written state.
 
         Returns:
             None
         """
+        width, height, pixel_width, pixel_height, frame_interval = self.calibration
         self.footer2 = ('\n\t\t<ImageData filename="' + str(self.filename) + '" '
-                        'folder="./" width="1392" '
-                        'height="1040" nslices="1" nframes="' + str(self.nframes) + '" '
-                        'pixelwidth="1.843" pixelheight="1.843" voxeldepth="1.0" '
-                        'timeinterval="300.0" />\n')
+                        'folder="./" width="' + str(int(width)) + '" '
+                        'height="' + str(int(height)) + '" nslices="1" '
+                        'nframes="' + str(self.nframes) + '" '
+                        'pixelwidth="' + str(float(pixel_width)) + '" '
+                        'pixelheight="' + str(float(pixel_height)) + '" voxeldepth="1.0" '
+                        'timeinterval="' + str(float(frame_interval)) + '" />\n'
+                        '<BasicSettings xstart="0" xend="' + str(int(width) - 1) + '" '
+                        'ystart="0" yend="' + str(int(height) - 1) + '" zstart="0" zend="0" '
+                        'tstart="0" tend="' + str(self.nframes) + '" />\n    ')
         self.header += '\n\t\t<AllSpots nspots="' + str(self.total_spots) + '">\n'
-        with open(os.path.join(self.imagepath, self.filename + '.xml'), 'w') as f:
+        with atomic_write(os.path.join(self.imagepath, self.filename + '.xml')) as f:
             f.write(self.header)
-            f.write(self.content)
+            if self._spill is None:
+                f.write(self.content)
+            else:
+                self._spill.seek(0)
+                shutil.copyfileobj(self._spill, f)
+                self._spill.close()
+                self._spill = None
             f.write(self.footer1)
             f.write(self.footer2)
             f.write(self.footer3)
 
 
+# The track filters of the TrackMate script, (feature, value, is_above)
+DEFAULT_TRACK_FILTERS = TRACK_FILTERS
+
+_TRACK_TAG = re.compile(r'<Track\s([^>]*)>')
+_ATTRIBUTE = re.compile(r'([\w:.-]+)="([^"]*)"')
+_FILTER = re.compile(r'^\s*(\w+)\s*(>=|<=|>|<)\s*([-+0-9.eE]+)\s*$')
+
+
+def parse_track_filters(text):
+    """
+    Parses track filters written as 'NUMBER_SPOTS>31,NUMBER_SPLITS<0.5'.
+
+    As in TrackMate, a track passes 'FEATURE>value' if its feature is at
+    least value, so > and >= mean the same, as do < and <=.
+
+    Returns:
+        tuple: (feature, value, is_above) for each filter, as in
+            linking.TRACK_FILTERS
+    """
+    filters = []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        match = _FILTER.match(part)
+        if match is None:
+            raise ValueError('Not a track filter: ' + part.strip() +
+                             ', expected e.g. NUMBER_SPOTS>31')
+        feature, operator, value = match.groups()
+        filters.append((feature, float(value), operator.startswith('>')))
+    return tuple(filters)
+
+
+def format_track_filters(filters):
+    """Formats track filters as parse_track_filters() reads them."""
+    return ','.join('%s%s%g' % (feature, '>' if is_above else '<', value)
+                    for feature, value, is_above in filters)
+
+
+def read_track_features(text):
+    """
+    Reads the features of all tracks from the text of a trackmate XML file,
+    without parsing the spots.
+
+    Returns:
+        (list, dict): The TRACK_ID of each track, and feature: numpy array
+            of its value for each track, NaN where it is missing
+    """
+    rows = [dict(_ATTRIBUTE.findall(match.group(1))) for match in _TRACK_TAG.finditer(text)]
+    names = set()
+    for row in rows:
+        names.update(row)
+    track_ids = [row.get('TRACK_ID') for row in rows]
+    features = {}
+    for name in names - {'name', 'TRACK_ID'}:
+        try:
+            features[name] = np.array([row.get(name, 'nan') for row in rows], dtype=np.float64)
+        except ValueError:
+            continue
+    return track_ids, features
+
+
+def filter_track_features(features, filters=DEFAULT_TRACK_FILTERS):
+    """
+    Applies track filters to the features of all tracks at once, like
+    linking.passes_filters() does per track.
+
+    Args:
+        features (dict): feature: numpy array, as from read_track_features()
+        filters (tuple): (feature, value, is_above) filters
+
+    Returns:
+        numpy.ndarray: bool, whether each track passes all filters
+    """
+    n_tracks = len(next(iter(features.values()))) if features else 0
+    passes = np.ones(n_tracks, dtype=bool)
+    for feature, value, is_above in filters:
+        if feature not in features:
+            if not n_tracks:
+                continue
+            raise ValueError('The tracks have no feature ' + feature)
+        passes &= (features[feature] >= value) if is_above else (features[feature] <= value)
+    return passes
+
+
+def _replace_element(text, tag, replacement):
+    """Replaces the first <tag .../> or <tag>...</tag> element in text."""
+    start = text.find('<' + tag)
+    if start < 0:
+        return None
+    opening_end = text.index('>', start)
+    if text[opening_end - 1] == '/':
+        end = opening_end + 1
+    else:
+        end = text.index('</' + tag + '>', start) + len(tag) + 3
+    return text[:start] + replacement + text[end:]
+
+
+def refilter_xml(xml_path, filters=DEFAULT_TRACK_FILTERS, out_path=None):
+    """
+    Filters the tracks of a trackmate XML file again, with other track
+    filters than the TrackMate script used, without tracking again.
+
+    The features that TrackMate computed for every track are kept in the
+    file, so only its FilteredTracks, and the filters in its Settings, are
+    rewritten. The file is left untouched when the same tracks pass.
+
+    Args:
+        xml_path (str): The .trackmate.xml file
+        filters (tuple): (feature, value, is_above) filters, see
+            parse_track_filters()
+        out_path (str): Write the filtered file here instead, e.g. to keep
+            the original
+
+    Returns:
+        (int, int): The number of tracks that passed, and of all tracks
+    """
+    with open(xml_path, encoding='utf-8') as f:
+        text = f.read()
+    track_ids, features = read_track_features(text)
+    passes = filter_track_features(features, filters)
+    kept = [track_id for track_id, keep in zip(track_ids, passes) if keep]
+
+    start = text.find('<FilteredTracks')
+    if start < 0:
+        raise ValueError('No FilteredTracks in ' + xml_path)
+    end = max(text.find('</FilteredTracks>', start), start)
+    current = re.findall(r'<TrackID\s+TRACK_ID="([^"]*)"', text[start:end])
+    if current == kept and out_path is None:
+        return len(kept), len(track_ids)
+
+    line_start = text.rfind('\n', 0, start) + 1
+    indent = text[line_start:start] if text[line_start:start].isspace() else ''
+    if kept:
+        filtered = ('<FilteredTracks>\n' +
+                    ''.join(indent + '  <TrackID TRACK_ID="%s" />\n' % track_id
+                            for track_id in kept) + indent + '</FilteredTracks>')
+    else:
+        filtered = '<FilteredTracks />'
+    text = _replace_element(text, 'FilteredTracks', filtered)
+    collection = ('<TrackFilterCollection>' +
+                  ''.join('<Filter feature="%s" value="%r" isabove="%s" />'
+                          % (feature, float(value), str(is_above).lower())
+                          for feature, value, is_above in filters) +
+                  '</TrackFilterCollection>')
+    text = _replace_element(text, 'TrackFilterCollection', collection) or text
+    with atomic_write(out_path or xml_path, 'w') as f:
+        f.write(text)
+    return len(kept), len(track_ids)
+
+
+def _refilter(args):
+    xml_path, filters = args
+    return (xml_path,) + refilter_xml(xml_path, filters)
+
+
+def refilter_folder(root_folder, filters=DEFAULT_TRACK_FILTERS, workers=None):
+    """
+    Filters the tracks of all trackmate XML files below a folder again, see
+    refilter_xml(), in a pool of worker processes.
+
+    Afterwards, process_xml_folder() and drawTrackmateVideo() use the new
+    filtered tracks; the CSV files only read the files that changed.
+
+    Args:
+        root_folder (str): E.g. the output folder of a LIF file, or a plate
+        filters (tuple): (feature, value, is_above) filters
+        workers (int): Number of processes, defaults to the number of cores
+
+    Returns:
+        list: (path, tracks passed, all tracks) for each file
+    """
+    paths = sorted(os.path.join(folder, name)
+                   for folder, subfolders, files in os.walk(root_folder)
+                   for name in files if name.endswith('trackmate.xml'))
+    jobs = [(path, tuple(filters)) for path in paths]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    with METRICS.timer('refilter'):
+        if workers > 1:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(workers) as pool:
+                return pool.map(_refilter, jobs)
+        return [_refilter(job) for job in jobs]
+
+
 def process_imagestack(well):
     """Processes a single image stack (xml file) and returns three lists,
     mean_speed, processivity, max_displacement.
+
+    Only the Track, TrackID and ImageData tags are read from the text of the
+    file, the spots are not parsed.
     """
-    tree = ET.parse(well)
-    root = tree.getroot()
+    with open(well, encoding='utf-8') as f:
+        text = f.read()
+    image_data = re.search(r'<ImageData\s([^>]*)>', text)
     try:
-        scale = float(root.find('Settings/ImageData').get('pixelwidth'))
-    except:
+        scale = float(dict(_ATTRIBUTE.findall(image_data.group(1)))['pixelwidth'])
+    except (AttributeError, KeyError, ValueError):
         scale = 1
-    filteredTrackId = [track.get('TRACK_ID') for track in root.findall('Model/FilteredTracks/TrackID')]
-
-    class track():
-        def __init__(self, xml_track):
-            self.id = xml_track.get('TRACK_ID')
-            self.num_spots = xml_track.get('NUMBER_SPOTS')
-            self.num_gaps = xml_track.get('NUMBER_GAPS')
-            self.total_displacement = xml_track.get('TRACK_DISPLACEMENT')
-            self.index = xml_track.get('TRACK_INDEX')
-            self.mean_speed = float(xml_track.get('TRACK_MEAN_SPEED'))
-            self.median_speed = xml_track.get('TRACK_MEDIAN_SPEED')
-            self.total_dist_traveled = xml_track.get('TOTAL_DISTANCE_TRAVELED')
-            self.max_dist_traveled = float(xml_track.get('MAX_DISTANCE_TRAVELED'))
-            self.processivity = float(xml_track.get('CONFINMENT_RATIO'))
-            #self.XML
-
-    tracks = [track(xml_track) for xml_track in root.findall('Model/AllTracks/Track')]
-
-    mean_speed = [track_data.mean_speed / scale for track_data in tracks
-                  if track_data.id in filteredTrackId]
-    processivity = [track_data.processivity / scale for track_data in tracks
-                    if track_data.id in filteredTrackId]
-    max_displacement = [track_data.max_dist_traveled / scale for track_data in tracks
-                        if track_data.id in filteredTrackId]
+    track_ids, features = read_track_features(text)
+    filtered_ids = set(re.findall(r'<TrackID\s+TRACK_ID="([^"]*)"', text))
+    keep = [index for index, track_id in enumerate(track_ids) if track_id in filtered_ids]
+    if not keep:
+        return [], [], []
+
+    mean_speed = (features['TRACK_MEAN_SPEED'][keep] / scale).tolist()
+    processivity = (features['CONFINMENT_RATIO'][keep] / scale).tolist()
+    max_displacement = (features['MAX_DISTANCE_TRAVELED'][keep] / scale).tolist()
     return mean_speed, processivity, max_displacement
 
 
-def process_well_list(well_string, xml_file_list):
-    """Takes a well name (well_string) and an xml_file_list (all XML file paths) returns
-    three pandas dataframes"""
-    print("Processing " + str(well_string))
-    match_well = [i for i in xml_file_list if str(well_string + '-') in i]
-    mean_speed, processivity, max_displacement = [], [], []
-    for well in match_well:
-        speed, process, disp = process_imagestack(well)
-        mean_speed.extend(speed)
-        processivity.extend(process)
-        max_displacement.extend(disp)
-    speed_um = pd.to_numeric(pd.Series(mean_speed))
-    processivity_um = pd.to_numeric(pd.Series(processivity))
-    max_displacement_um = pd.to_numeric(pd.Series(max_displacement))
-    return speed_um, processivity_um, max_displacement_um
-
-
-def process_xml_folder(folder):
-    print("Processing folder " + str(folder))
-    xml_file_list = glob.glob(os.path.join(folder, '*trackmate.xml'), )
+CSV_CACHE = 'acit_csv_cache.json'
+CSV_FILES = ('All_wells_speed.csv', 'All_wells_processivity.csv',
+             'All_wells_max_displacement.csv')
 
-    well_search = re.compile('(Well[0-9]*)')
-    well_list = list(set([well_search.search(well).group(0) for well in xml_file_list]))
-    speed_dict, processivity_dict, max_displacement_dict = {}, {}, {}
 
-    for well in well_list:
-        speed, processivity, max_displacement = process_well_list(well, xml_file_list)
-        well_num = int(well[4:])
-        speed_dict[well_num] = speed
-        processivity_dict[well_num] = processivity
-        max_displacement_dict[well_num] = max_displacement
+def _load_csv_cache(folder):
+    path = os.path.join(folder, CSV_CACHE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        print('Ignoring unreadable cache ' + path)
+        return {}
 
-    speed_df = pd.DataFrame(speed_dict)
-    processivity_df = pd.DataFrame(processivity_dict)
-    max_displacement_df = pd.DataFrame(max_displacement_dict)
 
-    speed_df.to_csv(os.path.join(folder, 'All_wells_speed.csv'), index=False)
-    processivity_df.to_csv(os.path.join(folder, 'All_wells_processivity.csv'), index=False)
-    max_displacement_df.to_csv(os.path.join(folder, 'All_wells_max_displacement.csv'), index=False)
\ No newline at end of file
+# Rough memory of a spawned parse worker for a memory budget: the interpreter
+# with numpy and pandas, plus the text of the file and what is parsed from it
+PARSE_WORKER_BYTES = 128 * 1024 ** 2
+PARSE_FILE_FACTOR = 3
+
+
+def process_xml_folder(folder, workers=None, use_cache=True, budget=None):
+    """
+    Writes the mean speed, processivity and maximum displacement of the
+    filtered tracks of every well in a folder to All_wells_speed.csv,
+    All_wells_processivity.csv and All_wells_max_displacement.csv, one
+    column per well.
+
+    The results of every XML file are cached in acit_csv_cache.json in the
+    folder, with the modification time and size of the file. Only files that
+    are new or changed since the last call are parsed, in a pool of at most
+    one worker process per file (in this process if only one file changed),
+    so the CSV files of a plate are updated quickly as positions
+    finish. If no file changed, the CSV files are left as they are.
+
+    Args:
+        folder (str): The folder with the trackmate XML files
+        workers (int): Number of processes to parse with, defaults to the
+            number of cores. 1 parses in this process.
+        use_cache (bool): Use and update the cache; False parses every file
+        budget (memory.MemoryBudget): If given, the pool is limited to the
+            workers that fit in the memory still free under the limit.
+    """
+    print("Processing folder " + str(folder))
+    stats = {}
+    for entry in os.scandir(folder):
+        if entry.name.endswith('trackmate.xml') and entry.is_file():
+            stat = entry.stat()
+            stats[entry.name] = [stat.st_mtime_ns, stat.st_size]
+
+    cache = _load_csv_cache(folder) if use_cache else {}
+    stale = sorted(name for name, stat in stats.items()
+                   if cache.get(name, {}).get('stat') != stat)
+    if (not stale and set(cache) == set(stats) and
+            all(os.path.exists(os.path.join(folder, name)) for name in CSV_FILES)):
+        print("CSV files are up to date")
+        return
+
+    with METRICS.timer('csv.parse'):
+        paths = [os.path.join(folder, name) for name in stale]
+        # Starting a spawn pool costs more than parsing one file
+        workers = min(workers or os.cpu_count() or 1, len(paths))
+        if budget is not None and paths:
+            largest = max(stats[name][1] for name in stale)
+            workers = budget.workers(PARSE_WORKER_BYTES + PARSE_FILE_FACTOR * largest,
+                                     workers)
+        if workers > 1:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(workers) as pool:
+                results = pool.map(process_imagestack, paths)
+        else:
+            results = [process_imagestack(path) for path in paths]
+    METRICS.count('csv.files', len(stale))
+    METRICS.count('csv.cached', len(stats) - len(stale))
+    cache = {name: cache[name] for name in stats if name in cache}
+    for name, (speed, processivity, max_displacement) in zip(stale, results):
+        cache[name] = {'stat': stats[name], 'speed': speed, 'processivity': processivity,
+                       'max_displacement': max_displacement}
+
+    # Group the files by well in one pass, in file name order
+    well_search = re.compile('(Well[0-9]+)')
+    speed_dict, processivity_dict, max_displacement_dict = {}, {}, {}
+    for name in sorted(cache):
+        well = well_search.search(name)
+        if well is None:
+            print("No well number in " + name + ", skipping")
+            continue
+        well_num = int(well.group(0)[4:])
+        speed_dict.setdefault(well_num, []).extend(cache[name]['speed'])
+        processivity_dict.setdefault(well_num, []).extend(cache[name]['processivity'])
+        max_displacement_dict.setdefault(well_num, []).extend(cache[name]['max_displacement'])
+
+    speed_df = pd.DataFrame({well: pd.Series(values, dtype=float)
+                             for well, values in speed_dict.items()})
+    processivity_df = pd.DataFrame({well: pd.Series(values, dtype=float)
+                                    for well, values in processivity_dict.items()})
+    max_displacement_df = pd.DataFrame({well: pd.Series(values, dtype=float)
+                                        for well, values in max_displacement_dict.items()})
+
+    with METRICS.timer('csv.write'):
+        speed_df.to_csv(os.path.join(folder, 'All_wells_speed.csv'), index=False)
+        processivity_df.to_csv(os.path.join(folder, 'All_wells_processivity.csv'), index=False)
+        max_displacement_df.to_csv(os.path.join(folder, 'All_wells_max_displacement.csv'), index=False)
+        if use_cache:
+            with atomic_write(os.path.join(folder, CSV_CACHE)) as f:
+                json.dump(cache, f)
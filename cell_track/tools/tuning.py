@@ -0,0 +1,217 @@
+"""
+Tuning of the inference settings for the machine, `python -m cell_track tune`.
+
+Tensorflow splits every operation over a pool of threads (intra-op) and runs
+independent operations side by side (inter-op). Its defaults size both pools
+to all cores, which on machines with several sockets often runs slower than
+smaller pools, or several processes with a model each. The tuner runs the
+model on frames of a sample stack for a grid of these settings, the batch
+size and the number of worker processes, and saves the fastest as the
+tuning profile of the machine:
+
+    python -m cell_track tune --stack /data/results/Exp1/Well1-Pos001.tif
+
+get_session() takes the thread counts from the profile, and python -m
+cell_track its batch size, number of detection workers and whether to pin
+them (tune --pin, see affinity). The profiles are kept per host name in
+~/.acit_tuning.json, or in the file set by the ACIT_TUNING environment
+variable, so a home folder shared between machines can hold the profile of
+each.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import time
+
+from cell_track.tools.checkpoint import atomic_write
+
+TUNING_ENV = 'ACIT_TUNING'
+
+
+def tuning_path():
+    """Path of the file with the tuning profiles."""
+    return os.environ.get(TUNING_ENV) or os.path.join(os.path.expanduser('~'),
+                                                      '.acit_tuning.json')
+
+
+def load_tuning(path=None):
+    """
+    Loads the tuning profile of this host.
+
+    Args:
+        path (str): The file with the profiles, defaults to tuning_path()
+
+    Returns:
+        dict: With the keys intra_op_threads, inter_op_threads, batch_size and
+            workers, empty if this host was not tuned
+    """
+    path = path or tuning_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get(socket.gethostname(), {})
+
+
+def save_tuning(profile, path=None):
+    """Saves the tuning profile of this host, keeping those of other hosts."""
+    path = path or tuning_path()
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[socket.gethostname()] = profile
+    with atomic_write(path) as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+
+def default_grid(cpus=None):
+    """
+    The settings tried by default: thread pools of a quarter, half and all of
+    the cores, batches of 1, 2 and 4 frames, and up to 4 workers, without
+    giving the workers more threads than there are cores.
+
+    Returns:
+        dict: Lists of values for intra_op_threads, inter_op_threads,
+            batch_size and workers
+    """
+    cpus = cpus or os.cpu_count() or 1
+    return {'intra_op_threads': sorted(set(max(1, cpus // n) for n in (4, 2, 1))),
+            'inter_op_threads': [1, 2],
+            'batch_size': [1, 2, 4],
+            'workers': [n for n in (1, 2, 4) if n <= cpus]}
+
+
+def _tune_worker(model_path, stack_path, n_frames, session, batch_sizes,
+                 barrier, results, cpus=None):
+    if cpus is not None:
+        from cell_track.tools.affinity import pin_to_cpus, replica_tuning
+        pin_to_cpus(cpus)
+        session = replica_tuning(cpus)
+    import numpy as np
+    from cell_track.tools import load_model
+    from cell_track.tools.stack_io import open_frame_source
+    from cell_track.tools.track_image import BatchBuffer, predict_frames
+    source = open_frame_source(stack_path)
+    frames = [np.asarray(source[t]) for t in range(n_frames)]
+    model = load_model(model_path, use_server=False, tuning=session)
+    buffer = BatchBuffer()
+    for batch_size in batch_sizes:
+        predict_frames(model, frames[:batch_size], buffer)  # builds the graph
+        barrier.wait()
+        start = time.perf_counter()
+        for i in range(0, n_frames, batch_size):
+            predict_frames(model, frames[i:i + batch_size], buffer)
+        results.put((batch_size, time.perf_counter() - start))
+
+
+def measure(model_path, stack_path, n_frames, intra_op_threads, inter_op_threads,
+            workers, batch_sizes, timeout=1800, pin=False):
+    """
+    Measures the frames per second of one setting of the thread pools and
+    workers, for each batch size.
+
+    The workers are separate processes that each load the model and run it
+    on the same n_frames frames, at the same time. With pin, they are pinned
+    as the detection workers of --pin are, and the thread counts are ignored.
+
+    Returns:
+        dict: batch_size: frames per second of all workers together. Batch
+            sizes that failed, e.g. out of memory, are left out.
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    session = {'intra_op_threads': intra_op_threads,
+               'inter_op_threads': inter_op_threads}
+    cpu_sets = [(None, None)] * workers
+    if pin:
+        from cell_track.tools.affinity import replica_cpu_sets
+        cpu_sets = replica_cpu_sets(workers)
+    processes = [context.Process(target=_tune_worker,
+                                 args=(model_path, stack_path, n_frames, session,
+                                       batch_sizes, barrier, results, cpus))
+                 for node, cpus in cpu_sets]
+    for process in processes:
+        process.start()
+    seconds = {}
+    deadline = time.time() + timeout
+    try:
+        for _ in range(workers * len(batch_sizes)):
+            while True:
+                try:
+                    batch_size, elapsed = results.get(timeout=5)
+                    break
+                except queue.Empty:
+                    if time.time() > deadline or \
+                            any(process.exitcode for process in processes):
+                        raise RuntimeError('a worker failed or timed out')
+            seconds.setdefault(batch_size, []).append(elapsed)
+    except RuntimeError as error:
+        print('  stopped: ' + str(error))
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    return {batch_size: workers * n_frames / max(times)
+            for batch_size, times in seconds.items() if len(times) == workers}
+
+
+def tune(model_path, stack_path, grid=None, n_frames=32, path=None, pin=False):
+    """
+    Measures every setting of the grid, and saves the fastest as the tuning
+    profile of this host.
+
+    With pin, the workers are pinned to their own cores (see affinity), which
+    also sets their thread counts, so only the batch sizes and numbers of
+    workers of the grid are tried.
+
+    Args:
+        model_path (str): Path of the model
+        stack_path (str): TIFF stack or Zarr store to take the frames from
+        grid (dict): Values to try, see default_grid()
+        n_frames (int): Number of frames every worker runs per setting
+        path (str): The file with the profiles, defaults to tuning_path()
+        pin (bool): Pin the workers
+
+    Returns:
+        dict: The saved profile, None if no setting worked
+    """
+    from cell_track.tools.stack_io import open_frame_source
+    grid = grid or default_grid()
+    n_frames = min(n_frames, len(open_frame_source(stack_path)))
+    cpus = os.cpu_count() or 1
+    print('%8s %8s %8s %8s %10s' % ('intra', 'inter', 'batch', 'workers', 'frames/s'))
+    best = None
+    for workers in grid['workers']:
+        if pin:
+            from cell_track.tools.affinity import replica_cpu_sets, replica_tuning
+            # The threads of a pinned worker follow from its cores
+            session = replica_tuning(replica_cpu_sets(workers)[0][1])
+            settings = [(session['intra_op_threads'], session['inter_op_threads'])]
+        else:
+            settings = [(intra, inter) for intra in grid['intra_op_threads']
+                        for inter in grid['inter_op_threads'] if intra * workers <= cpus]
+        for intra, inter in settings:
+            fps = measure(model_path, stack_path, n_frames, intra, inter,
+                          workers, grid['batch_size'], pin=pin)
+            for batch_size, frames_per_second in sorted(fps.items()):
+                print('%8d %8d %8d %8d %10.2f' % (intra, inter, batch_size,
+                                                  workers, frames_per_second))
+                if best is None or frames_per_second > best['frames_per_second']:
+                    best = {'intra_op_threads': intra, 'inter_op_threads': inter,
+                            'batch_size': batch_size, 'workers': workers,
+                            'frames_per_second': frames_per_second}
+    if best is None:
+        print('No setting worked, the tuning profile is unchanged')
+        return None
+    best.update({'model': os.path.basename(model_path), 'cpus': cpus, 'pin': pin,
+                 'tuned': time.strftime('%Y-%m-%d %H:%M:%S')})
+    save_tuning(best, path)
+    print('Best: %(intra_op_threads)d intra-op threads, %(inter_op_threads)d inter-op '
+          'threads, batches of %(batch_size)d, %(workers)d workers, '
+          '%(frames_per_second).2f frames/s' % best)
+    print('Saved to ' + (path or tuning_path()))
+    return best
@@ -0,0 +1,85 @@
+"""
+Watching a folder for LIF files while the microscope is writing them.
+
+A LIF file is only handed on once its size and modification time have not
+changed for a while, so files that are still being acquired are not read.
+"""
+import glob
+import os
+import time
+
+
+class LifWatcher:
+    """
+    Polls a folder and reports LIF files once they are finished.
+
+    A file counts as finished when its size and modification time have been
+    the same for settle_time seconds. Each version of a file is reported once;
+    a file that is replaced or grows again is reported again when it settles.
+
+    Args:
+        folder (str): The folder to watch
+        settle_time (float): Seconds a file must stay unchanged
+        poll_interval (float): Seconds between two scans of the folder
+        pattern (str): Glob pattern of the files to watch
+
+    Examples:
+        >>> watcher = LifWatcher('/data/microscope', settle_time=120)
+        >>> for lif_path in watcher.watch():
+        >>>     track_lif(lif_path, out_path, model)
+    """
+    def __init__(self, folder, settle_time=60.0, poll_interval=10.0, pattern='*.lif'):
+        self.folder = folder
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.pattern = pattern
+        self._candidates = {}  # path: ((size, mtime), first time seen like this)
+        self._reported = {}  # path: (size, mtime) when it was reported
+
+    def poll(self, now=None):
+        """
+        Scans the folder once.
+
+        Args:
+            now (float): The current time, defaults to time.time()
+
+        Returns:
+            list: Paths of the files that became finished since the last call,
+                oldest first.
+        """
+        now = time.time() if now is None else now
+        finished = []
+        present = set()
+        for path in glob.glob(os.path.join(self.folder, self.pattern)):
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed while scanning
+                continue
+            present.add(path)
+            state = (stat.st_size, stat.st_mtime)
+            if self._reported.get(path) == state:
+                continue
+            previous = self._candidates.get(path)
+            if previous is None or previous[0] != state:
+                self._candidates[path] = (state, now)
+            elif now - previous[1] >= self.settle_time:
+                finished.append((stat.st_mtime, path))
+                self._reported[path] = state
+                del self._candidates[path]
+
+        for path in list(self._candidates):
+            if path not in present:
+                del self._candidates[path]
+        return [path for mtime, path in sorted(finished)]
+
+    def watch(self):
+        """
+        Scans the folder forever.
+
+        Returns:
+            generator: The path of each finished file
+        """
+        while True:
+            for path in self.poll():
+                yield path
+            time.sleep(self.poll_interval)
@@ -0,0 +1,300 @@
+"""
+Work queue on a shared filesystem, to run detection on several machines.
+
+The queue is a folder, usually on the NAS that holds the LIF files and the
+output folder. Every unit of work, one image series of a LIF file, is a small
+JSON file that moves between the subfolders:
+
+    pending/  waiting to be processed
+    claimed/  being processed, the file name ends with @<worker id>
+    done/     finished
+    failed/   failed max_attempts times
+
+An empty file in units/ marks every unit that was ever added. It is created
+with O_EXCL, so a unit is only added once even while it is moving between
+the subfolders.
+
+A worker claims a unit by renaming it from pending/ to claimed/. A rename is
+atomic, also on NFS and SMB shares, so only one worker gets each unit. While
+it works on the unit, the worker touches the claimed file regularly
+(heartbeat). A claim whose file was not touched for lease_time seconds
+belongs to a worker that died, and is put back in pending/ by the next
+worker that looks. The clocks of the machines should therefore roughly agree,
+and lease_time be well above the heartbeat interval.
+
+No other service is needed. The outputs are written to the usual output
+folder layout, so the other stages can be run on one machine afterwards.
+"""
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from urllib.parse import quote
+
+SUBFOLDERS = ('pending', 'claimed', 'done', 'failed')
+
+
+def default_worker_id():
+    """Host name and process id, unique among the workers of a queue."""
+    return socket.gethostname() + '-' + str(os.getpid())
+
+
+class Claim:
+    """
+    A unit of work claimed by a worker, see WorkQueue.claim().
+
+    Used as a context manager, it sends heartbeats while the block runs, and
+    marks the unit done, or puts it back if an exception is raised.
+
+    Attributes:
+        unit (dict): The unit, with keys 'lif', 'series' and 'attempts'
+        lost (bool): True if the claim was reclaimed by another worker
+            because the heartbeats stopped for too long.
+    """
+    def __init__(self, queue, name, path, unit):
+        self.queue = queue
+        self.name = name
+        self.path = path
+        self.unit = unit
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def heartbeat(self):
+        """
+        Renews the lease.
+
+        Returns:
+            bool: False if the claim was lost
+        """
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            self.lost = True
+        return not self.lost
+
+    def _beat(self):
+        while not self._stop.wait(self.queue.heartbeat_interval):
+            if not self.heartbeat():
+                print('Lost the claim on ' + self.name)
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._stop.set()
+        self._thread.join()
+        if exc_type is None:
+            self.complete()
+        else:
+            # Interrupting the worker is not a failure of the unit
+            self.release(failed=issubclass(exc_type, Exception))
+        return False
+
+    def complete(self):
+        """Moves the unit to done/."""
+        self._move('done')
+
+    def release(self, failed=False):
+        """
+        Puts the unit back in pending/, or in failed/ if it failed too often.
+
+        Args:
+            failed (bool): Count this as a failed attempt
+        """
+        if failed:
+            self.unit['attempts'] = self.unit.get('attempts', 0) + 1
+            if self.unit['attempts'] >= self.queue.max_attempts:
+                self._move('failed')
+                return
+        self._move('pending')
+
+    def _move(self, subfolder):
+        if self.lost:
+            return
+        # Taking the file out of claimed/ first makes sure it was still ours
+        tmp_path = os.path.join(self.queue.path, 'tmp', os.path.basename(self.path))
+        try:
+            os.rename(self.path, tmp_path)
+        except FileNotFoundError:
+            # Reclaimed by another worker in the meantime. The outputs are
+            # written atomically, so the other worker just redoes the unit.
+            self.lost = True
+            return
+        with open(tmp_path, 'w') as f:
+            json.dump(self.unit, f)
+        os.rename(tmp_path, os.path.join(self.queue.path, subfolder, self.name))
+
+
+class WorkQueue:
+    """
+    A work queue of (lif, series) units in a folder on a shared filesystem.
+
+    Args:
+        path (str): The queue folder, created if it does not exist
+        worker_id (str): Name of this worker, defaults to host-pid
+        lease_time (float): Seconds after which a claim without heartbeat is
+            considered abandoned
+        max_attempts (int): Number of failures after which a unit is moved to
+            failed/ instead of back to pending/
+
+    Examples:
+        >>> queue = WorkQueue('/nas/queue')
+        >>> queue.add_lif('/nas/lifs/plate1.lif')
+        >>> run_worker(queue, lambda unit: print(unit['series']))
+    """
+    def __init__(self, path, worker_id=None, lease_time=600.0, max_attempts=3):
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_time = lease_time
+        self.heartbeat_interval = lease_time / 5
+        self.max_attempts = max_attempts
+        for subfolder in SUBFOLDERS + ('tmp', 'units'):
+            os.makedirs(os.path.join(path, subfolder), exist_ok=True)
+
+    @staticmethod
+    def unit_name(lif, series):
+        """File name of a unit, readable and unique per (lif, series)."""
+        return quote(os.path.basename(lif) + '|' + series, safe='') + '.json'
+
+    def _names(self, subfolder):
+        names = set()
+        for path in glob.glob(os.path.join(self.path, subfolder, '*.json*')):
+            names.add(os.path.basename(path).split('@')[0])
+        return names
+
+    def add(self, lif, series):
+        """
+        Adds a unit, unless it is already in the queue.
+
+        Args:
+            lif (str): Path of the LIF file, the same on every worker
+            series (str): Path of the series, as from track_image.iter_lif_series
+
+        Returns:
+            bool: True if the unit was added
+        """
+        name = self.unit_name(lif, series)
+        try:
+            os.close(os.open(os.path.join(self.path, 'units', name),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        # Queues from before units/ have no markers
+        if any(name in self._names(subfolder) for subfolder in SUBFOLDERS):
+            return False
+        tmp_path = os.path.join(self.path, 'tmp', name + '@' + self.worker_id)
+        with open(tmp_path, 'w') as f:
+            json.dump({'lif': os.path.abspath(lif), 'series': series,
+                       'attempts': 0}, f)
+        os.rename(tmp_path, os.path.join(self.path, 'pending', name))
+        return True
+
+    def add_lif(self, lif):
+        """
+        Adds a unit for every series of a LIF file.
+
+        Returns:
+            int: The number of units added
+        """
+        from readlif.reader import LifFile
+        from cell_track.tools.track_image import iter_lif_series
+        added = 0
+        for index, image, folder_path, path in iter_lif_series(LifFile(lif)):
+            added += self.add(lif, path)
+        return added
+
+    def claim(self):
+        """
+        Claims a pending unit.
+
+        Returns:
+            Claim: or None if nothing is pending
+        """
+        for path in sorted(glob.glob(os.path.join(self.path, 'pending', '*.json'))):
+            name = os.path.basename(path)
+            claimed_path = os.path.join(self.path, 'claimed', name + '@' + self.worker_id)
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue  # another worker was faster
+            try:
+                # The rename keeps the old mtime, so the claim can be reclaimed
+                # as stale before the lease is renewed here
+                os.utime(claimed_path)
+                with open(claimed_path) as f:
+                    unit = json.load(f)
+            except FileNotFoundError:
+                continue
+            return Claim(self, name, claimed_path, unit)
+        return None
+
+    def reclaim_stale(self, now=None):
+        """
+        Puts claims without a recent heartbeat back in pending/.
+
+        Args:
+            now (float): The current time, defaults to time.time()
+
+        Returns:
+            list: Names of the reclaimed units
+        """
+        now = time.time() if now is None else now
+        reclaimed = []
+        for path in glob.glob(os.path.join(self.path, 'claimed', '*.json@*')):
+            try:
+                if now - os.path.getmtime(path) < self.lease_time:
+                    continue
+                name = os.path.basename(path).split('@')[0]
+                os.rename(path, os.path.join(self.path, 'pending', name))
+            except FileNotFoundError:
+                continue  # finished or reclaimed in the meantime
+            print('Reclaimed ' + name + ' from ' + os.path.basename(path).split('@', 1)[1])
+            reclaimed.append(name)
+        return reclaimed
+
+    def counts(self):
+        """
+        Returns:
+            dict: Number of units in each of SUBFOLDERS
+        """
+        return {subfolder: len(glob.glob(os.path.join(self.path, subfolder, '*.json*')))
+                for subfolder in SUBFOLDERS}
+
+
+def run_worker(queue, process, poll_interval=30.0):
+    """
+    Processes units until the queue is empty and no other worker is busy.
+
+    Waiting for the other workers means that units they abandon are still
+    picked up. A unit whose processing raises an exception is retried later.
+
+    Args:
+        queue (WorkQueue): The queue
+        process (function): Called with the unit dict of every claimed unit
+        poll_interval (float): Seconds to wait when nothing is pending
+
+    Returns:
+        int: The number of units this worker finished
+    """
+    finished = 0
+    while True:
+        queue.reclaim_stale()
+        claim = queue.claim()
+        if claim is None:
+            if queue.counts()['claimed'] == 0:
+                return finished
+            time.sleep(poll_interval)
+            continue
+        try:
+            with claim:
+                process(claim.unit)
+            finished += 1
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,31 @@
+import argparse
+import os
+
+from cell_track.tools import load_model
+from cell_track.tools.server import InferenceServer, default_address
+# Requires:
+# tensorflow
+# keras
+# keras_retinanet
+# numpy
+
+local_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+model_path = os.path.join(local_path, 'trained_models/resnet50_csv_v1.0.h5')
+
+parser = argparse.ArgumentParser(description='Keep a model loaded and serve it to '
+                                             'python -m cell_track and '
+                                             'track_tiff_stack.py')
+parser.add_argument('--gpu', help='Id of the GPU to use (as reported by nvidia-smi).')
+parser.add_argument('--model', '-m', help='Path of the model, defaults to the '
+                                          'model included with the module',
+                    default=model_path)
+parser.add_argument('--address', help='Socket to listen on, defaults to ' +
+                                      default_address(),
+                    default=None)
+args = parser.parse_args()
+
+if args.gpu:
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
+
+model = load_model(args.model, use_server=False)
+InferenceServer(model, args.model, address=args.address).serve_forever()
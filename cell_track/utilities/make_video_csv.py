@@ -1,4 +1,5 @@
 from cell_track.tools.trackmate import drawTrackmateVideo
+from cell_track.tools.profiling import StageProfiler
 import os
 import argparse
 import glob
@@ -12,6 +13,8 @@ def getArgs():
     required = parser.add_argument_group('Required')
     required.add_argument('--folder', '-f', help='The tiff folder to process, need trakmate XML files',
                           required=True)
+    parser.add_argument('--profile', help='Write profiles of the run to acit_profile '
+                                          'in the folder', action='store_true')
     return parser.parse_args()
 
 
@@ -23,5 +26,7 @@ print('Making videos and compiling data')
 if os.path.exists(os.path.join(args.folder, 'alldata.csv')):
     os.remove(os.path.join(args.folder, 'alldata.csv'))
 
-for file in file_list:
-    drawTrackmateVideo(file, os.path.join(args.folder, 'alldata.csv'))
+profiler = StageProfiler(os.path.join(args.folder, 'acit_profile') if args.profile else None)
+with profiler.stage('video'):
+    for file in file_list:
+        drawTrackmateVideo(file, os.path.join(args.folder, 'alldata.csv'))
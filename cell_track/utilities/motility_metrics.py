@@ -0,0 +1,23 @@
+from cell_track.tools.analytics import analyze_folder
+import argparse
+
+# Parallelize over folders..:
+# parallel 'python motility_metrics.py -f {}' ::: /path/to/dir/*
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='Compute speed, displacement, MSD, persistence and '
+                                                 'turning angles of all tracks in a folder.')
+    required = parser.add_argument_group('Required')
+    required.add_argument('--folder', '-f', help='The folder with the trackmate XML files',
+                          required=True)
+    parser.add_argument('--max_lag', type=int, default=20,
+                        help='Largest lag of the MSD curves, in frames')
+    return parser.parse_args()
+
+
+args = getArgs()
+
+table = analyze_folder(args.folder, max_lag=args.max_lag)
+print('Wrote the metrics of ' + str(len(table)) + ' tracks to All_tracks_motility.csv '
+      'and All_wells_msd.csv')
@@ -0,0 +1,67 @@
+from cell_track.tools.catalog import Catalog, STACK_COLUMNS
+import argparse
+import os
+
+# Add the folders of an experiment that was run without --catalog:
+# python query_catalog.py -c acit_catalog.sqlite --add /data/results/Exp1 --experiment Exp1
+# Mean speed per experiment and well:
+# python query_catalog.py -c acit_catalog.sqlite --summary mean_speed --by experiment,well
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='Fill and query the catalog of tracks '
+                                                 'of many experiments.')
+    required = parser.add_argument_group('Required')
+    required.add_argument('--catalog', '-c', help='The SQLite catalog', required=True)
+    parser.add_argument('--add', help='Add all trackmate XML files below this output folder')
+    parser.add_argument('--experiment', help='Name of the experiment added with --add, '
+                                             'defaults to the folder name. Also selects '
+                                             'the tracks of --summary and --tracks')
+    parser.add_argument('--well', help='Only the tracks of this well, e.g. Well3')
+    parser.add_argument('--summary', help='Count, mean, min and max of this track column')
+    parser.add_argument('--by', default='experiment,well',
+                        help='Stack columns to group --summary by (default experiment,well), '
+                             'out of ' + ', '.join(STACK_COLUMNS))
+    parser.add_argument('--tracks', help='Comma separated track columns to list, '
+                                         'e.g. track_id,mean_speed,straightness')
+    parser.add_argument('--all_tracks', help='Include the tracks that did not pass the '
+                                             'track filters', action='store_true')
+    parser.add_argument('--sql', help='Run this SQL query')
+    parser.add_argument('--out', '-o', help='Write the result to this CSV file '
+                                            'instead of printing it')
+    return parser.parse_args()
+
+
+args = getArgs()
+catalog = Catalog(args.catalog)
+
+if args.add:
+    experiment = args.experiment or os.path.basename(os.path.normpath(args.add))
+    run_id = catalog.add_run(experiment, args.add)
+    added = 0
+    for dir, subFolders, files in os.walk(args.add):
+        subFolders[:] = [subdir for subdir in subFolders if not subdir.endswith('.zarr')]
+        if any(name.endswith('trackmate.xml') for name in files):
+            lif = os.path.relpath(dir, args.add).split(os.sep)[0]
+            folder = os.path.relpath(dir, os.path.join(args.add, lif))
+            added += catalog.add_folder(dir, experiment, lif, folder, run_id)
+    print('Added ' + str(added) + ' stacks of ' + experiment)
+
+filtered = None if args.all_tracks else True
+result = None
+if args.sql:
+    result = catalog.query(args.sql)
+elif args.summary:
+    result = catalog.summary(args.summary, by=tuple(args.by.split(',')), filtered=filtered,
+                             experiment=args.experiment, well=args.well)
+elif args.tracks:
+    result = catalog.tracks(args.tracks.split(','), filtered=filtered,
+                            experiment=args.experiment, well=args.well)
+
+if result is not None:
+    if args.out:
+        result.to_csv(args.out, index=False)
+        print('Wrote ' + str(len(result)) + ' rows to ' + args.out)
+    else:
+        print(result.to_string(index=False))
+catalog.close()
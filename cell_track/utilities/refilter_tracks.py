@@ -0,0 +1,43 @@
+from cell_track.tools.trackmate import (DEFAULT_TRACK_FILTERS, format_track_filters,
+                                        parse_track_filters, process_xml_folder,
+                                        refilter_folder)
+import argparse
+import os
+
+# Try a longer minimum track length on a whole plate, without tracking again:
+# python refilter_tracks.py -f /data/results/Exp1 --filters "NUMBER_SPOTS>60,NUMBER_SPLITS<0.5" --make_csv
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='Filter the tracks of trackmate XML files '
+                                                 'again, with other track filters.')
+    required = parser.add_argument_group('Required')
+    required.add_argument('--folder', '-f', help='Folder with the trackmate XML files, '
+                                                 'subfolders included', required=True)
+    parser.add_argument('--filters', default=format_track_filters(DEFAULT_TRACK_FILTERS),
+                        help='Comma separated track filters, FEATURE>value keeps tracks '
+                             'with at least value, FEATURE<value at most (default %(default)s, '
+                             'as the TrackMate script)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes, defaults to the number of cores')
+    parser.add_argument('--make_csv', help='Make the CSV files of the folders again',
+                        action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    filters = parse_track_filters(args.filters)
+
+    results = refilter_folder(args.folder, filters, args.workers)
+    for path, kept, total in results:
+        print('%s: %d of %d tracks' % (path, kept, total))
+    print('Filtered ' + str(len(results)) + ' files with ' + format_track_filters(filters))
+
+    if args.make_csv:
+        for folder in sorted(set(os.path.dirname(path) for path, kept, total in results)):
+            process_xml_folder(folder, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
-import keras
-from keras_retinanet import models
 import argparse
-import tensorflow as tf
 import os
 
 from cell_track.tools.track_image import track_tiff_folder
-from cell_track.tools import get_session, safe_load_model
+from cell_track.tools import load_model
+from cell_track.tools.metrics import METRICS
+from cell_track.tools.profiling import StageProfiler
+from cell_track.tools.tuning import load_tuning
 # Requires:
 # tensorflow
 # keras
@@ -14,6 +14,8 @@ from cell_track.tools import get_session, safe_load_model
 
 parser = argparse.ArgumentParser(description='Simple training script for training a RetinaNet network.')
 parser.add_argument('--gpu', help='Id of the GPU to use (as reported by nvidia-smi).')
+parser.add_argument('--profile', help='Write profiles of the run to acit_profile '
+                                      'in the tiff folder', action='store_true')
 
 required = parser.add_argument_group('Required')
 required.add_argument('--tiff_folder', '-t', help='The tiff folder to process',
@@ -29,10 +31,16 @@ modelpath = args.model
 if args.gpu:
     os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
 
-keras.backend.tensorflow_backend.set_session(get_session())
-
-# convert into inference model
-model = safe_load_model(modelpath)
-
-
-track_tiff_folder(tiff_folder, model)
+# Uses a running inference server if there is one, see inference_server.py
+profiler = StageProfiler(os.path.join(tiff_folder, 'acit_profile') if args.profile else None)
+model = load_model(modelpath)
+
+if hasattr(model, 'run_job') and not args.profile:
+    # Let the server read the TIFF files too, instead of sending each frame
+    model.run_job('track_tiff_folder', os.path.abspath(tiff_folder))
+else:
+    with profiler.stage('detect'):
+        track_tiff_folder(tiff_folder, profiler.wrap_model(model),
+                          batch_size=load_tuning().get('batch_size', 1))
+    METRICS.write_json(os.path.join(tiff_folder, 'acit_metrics.json'))
+    print('frames/s: ' + str(METRICS.summary()['frames_per_second']))
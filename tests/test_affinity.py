@@ -0,0 +1,46 @@
+"""
+Unit tests for the NUMA topology and the pinning of detection workers.
+"""
+import os
+import tempfile
+import unittest
+
+from cell_track.tools import affinity
+from cell_track.tools.affinity import (format_cpulist, numa_nodes, parse_cpulist,
+                                       replica_cpu_sets)
+
+
+class TestAffinity(unittest.TestCase):
+    def test_cpulist(self):
+        self.assertEqual(parse_cpulist('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(format_cpulist([11, 10, 8, 3, 2, 1, 0]), '0-3,8,10-11')
+
+    def test_numa_nodes(self):
+        original = affinity.allowed_cpus
+        affinity.allowed_cpus = lambda: list(range(6))
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                for node, cpus in ((0, '0-3'), (1, '4-7'), (2, '8-11')):
+                    os.makedirs(os.path.join(root, 'node' + str(node)))
+                    with open(os.path.join(root, 'node' + str(node), 'cpulist'), 'w') as f:
+                        f.write(cpus + '\n')
+                # cpus outside the affinity of the process are left out
+                self.assertEqual(numa_nodes(root), {0: [0, 1, 2, 3], 1: [4, 5]})
+                self.assertEqual(numa_nodes(os.path.join(root, 'missing')),
+                                 {0: list(range(6))})
+        finally:
+            affinity.allowed_cpus = original
+
+    def test_replica_cpu_sets(self):
+        nodes = {0: list(range(8)), 1: list(range(8, 16))}
+        self.assertEqual(replica_cpu_sets(2, nodes),
+                         [(0, list(range(8))), (1, list(range(8, 16)))])
+        self.assertEqual(replica_cpu_sets(4, nodes),
+                         [(0, [0, 1, 2, 3]), (1, [8, 9, 10, 11]),
+                          (0, [4, 5, 6, 7]), (1, [12, 13, 14, 15])])
+        # More replicas than cpus share them
+        self.assertEqual(replica_cpu_sets(3, {0: [0, 1]}), [(0, [0]), (0, [1]), (0, [0])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Unit tests for the motility analytics.
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools.analytics import (Trajectories, msd, read_plate, track_metrics,
+                                        turning_angles)
+
+
+def make_trajectories(tracks, frame_interval=10.0):
+    """tracks: list of [(frame, x, y)] per track"""
+    rows = [(track_id, frame, x, y) for track_id, spots in enumerate(tracks)
+            for frame, x, y in spots]
+    table = np.array(rows, dtype=np.float64)
+    frames = table[:, 1].astype(np.int64)
+    return Trajectories(table[:, 0].astype(np.int64), frames, frames * frame_interval,
+                        table[:, 2], table[:, 3])
+
+
+class TestAnalytics(unittest.TestCase):
+    def test_track_metrics(self):
+        straight = [(0, 0, 0), (1, 3, 4), (2, 6, 8)]
+        square = [(0, 0, 0), (1, 1, 0), (2, 1, 1), (3, 0, 1)]
+        metrics = track_metrics(make_trajectories([straight, square]))
+
+        self.assertEqual(list(metrics['n_spots']), [3, 4])
+        self.assertEqual(list(metrics['duration']), [20.0, 30.0])
+        np.testing.assert_allclose(metrics['total_distance'], [10, 3])
+        np.testing.assert_allclose(metrics['net_displacement'], [10, 1])
+        np.testing.assert_allclose(metrics['max_displacement'], [10, np.sqrt(2)])
+        np.testing.assert_allclose(metrics['mean_speed'], [0.5, 0.1])
+        np.testing.assert_allclose(metrics['straightness'], [1, 1 / 3])
+        np.testing.assert_allclose(metrics['directional_persistence'], [1, 0], atol=1e-12)
+        np.testing.assert_allclose(metrics['mean_turning_angle'], [0, np.pi / 2])
+
+    def test_turning_angles_skip_pauses(self):
+        # Left turn, pause, right turn
+        track = [(0, 0, 0), (1, 1, 0), (2, 1, 1), (3, 1, 1), (4, 2, 1)]
+        tracks, angles = turning_angles(make_trajectories([track]))
+        np.testing.assert_allclose(angles, [np.pi / 2, -np.pi / 2])
+        self.assertEqual(list(tracks), [0, 0])
+
+    def test_msd_with_gap(self):
+        # Frame 2 is missing, moving 1 um per frame along x
+        track = [(0, 0, 0), (1, 1, 0), (3, 3, 0), (4, 4, 0)]
+        lags, lag_times, per_track, ensemble = msd(make_trajectories([track]), max_lag=5)
+        np.testing.assert_allclose(per_track[0, :4], [1, 4, 9, 16])
+        self.assertTrue(np.isnan(per_track[0, 4]))
+        np.testing.assert_allclose(lag_times[:4], [10, 20, 30, 40])
+        np.testing.assert_allclose(ensemble[:4], [1, 4, 9, 16])
+
+    def test_read_plate_scales_to_microns(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for well in (1, 2):
+                path = os.path.join(tmpdir, 'Well%d-Pos001.tif.trackmate.xml' % well)
+                write_trackmate_xml(path, n_tracks=6, n_frames=12, seed=well,
+                                    pixelwidth=2.0, timeinterval=60.0)
+                paths.append(path)
+            trajectories, tracks = read_plate(paths)
+            single, _ = read_plate(paths[:1])
+
+        self.assertEqual(sorted(set(tracks['well'])), ['Well1', 'Well2'])
+        self.assertEqual(len(set(trajectories.track_id)), len(tracks))
+        self.assertTrue(np.all(np.diff(trajectories.track_id) >= 0))
+        np.testing.assert_allclose(np.diff(single.t)[np.diff(single.track_id) == 0], 60.0)
+        metrics = track_metrics(trajectories)
+        self.assertEqual(len(metrics), len(tracks))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Unit tests for the benchmark helpers.
+"""
+import os
+import tempfile
+import unittest
+
+from benchmarks import synthetic
+from benchmarks.runner import compare
+from cell_track.tools.trackmate import process_imagestack
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_synthetic_trackmate_xml(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'synthetic.trackmate.xml')
+            synthetic.write_trackmate_xml(path, n_tracks=6, n_frames=10)
+            speed, processivity, displacement = process_imagestack(path)
+            # Every second track passes the filters
+            self.assertEqual(len(speed), 3)
+            self.assertTrue(all(0 <= ratio <= 1 for ratio in processivity))
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'best': 1.0}, 'b': {'best': 1.0}}}
+        results = {'results': {'a': {'best': 1.5}, 'b': {'best': 0.9}, 'c': {'best': 1}}}
+        rows = compare(results, baseline, threshold=0.2)
+        self.assertEqual([(row[0], row[4]) for row in rows], [('a', True), ('b', False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Unit tests for the catalog of tracks across experiments.
+"""
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools.catalog import Catalog
+from cell_track.tools.dataset import stack_tables
+
+
+class TestCatalog(unittest.TestCase):
+    def test_add_and_query(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = {}
+            for experiment in ('Exp1', 'Exp2'):
+                folder = os.path.join(tmpdir, experiment, 'Group1')
+                os.makedirs(folder)
+                for well in (1, 2):
+                    path = os.path.join(folder, 'Well%d-Pos001.tif.trackmate.xml' % well)
+                    write_trackmate_xml(path, n_tracks=6, n_frames=10, seed=well,
+                                        pixelwidth=2.0, timeinterval=60.0)
+                    paths[experiment, well] = path
+            catalog = Catalog(os.path.join(tmpdir, 'catalog.sqlite'))
+            run_id = catalog.add_run('Exp1', os.path.join(tmpdir, 'Exp1'), 'model.h5')
+            self.assertEqual(catalog.add_folder(os.path.join(tmpdir, 'Exp1', 'Group1'), 'Exp1',
+                                                'exp1.lif', 'Group1', run_id), 2)
+            catalog.add_folder(os.path.join(tmpdir, 'Exp2', 'Group1'), 'Exp2')
+            # Unchanged files are skipped
+            self.assertEqual(catalog.add_folder(os.path.join(tmpdir, 'Exp1', 'Group1'),
+                                                'Exp1'), 0)
+
+            tracks, spots = stack_tables(paths['Exp1', 2])
+            expected = tracks[tracks['filtered']]
+            selected = catalog.tracks(experiment='Exp1', well='Well2',
+                                      columns=['track_id', 'mean_speed'])
+            self.assertEqual(list(selected['position']), [1] * len(expected))
+            np.testing.assert_allclose(selected['mean_speed'], expected['mean_speed'])
+
+            summary = catalog.summary('mean_speed', by=('experiment', 'well'))
+            self.assertEqual(list(zip(summary['experiment'], summary['well'])),
+                             [('Exp1', 'Well1'), ('Exp1', 'Well2'),
+                              ('Exp2', 'Well1'), ('Exp2', 'Well2')])
+            self.assertAlmostEqual(summary['mean'][1], expected['mean_speed'].mean())
+            n_spots = catalog.query('SELECT COUNT(*) AS n FROM spots JOIN stacks '
+                                    'USING (stack_id) WHERE experiment = ?', ('Exp2',))
+            self.assertEqual(n_spots['n'][0], 2 * len(spots))
+
+            # A changed file replaces its stack
+            time.sleep(0.01)
+            write_trackmate_xml(paths['Exp1', 2], n_tracks=2, n_frames=10, seed=3)
+            self.assertTrue(catalog.add_stack(paths['Exp1', 2], 'Exp1'))
+            self.assertEqual(len(catalog.tracks(experiment='Exp1', well='Well2', filtered=None)), 2)
+            with self.assertRaises(ValueError):
+                catalog.tracks(columns=['track_id; DROP TABLE tracks'])
+            catalog.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Unit tests for the detection checkpoints.
+"""
+import os
+import tempfile
+import unittest
+
+from cell_track.tools.checkpoint import DetectionLog, atomic_write
+
+
+class TestDetectionLog(unittest.TestCase):
+    def test_resume_after_truncated_line(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'Well1-Pos001.tif.detections.jsonl')
+            log = DetectionLog(path)
+            log.append(1, [[1.0, 2.0, 30.0, 40.0]], [0.9])
+            log.append(2, [], [])
+            log.close()
+            # Simulate a crash in the middle of writing frame 3
+            with open(path, 'a') as f:
+                f.write('{"frame": 3, "boxes": [[1.0, ')
+
+            log = DetectionLog(path)
+            done = log.read()
+            self.assertEqual(sorted(done), [1, 2])
+            self.assertEqual(done[1], ([[1.0, 2.0, 30.0, 40.0]], [0.9]))
+
+            log.append(3, [[5.0, 5.0, 9.0, 9.0]], [0.5])
+            log.close()
+            self.assertEqual(sorted(DetectionLog(path).read()), [1, 2, 3])
+
+    def test_atomic_write_keeps_old_file_on_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'out.xml')
+            with atomic_write(path) as f:
+                f.write('done')
+            with self.assertRaises(RuntimeError):
+                with atomic_write(path) as f:
+                    f.write('half')
+                    raise RuntimeError
+            with open(path) as f:
+                self.assertEqual(f.read(), 'done')
+            self.assertEqual(os.listdir(tmpdir), ['out.xml'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Unit tests for the Parquet dataset of the tracks and spots.
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools.dataset import dataset_available, stack_tables, write_folder, load_table
+
+
+class TestDataset(unittest.TestCase):
+    def test_stack_tables(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'Well3-Pos002.tif.trackmate.xml')
+            write_trackmate_xml(path, n_tracks=5, n_frames=10, seed=1,
+                                pixelwidth=2.0, timeinterval=60.0)
+            tracks, spots = stack_tables(path)
+
+        self.assertEqual(set(tracks['stack']), {'Well3-Pos002'})
+        self.assertEqual(len(tracks), len(set(tracks['track_id'])))
+        self.assertEqual(set(spots['track_id']), set(tracks['track_id']))
+        np.testing.assert_allclose(spots['x'], spots['x_px'] * 2.0)
+        np.testing.assert_allclose(spots['t'], spots['frame'] * 60.0)
+        n_spots = spots.groupby('track_id').size()
+        np.testing.assert_array_equal(tracks.set_index('track_id')['n_spots'],
+                                      n_spots.reindex(tracks['track_id']))
+        self.assertFalse(tracks['track_mean_speed'].isnull().all())
+
+    @unittest.skipUnless(dataset_available(), 'pyarrow is not installed')
+    def test_write_and_load_partitions(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for well in (1, 2):
+                path = os.path.join(tmpdir, 'Well%d-Pos001.tif.trackmate.xml' % well)
+                write_trackmate_xml(path, n_tracks=4, n_frames=8, seed=well)
+            root = os.path.join(tmpdir, 'acit_dataset')
+            n_tracks, n_spots = write_folder(root, tmpdir, 'exp1', 'Group1')
+            # Stacks that did not change are not written again
+            self.assertEqual(write_folder(root, tmpdir, 'exp1', 'Group1'), (0, 0))
+
+            tracks = load_table(root, 'tracks')
+            well1 = load_table(root, 'spots', columns=['track_id', 'x'],
+                               filters=[('well', '=', 'Well1')])
+
+        self.assertEqual(len(tracks), n_tracks)
+        self.assertEqual(sorted(set(tracks['well'].astype(str))), ['Well1', 'Well2'])
+        self.assertEqual(list(well1.columns), ['track_id', 'x'])
+        self.assertLess(len(well1), n_spots)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Unit tests for the Python linker.
+"""
+import os
+import tempfile
+import unittest
+from xml.etree import ElementTree as ET
+
+from cell_track.tools.linking import link_spots, link_xml, track_features
+from cell_track.tools.trackmate import Track, trackmateXML
+
+
+class TestLinking(unittest.TestCase):
+    def test_link_spots_with_gap(self):
+        # Two cells moving right, the first is missed in frames 3 and 4
+        frames = {}
+        for frame in range(8):
+            spots = [('b%d' % frame, 10.0 + 5 * frame, 200.0, frame * 300.0, 0.9)]
+            if frame not in (3, 4):
+                spots.append(('a%d' % frame, 10.0 + 5 * frame, 100.0, frame * 300.0, 0.9))
+            frames[frame] = spots
+        tracks = link_spots(frames)
+        self.assertEqual(sorted(len(track) for track in tracks), [6, 8])
+        gap_track = min(tracks, key=len)
+        features = track_features(gap_track, 0)
+        self.assertEqual(features['NUMBER_GAPS'], 1)
+        self.assertEqual(features['LONGEST_GAP'], 2)
+        self.assertAlmostEqual(features['TRACK_DISPLACEMENT'], 35.0)
+        self.assertAlmostEqual(features['CONFINMENT_RATIO'], 1.0)
+        self.assertAlmostEqual(features['TRACK_MEAN_SPEED'], 5.0 / 300)
+
+    def test_link_xml(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tm_xml = trackmateXML()
+            tm_xml.filename = 'stack.tif'
+            tm_xml.imagepath = tmpdir
+            for frame in range(40):
+                tm_xml.frame = frame
+                tm_xml.nframes = frame + 1
+                boxes = [(100 + 2 * frame, 100, 120 + 2 * frame, 120)]
+                if frame < 10:
+                    boxes.append((500, 500, 520, 520 + frame))
+                tm_xml.add_frame_spots(boxes, [0.9] * len(boxes))
+            tm_xml.write_xml()
+
+            out_path = link_xml(os.path.join(tmpdir, 'stack.tif.xml'))
+            self.assertEqual(out_path, os.path.join(tmpdir, 'stack.tif.trackmate.xml'))
+            root = ET.parse(out_path).getroot()
+            tracks = [Track(xml_track, root) for xml_track in root.findall('Model/AllTracks/Track')]
+            # The short track does not pass the NUMBER_SPOTS filter
+            self.assertEqual(len(tracks), 2)
+            self.assertEqual([track.include for track in tracks].count(True), 1)
+            long_track = [track for track in tracks if track.include][0]
+            self.assertEqual(len(long_track.lines), 39)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Unit tests for the run manifest.
+"""
+import tempfile
+import unittest
+
+from cell_track.tools.manifest import RunManifest
+
+
+class TestRunManifest(unittest.TestCase):
+    def test_pending_and_invalidation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = RunManifest(tmpdir)
+            lif, series = 'plate1.lif', 'Infected/Well1-Pos001'
+
+            self.assertEqual(manifest.check(lif, series, 'detect', 'a', 'm'), 'new')
+            with manifest.run(lif, series, 'detect', 'a', 'm'):
+                pass
+            self.assertEqual(manifest.check(lif, series, 'detect', 'a', 'm'), 'current')
+            self.assertEqual(manifest.pending('track', lif), [series])
+
+            manifest.mark_done(lif, series, 'track',
+                               manifest.upstream_hash(lif, series, 'detect'))
+            self.assertEqual(manifest.pending('track', lif), [])
+            self.assertEqual(manifest.pending('video', lif), [series])
+
+            # A new model invalidates detection and everything after it
+            self.assertEqual(manifest.check(lif, series, 'detect', 'a', 'm2'), 'stale')
+            self.assertIsNone(manifest.get(lif, series, 'track'))
+            manifest.close()
+
+    def test_failed_stage_is_not_done(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = RunManifest(tmpdir)
+            with self.assertRaises(ValueError):
+                with manifest.run('plate1.lif', 'Well1-Pos001', 'detect'):
+                    raise ValueError
+            self.assertEqual(manifest.get('plate1.lif', 'Well1-Pos001', 'detect')['status'],
+                             'failed')
+            self.assertEqual(manifest.check('plate1.lif', 'Well1-Pos001', 'detect'), 'new')
+            manifest.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
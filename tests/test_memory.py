@@ -0,0 +1,117 @@
+"""
+Unit tests for the memory accounting and the low memory variants.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from xml.etree import ElementTree as ET
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools import memory
+from cell_track.tools.memory import MemoryBudget, parse_size
+from cell_track.tools.metrics import Metrics
+from cell_track.tools.stack_io import TiffStackWriter
+from cell_track.tools.trackmate import (Track, process_xml_folder, read_filtered_tracks,
+                                        trackmateXML)
+
+
+class TestMemory(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512M'), 512 * 1024 ** 2)
+        self.assertEqual(parse_size('8GB'), 8 * 1024 ** 3)
+        self.assertEqual(parse_size('1.5g'), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_size('1000'), 1000)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_budget_workers(self):
+        budget = MemoryBudget('1T')
+        self.assertEqual(budget.workers(1024, 4), 4)
+        budget = MemoryBudget(0)
+        self.assertEqual(budget.workers(1024, 4), 1)
+
+    def test_budget_limits_parse_pool(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for pos in range(3):
+                write_trackmate_xml(os.path.join(tmpdir, 'Well1-Pos%03d.tif.trackmate.xml' % pos),
+                                    n_tracks=4, n_frames=10, seed=pos)
+            # No room for a pool, the files are parsed in this process
+            with mock.patch('multiprocessing.get_context') as get_context:
+                process_xml_folder(tmpdir, workers=3, budget=MemoryBudget(0))
+            get_context.assert_not_called()
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'All_wells_speed.csv')))
+
+    def test_peak_without_resource_module(self):
+        # Windows has no resource module
+        with mock.patch.dict(sys.modules, {'resource': None}):
+            self.assertGreaterEqual(memory._lifetime_peak_rss(), 0)
+        self.assertGreater(memory._lifetime_peak_rss(), 0)
+
+    def test_stage_memory(self):
+        metrics = Metrics()
+        with metrics.memory('detect', trace=True):
+            data = np.ones((1024, 1024, 8))
+        del data
+        stats = metrics.summary()['memory']['detect']
+        self.assertGreaterEqual(stats['rss_peak_mb'], stats['rss_start_mb'])
+        self.assertGreater(stats['python_peak_mb'], 60)
+        self.assertTrue(stats['top_allocations'])
+
+    def test_streamed_tiff_matches_save_all(self):
+        frames = [np.random.RandomState(t).randint(0, 255, (40, 60)).astype(np.uint8)
+                  for t in range(5)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            streamed = os.path.join(tmpdir, 'streamed.tif')
+            with TiffStackWriter(streamed) as writer:
+                for frame in frames:
+                    writer.append(frame)
+            self.assertEqual(writer.nframes, 5)
+
+            with Image.open(streamed) as image:
+                self.assertEqual(image.n_frames, 5)
+                for t, frame in enumerate(frames):
+                    image.seek(t)
+                    np.testing.assert_array_equal(np.asarray(image), frame)
+
+    def test_spilled_xml_matches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            contents = []
+            for spill in (False, True):
+                tm_xml = trackmateXML(spill_to_disk=spill)
+                tm_xml.imagepath = tmpdir
+                tm_xml.filename = 'spill' + str(spill) + '.tif'
+                for frame in range(3):
+                    tm_xml.frame = tm_xml.nframes = frame
+                    tm_xml.add_frame_spots([(0, 0, 10, 10), (20, 20, 30, 30)], [0.9, 0.5])
+                tm_xml.write_xml()
+                with open(os.path.join(tmpdir, tm_xml.filename + '.xml')) as f:
+                    contents.append(f.read().replace('spill' + str(spill), ''))
+            self.assertEqual(contents[0], contents[1])
+
+    def test_read_filtered_tracks_matches_track(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'Well1-Pos001.tif.trackmate.xml')
+            write_trackmate_xml(path, n_tracks=8, n_frames=12)
+            root = ET.parse(path).getroot()
+            tracks = [Track(xml_track, root)
+                      for xml_track in root.findall('Model/AllTracks/Track')]
+            expected = [track for track in tracks if track.include]
+            light = read_filtered_tracks(path)
+
+        self.assertEqual([track.id for track in light], [track.id for track in expected])
+        for light_track, track in zip(light, expected):
+            self.assertEqual([(spot.id, spot.frame, spot.x, spot.y)
+                              for spot in light_track.spot_objs],
+                             [(spot.id, spot.frame, spot.x, spot.y)
+                              for spot in track.spot_objs])
+            self.assertEqual([(line.x1y1, line.x2y2) for line in light_track.lines],
+                             [(line.x1y1, line.x2y2) for line in track.lines])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Unit tests for the pipeline metrics.
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from cell_track.tools.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_summary_and_exports(self):
+        metrics = Metrics()
+        for frame in metrics.timed_iter(range(4), 'detect.decode'):
+            with metrics.timer('detect.inference'):
+                pass
+            metrics.count('detect.frames')
+        metrics.count('detect.cells', 10)
+
+        summary = metrics.summary()
+        self.assertEqual(summary['counters'], {'detect.cells': 10, 'detect.frames': 4})
+        self.assertEqual(summary['timers']['detect.decode']['count'], 4)
+        self.assertEqual(summary['timers']['detect.inference']['count'], 4)
+        self.assertGreater(summary['frames_per_second']['detect'], 0)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            metrics.write_json(os.path.join(tmpdir, 'metrics.json'))
+            with open(os.path.join(tmpdir, 'metrics.json')) as f:
+                self.assertEqual(json.load(f)['counters']['detect.frames'], 4)
+
+            metrics.write_prometheus(os.path.join(tmpdir, 'acit.prom'))
+            with open(os.path.join(tmpdir, 'acit.prom')) as f:
+                lines = f.read().splitlines()
+            self.assertIn('acit_detect_frames_total 4', lines)
+            self.assertIn('acit_detect_inference_seconds_bucket{le="+Inf"} 4', lines)
+            self.assertIn('acit_detect_inference_seconds_count 4', lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
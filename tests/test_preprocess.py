@@ -0,0 +1,45 @@
+"""
+Unit tests for the fused frame preprocessing, checked against keras_retinanet.
+"""
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from cell_track.tools.track_image import preprocess_frame
+
+try:
+    from keras_retinanet.utils.image import preprocess_image, resize_image
+except ImportError:
+    preprocess_image = resize_image = None
+
+
+def reference(frame):
+    """Preprocesses a frame like track_image did before, through PIL and keras_retinanet."""
+    image = np.asarray(Image.fromarray(frame).convert('RGB'))[:, :, ::-1].copy()
+    image = preprocess_image(image)
+    return resize_image(image)
+
+
+@unittest.skipIf(preprocess_image is None, 'keras_retinanet is not installed')
+class TestPreprocessFrame(unittest.TestCase):
+    def check(self, frame):
+        expected, expected_scale = reference(frame)
+        batch, scale = preprocess_frame(frame)
+        self.assertAlmostEqual(scale, expected_scale)
+        self.assertEqual(batch.shape, (1,) + expected.shape)
+        self.assertEqual(batch.dtype, np.float32)
+        np.testing.assert_allclose(batch[0], expected, rtol=0, atol=1e-3)
+
+    def test_matches_keras_retinanet(self):
+        rng = np.random.RandomState(0)
+        # 104 x 139 is scaled up to a smallest side of 800, 100 x 400 to a
+        # largest side of 1333
+        for shape in ((104, 139), (100, 400)):
+            with self.subTest(shape=shape):
+                self.check(rng.randint(0, 256, shape, dtype=np.uint8))
+                self.check(rng.randint(0, 256, shape + (3,), dtype=np.uint8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Unit tests for the stage profiler.
+"""
+import os
+import tempfile
+import time
+import unittest
+
+from cell_track.tools.profiling import StageProfiler
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stage_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler = StageProfiler(tmpdir, interval=0.001)
+            with profiler.stage('detect'):
+                busy_wait(0.1)
+            for ext in ('.prof', '.txt', '.collapsed'):
+                self.assertTrue(os.path.exists(os.path.join(tmpdir, 'detect' + ext)))
+            with open(os.path.join(tmpdir, 'detect.collapsed')) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(any('busy_wait' in line for line in lines))
+            stack, count = lines[0].rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+    def test_disabled(self):
+        profiler = StageProfiler(None)
+        model = object()
+        with profiler.stage('detect'):
+            pass
+        self.assertIs(profiler.wrap_model(model), model)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Unit tests for the inference server, with a stand-in model.
+"""
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from multiprocessing import AuthenticationError
+from unittest import mock
+
+import numpy as np
+
+from cell_track.tools.server import (KEY_FILE, InferenceServer, RemoteModel, connect,
+                                     runtime_dir)
+
+
+class EchoModel:
+    def predict_on_batch(self, batch):
+        return batch.sum(), batch.shape
+
+
+class TestInferenceServer(unittest.TestCase):
+    def test_remote_predict(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.dict(os.environ, {'ACIT_RUNTIME_DIR': os.path.join(tmpdir, 'run')}):
+            address = os.path.join(tmpdir, 'server.sock')
+            self.assertIsNone(connect(address=address))
+
+            server = InferenceServer(EchoModel(), 'model.h5', address=address)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            for _ in range(100):
+                if os.path.exists(address):
+                    break
+                threading.Event().wait(0.05)
+            self.assertEqual(os.stat(address).st_mode & 0o077, 0)
+            key_path = os.path.join(tmpdir, 'run', KEY_FILE)
+            self.assertEqual(os.stat(key_path).st_mode & 0o077, 0)
+            self.assertEqual(os.stat(os.path.dirname(key_path)).st_mode & 0o077, 0)
+
+            # Clients without the key are turned away, and the server carries on
+            with self.assertRaises(AuthenticationError):
+                RemoteModel(address, authkey=b'wrong key')._request('ping')
+
+            # A client dropping mid-handshake doesn't stop the server accepting
+            dropped = socket.socket(socket.AF_UNIX)
+            dropped.connect(address)
+            dropped.close()
+
+            # Only a server with the same model is used
+            self.assertIsNone(connect('other.h5', address=address))
+            model = connect('model.h5', address=address)
+            self.assertIsNotNone(model)
+            batch = np.ones((1, 4, 5, 3), dtype=np.float32)
+            self.assertEqual(model.predict_on_batch(batch), (60.0, (1, 4, 5, 3)))
+            with self.assertRaises(RuntimeError):
+                model.run_job('no_such_job')
+            model.close()
+
+            server.shutdown()
+            thread.join(5)
+            self.assertFalse(os.path.exists(address))
+
+    def test_accept_backs_off_on_errors(self):
+        server = InferenceServer(EchoModel(), 'model.h5', address='unused')
+        errors = [OSError(24, 'Too many open files')] * 3
+
+        def accept():
+            if len(listener.accept.mock_calls) > len(errors):
+                server.shutdown()
+                raise OSError('listener closed')
+            raise errors[0]
+        listener = mock.Mock()
+        listener.accept.side_effect = accept
+        with mock.patch('cell_track.tools.server.ACCEPT_RETRY_DELAY', 0.01), \
+                mock.patch('cell_track.tools.server.ACCEPT_MAX_DELAY', 0.02), \
+                mock.patch('cell_track.tools.server.print') as print_:
+            server._accept(listener)
+        self.assertEqual(listener.accept.call_count, 4)
+        self.assertEqual(print_.call_count, 3)
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'POSIX permissions')
+    def test_shared_runtime_dir(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.dict(os.environ, {'ACIT_RUNTIME_DIR': tmpdir}):
+            os.chmod(tmpdir, 0o755)
+            with self.assertRaises(RuntimeError):
+                runtime_dir()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Unit tests for the spatial-temporal index of the spots and tracks.
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools.spatial_index import SpotIndex
+from cell_track.tools.trackmate import read_filtered_tracks
+from tests.test_analytics import make_trajectories
+
+
+class TestSpotIndex(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.RandomState(0)
+        tracks = []
+        for _ in range(200):
+            start = rng.randint(0, 50)
+            frames = np.arange(start, start + rng.randint(1, 30))
+            xy = np.cumsum(rng.normal(0, 5, (len(frames), 2)), axis=0) + rng.uniform(0, 1000, 2)
+            tracks.append([(frame, x, y) for frame, (x, y) in zip(frames, xy)])
+        trajectories = make_trajectories(tracks, frame_interval=1.0)
+        index = SpotIndex(trajectories, cell_size=25)
+        t = trajectories
+        for _ in range(50):
+            x0, y0 = rng.uniform(-50, 1000, 2)
+            x1, y1 = x0 + rng.uniform(0, 300), y0 + rng.uniform(0, 300)
+            f0 = rng.randint(-5, 60)
+            f1 = f0 + rng.randint(0, 20)
+            inside = np.flatnonzero((t.x >= x0) & (t.x <= x1) & (t.y >= y0) & (t.y <= y1) &
+                                    (t.frame >= f0) & (t.frame <= f1))
+            np.testing.assert_array_equal(index.spots_in(x0, y0, x1, y1, f0, f1), inside)
+            self.assertEqual(index.tracks_in(x0, y0, x1, y1, f0, f1),
+                             sorted(set(t.track_id[inside])))
+            result = index.query(x0, y0, x1, y1, f0, f1)
+            if result:
+                np.testing.assert_array_equal(np.concatenate([s for _, s in result]), inside)
+            # Every track with a spot inside has an overlapping bounding box
+            self.assertTrue(set(t.track_id[inside]) <=
+                            set(index.tracks_overlapping(x0, y0, x1, y1, f0, f1)))
+
+        spots = index.track_slice(3)
+        self.assertEqual(list(t.frame[spots]), [frame for frame, _, _ in tracks[3]])
+
+    def test_from_xml_and_tracks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'Well1-Pos001.tif.trackmate.xml')
+            write_trackmate_xml(path, n_tracks=10, n_frames=20, seed=2)
+            from_xml = SpotIndex.from_xml(path)
+            from_tracks = SpotIndex.from_tracks(read_filtered_tracks(path))
+        self.assertEqual(sorted(from_xml.names), sorted(from_tracks.names))
+        everything = from_xml.tracks_in(-1e9, -1e9, 1e9, 1e9)
+        self.assertEqual(sorted(everything), sorted(from_xml.names))
+        self.assertEqual(from_xml.tracks_in(-1e9, -1e9, 1e9, 1e9, 100, 200), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Unit tests for the intensity features of the detected spots.
+"""
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest import mock
+from xml.etree import ElementTree as ET
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.timelapse import StubModel, cell_trajectories, render_frame
+from cell_track.tools.spot_features import SPOT_FEATURES, box_features
+from cell_track.tools.track_image import track_lif
+from cell_track.tools.trackmate import trackmateXML
+
+Dims = namedtuple('Dims', 'x y z t m')
+
+
+class FakeLifImage:
+    """A LIF series of synthetic frames, as readlif reads it."""
+    def __init__(self, n_frames=4):
+        self.path = '/plate1/Group1'
+        self.name = 'Well1-Pos001'
+        self.nt = n_frames
+        self.positions = cell_trajectories(10, n_frames)
+        frame = render_frame(self.positions[:, 0])
+        self.dims = Dims(frame.shape[1], frame.shape[0], 1, n_frames, 1)
+        self.scale = (0.5, 0.5, None, 1 / 300.0)
+
+    def get_frame(self, t=0):
+        return Image.fromarray(render_frame(self.positions[:, t], seed=t))
+
+
+class FakeLifFile:
+    def __init__(self, path):
+        self.image = FakeLifImage()
+
+    def get_iter_image(self):
+        return iter([self.image])
+
+
+class InterruptedModel(StubModel):
+    """Stops after calls batches, like a run that is killed."""
+    def __init__(self, calls):
+        super().__init__()
+        self.calls = calls
+
+    def predict_on_batch(self, batch):
+        if not self.calls:
+            raise KeyboardInterrupt
+        self.calls -= 1
+        return super().predict_on_batch(batch)
+
+
+class TestBoxFeatures(unittest.TestCase):
+    def test_matches_crops(self):
+        rng = np.random.RandomState(0)
+        frame = rng.randint(0, 4096, (200, 300)).astype(np.uint16)
+        boxes = [(x, y, x + w, y + h) for x, y, w, h in
+                 zip(rng.uniform(-20, 290, 100), rng.uniform(-20, 190, 100),
+                     rng.uniform(1, 60, 100), rng.uniform(1, 60, 100))]
+        features = box_features(frame, boxes)
+        self.assertEqual(sorted(features), sorted(SPOT_FEATURES))
+        for index, box in enumerate(boxes):
+            x1, y1 = min(max(round(box[0]), 0), 299), min(max(round(box[1]), 0), 199)
+            x2, y2 = max(min(round(box[2]), 300), x1 + 1), max(min(round(box[3]), 200), y1 + 1)
+            crop = frame[y1:y2, x1:x2].astype(np.float64)
+            for feature, value in (('MEAN_INTENSITY', crop.mean()),
+                                   ('MEDIAN_INTENSITY', np.median(crop)),
+                                   ('MIN_INTENSITY', crop.min()),
+                                   ('MAX_INTENSITY', crop.max()),
+                                   ('TOTAL_INTENSITY', crop.sum()),
+                                   ('STANDARD_DEVIATION', crop.std())):
+                self.assertAlmostEqual(features[feature][index], value, places=6, msg=feature)
+
+    def test_bright_cell(self):
+        frame = np.full((100, 100, 3), 10, dtype=np.uint8)
+        frame[40:60, 40:60] = 90
+        frame[50, 50] = 250
+        features = box_features(frame, [(40, 40, 60, 60), (0, 0, 20, 20)])
+        self.assertEqual(features['MAX_INTENSITY'][0], 250)
+        self.assertEqual(features['MEDIAN_INTENSITY'][0], 90)
+        self.assertAlmostEqual(features['CONTRAST'][0], (90.4 - 10) / (90.4 + 10))
+        self.assertGreater(features['SNR'][0], 0)
+        self.assertAlmostEqual(features['RADIUS'][0], np.sqrt(400 / np.pi))
+        # Flat background
+        self.assertEqual(features['STANDARD_DEVIATION'][1], 0)
+        self.assertEqual(features['SNR'][1], 0)
+        self.assertEqual(len(box_features(frame, [])['MEAN_INTENSITY']), 0)
+
+    def test_written_to_xml(self):
+        frame = np.arange(100 * 100, dtype=np.float32).reshape(100, 100)
+        boxes = [(0, 0, 10, 10), (20, 20, 30, 30)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tm_xml = trackmateXML()
+            tm_xml.imagepath = tmpdir
+            tm_xml.filename = 'Well1-Pos001.tif'
+            tm_xml.frame = tm_xml.nframes = 0
+            tm_xml.add_frame_spots(boxes, [0.9, 0.5], box_features(frame, boxes))
+            tm_xml.frame = tm_xml.nframes = 1
+            tm_xml.add_frame_spots(boxes, [0.9, 0.5])
+            tm_xml.write_xml()
+            root = ET.parse(os.path.join(tmpdir, 'Well1-Pos001.tif.xml')).getroot()
+        spots = root.findall('Model/AllSpots/SpotsInFrame/Spot')
+        self.assertEqual(float(spots[1].get('MEAN_INTENSITY')), frame[20:30, 20:30].mean())
+        self.assertEqual(float(spots[1].get('TOTAL_INTENSITY')), frame[20:30, 20:30].sum())
+        self.assertEqual(spots[3].get('MEAN_INTENSITY'), '50')
+        self.assertEqual(set(spots[0].attrib), set(spots[3].attrib))
+
+
+class TestResumedFeatures(unittest.TestCase):
+    def test_resume_without_image_stack(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch('readlif.reader.LifFile', FakeLifFile):
+            with self.assertRaises(KeyboardInterrupt):
+                track_lif('plate1.lif', tmpdir, InterruptedModel(calls=2), out_format='none')
+            track_lif('plate1.lif', tmpdir, StubModel(), out_format='none')
+            root = ET.parse(os.path.join(tmpdir, 'Group1', 'Well1-Pos001.tif.xml')).getroot()
+        frames = root.findall('Model/AllSpots/SpotsInFrame')
+        self.assertEqual(len(frames), 4)
+        for frame in frames:
+            spots = frame.findall('Spot')
+            self.assertTrue(spots)
+            # Measured on the frame, also for the frames detected before the interruption
+            for spot in spots:
+                self.assertNotEqual(spot.get('TOTAL_INTENSITY'), '21000')
+                self.assertNotEqual(spot.get('MEAN_INTENSITY'), '50')
+
+
+if __name__ == '__main__':
+    unittest.main()
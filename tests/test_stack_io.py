@@ -0,0 +1,128 @@
+"""
+Unit tests for the image stack readers, checked against PIL.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from cell_track.tools.stack_io import (DEFAULT_CALIBRATION, FrameSource, ImageCalibration,
+                                       MmapTiffFrameSource, TiffFrameSource,
+                                       complete_calibration, lif_calibration,
+                                       open_tiff_frames, tiff_calibration, to_rgb8)
+
+
+class TestTiffFrames(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.RandomState(0)
+        self.frames = [rng.randint(0, 255, (37, 53)).astype(np.uint8)
+                       for _ in range(4)]
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def _save(self, name, **kwargs):
+        path = os.path.join(self.tmpdir.name, name)
+        images = [Image.fromarray(frame) for frame in self.frames]
+        images[0].save(path, format='tiff', save_all=True,
+                       append_images=images[1:], **kwargs)
+        return path
+
+    def test_uncompressed_is_memory_mapped(self):
+        frames = open_tiff_frames(self._save('raw.tif'))
+        self.assertIsInstance(frames, MmapTiffFrameSource)
+        self.assertEqual(len(frames), len(self.frames))
+        for frame, expected in zip(frames, self.frames):
+            np.testing.assert_array_equal(frame, expected)
+        np.testing.assert_array_equal(frames[2], self.frames[2])
+
+    def test_compressed_falls_back_to_pil(self):
+        frames = open_tiff_frames(self._save('lzw.tif', compression='tiff_lzw'))
+        self.assertIsInstance(frames, TiffFrameSource)
+        for frame, expected in zip(frames, self.frames):
+            np.testing.assert_array_equal(frame, expected)
+
+    def test_rgb8_matches_pil(self):
+        expected = np.asarray(Image.fromarray(self.frames[0]).convert('RGB'))
+        np.testing.assert_array_equal(to_rgb8(self.frames[0]), expected)
+
+    def test_incomplete_source_cannot_be_created(self):
+        class LengthOnly(FrameSource):
+            def __len__(self):
+                return 1
+        with self.assertRaises(TypeError):
+            LengthOnly()
+
+
+class TestCalibration(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def _save(self, name, **kwargs):
+        path = os.path.join(self.tmpdir.name, name)
+        frames = [Image.fromarray(np.zeros((30, 40), dtype=np.uint8)) for _ in range(3)]
+        frames[0].save(path, format='tiff', save_all=True, append_images=frames[1:],
+                       **kwargs)
+        return path
+
+    def test_imagej_tiff(self):
+        description = 'ImageJ=1.53t\nimages=3\nframes=3\nunit=micron\nfinterval=120.0\n'
+        path = self._save('imagej.tif', resolution=1 / 0.65, resolution_unit=1,
+                          description=description)
+        calibration = tiff_calibration(path)
+        self.assertEqual((calibration.width, calibration.height), (40, 30))
+        self.assertAlmostEqual(calibration.pixel_width, 0.65)
+        self.assertAlmostEqual(calibration.pixel_height, 0.65)
+        self.assertEqual(calibration.frame_interval, 120.0)
+
+    def test_ome_tiff(self):
+        description = ('<?xml version="1.0"?><OME><Image><Pixels PhysicalSizeX="0.5" '
+                       'PhysicalSizeY="500" PhysicalSizeYUnit="nm" TimeIncrement="2" '
+                       'TimeIncrementUnit="min" /></Image></OME>')
+        calibration = tiff_calibration(self._save('ome.tif', description=description))
+        self.assertEqual(calibration.pixel_width, 0.5)
+        self.assertAlmostEqual(calibration.pixel_height, 0.5)
+        self.assertEqual(calibration.frame_interval, 120.0)
+
+    def test_resolution_tags(self):
+        # 2000 pixels per centimeter
+        calibration = tiff_calibration(self._save('cm.tif', resolution=2000.0,
+                                                  resolution_unit=3))
+        self.assertAlmostEqual(calibration.pixel_width, 5.0)
+        self.assertIsNone(calibration.frame_interval)
+        # 72 dpi is a display resolution
+        calibration = tiff_calibration(self._save('dpi.tif', dpi=(72, 72)))
+        self.assertIsNone(calibration.pixel_width)
+
+    def test_lif(self):
+        Dims = namedtuple('Dims', 'x y z t m')
+        Image = namedtuple('LifImage', 'dims scale')
+        calibration = lif_calibration(Image(Dims(512, 256, 1, 10, 1), (2.0, 2.0, None, 0.1)))
+        self.assertEqual(calibration, ImageCalibration(512, 256, 0.5, 0.5, 10.0))
+        calibration = lif_calibration(Image(Dims(512, 256, 1, 1, 1), (2.0, 2.0, None, None)))
+        self.assertIsNone(calibration.frame_interval)
+        # Older readlif, with plain tuples and no time scale
+        calibration = lif_calibration(Image((512, 256, 1, 10), (2.0, 4.0, None)))
+        self.assertEqual(calibration, ImageCalibration(512, 256, 0.5, 0.25, None))
+
+    def test_defaults(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            calibration = complete_calibration(ImageCalibration(512, 256, 0.5, 0.5, None),
+                                               'Well1-Pos001')
+        self.assertEqual(calibration, ImageCalibration(512, 256, 0.5, 0.5,
+                                                       DEFAULT_CALIBRATION[4]))
+        self.assertIn('Warning: Well1-Pos001 has no frame_interval', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Unit tests for the parameter sweep over logged detections.
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cell_track.tools.box import get_box_center
+from cell_track.tools.checkpoint import DETECTION_LOG_EXT, DetectionLog
+from cell_track.tools.stack_io import DEFAULT_CALIBRATION
+from cell_track.tools.sweep import (detection_spots, find_logs, grid_points, stack_calibration,
+                                   sweep)
+from cell_track.tools.track_image import filter_detections
+
+
+def write_detections(path, n_cells=10, n_frames=40, seed=0):
+    """Logs boxes of cells 150 pixels apart moving 3 to 4 pixels per frame, each
+    with a weak duplicate."""
+    rng = np.random.RandomState(seed)
+    start = 100 + 150 * np.array([(i % 5, i // 5) for i in range(n_cells)], dtype=float)
+    step = np.array([3.0, 2.0]) + rng.uniform(-0.5, 0.5, (n_cells, 2))
+    log = DetectionLog(path)
+    for frame in range(n_frames):
+        boxes, scores = [], []
+        for x, y in start + frame * step:
+            boxes.append([int(x) - 8, int(y) - 8, int(x) + 8, int(y) + 8])
+            scores.append(0.9)
+            boxes.append([int(x) - 3, int(y) - 8, int(x) + 13, int(y) + 8])
+            scores.append(0.15)
+        log.append(frame, boxes, scores)
+    log.close()
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, 'Group1'))
+        self.log = os.path.join(self.folder, 'Group1', 'Well1-Pos001' + DETECTION_LOG_EXT)
+        write_detections(self.log)
+
+    def test_grid_points(self):
+        points = grid_points({'score_threshold': [0.1, 0.2], 'linking_max_distance': [20, 40]})
+        self.assertEqual(len(points), 4)
+        self.assertEqual([point['score_threshold'] for point in points], [0.1, 0.1, 0.2, 0.2])
+        self.assertEqual(points[0]['center_distance'], 20)
+        with self.assertRaises(ValueError):
+            grid_points({'threshold': [0.1]})
+
+    def test_detection_spots(self):
+        detections = DetectionLog(self.log).read()
+        for score, center in ((0.1, 20), (0.1, 2), (0.5, 20)):
+            boxes, _ = filter_detections(*detections[0], score_threshold=score,
+                                         center_distance=center)
+            self.assertEqual(len(detection_spots(detections, score, center)[0]), len(boxes))
+        # The duplicates are 5 pixels off, kept with a center distance of 2
+        self.assertGreater(len(detection_spots(detections, 0.1, 2)[0]),
+                           len(detection_spots(detections, 0.1, 20)[0]))
+        spot = detection_spots(detections, 0.5, 20)[3][0]
+        boxes, _ = filter_detections(*detections[3], score_threshold=0.5, center_distance=20)
+        self.assertEqual(spot[1:3], get_box_center(boxes[0]))
+        self.assertEqual(spot[3], 900.0)
+
+    def test_sweep(self):
+        self.assertEqual(find_logs(self.folder), [self.log])
+        grid = {'score_threshold': [0.1, 0.5], 'linking_max_distance': [1.0, 40.0],
+                'gap_closing_max_distance': [1.0]}
+        results = sweep(find_logs(self.folder), grid, workers=1)
+        self.assertEqual(len(results), 4)
+        best = results[(results.score_threshold == 0.5) &
+                       (results.linking_max_distance == 40.0)].iloc[0]
+        spots = detection_spots(DetectionLog(self.log).read(), 0.5, 20)
+        self.assertEqual(best.n_spots, sum(len(frame) for frame in spots.values()))
+        # Every cell is linked over all 40 frames
+        self.assertEqual(best.n_filtered, len(spots[0]))
+        self.assertEqual(best.median_track_spots, 40)
+        # No links or gaps closed within 1 pixel, so no tracks
+        self.assertEqual(results[results.linking_max_distance == 1.0].n_tracks.max(), 0)
+        self.assertTrue(np.isnan(results[results.linking_max_distance == 1.0]
+                                 .median_speed).all())
+
+    def test_pool_matches_one_process(self):
+        grid = {'score_threshold': [0.1, 0.5], 'center_distance': [10, 20],
+                'linking_max_distance': [20.0, 40.0]}
+        single = sweep(find_logs(self.folder), grid, workers=1)
+        pooled = sweep(find_logs(self.folder), grid, workers=2)
+        pd.testing.assert_frame_equal(pooled, single)
+
+    def test_stack_calibration(self):
+        self.assertEqual(stack_calibration(self.log),
+                         (DEFAULT_CALIBRATION[2], DEFAULT_CALIBRATION[4]))
+        # After Fiji tracked the stack, only the .trackmate.xml file is left
+        xml_path = self.log[:-len(DETECTION_LOG_EXT)] + '.trackmate.xml'
+        with open(xml_path, 'w') as f:
+            f.write('<TrackMate>\n<Settings>\n<ImageData filename="Well1-Pos001.tif" '
+                    'pixelwidth="0.65" pixelheight="0.65" timeinterval="600.0" />\n'
+                    '</Settings>\n</TrackMate>\n')
+        self.assertEqual(stack_calibration(self.log), (0.65, 600.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Unit tests for the folder CSV files and the track filters of the trackmate XML files.
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import write_trackmate_xml
+from cell_track.tools.metrics import METRICS
+from cell_track.tools.linking import passes_filters
+from cell_track.tools.analytics import parse_trackmate_xml
+from cell_track.tools.linking import read_spots
+from cell_track.tools.stack_io import ImageCalibration
+from cell_track.tools.trackmate import (format_track_filters, parse_track_filters,
+                                        process_imagestack, process_xml_folder,
+                                        refilter_folder, refilter_xml, trackmateXML)
+
+
+class TestProcessXmlFolder(unittest.TestCase):
+    def test_incremental_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for well, pos in ((1, 1), (1, 2), (12, 1)):
+                write_trackmate_xml(os.path.join(tmpdir, 'Well%d-Pos%03d.tif.trackmate.xml'
+                                                 % (well, pos)),
+                                    n_tracks=6, n_frames=10, seed=well * 10 + pos)
+            process_xml_folder(tmpdir, workers=2)
+            speed = pd.read_csv(os.path.join(tmpdir, 'All_wells_speed.csv'))
+            self.assertEqual(list(speed.columns), ['1', '12'])
+            expected = (process_imagestack(os.path.join(tmpdir, 'Well1-Pos001.tif.trackmate.xml'))[0] +
+                        process_imagestack(os.path.join(tmpdir, 'Well1-Pos002.tif.trackmate.xml'))[0])
+            np.testing.assert_allclose(speed['1'].dropna(), expected)
+
+            # A new position only parses the new file, without a pool
+            write_trackmate_xml(os.path.join(tmpdir, 'Well12-Pos002.tif.trackmate.xml'),
+                                n_tracks=6, n_frames=10, seed=5)
+            parsed = METRICS.counters.get('csv.files', 0)
+            with mock.patch('multiprocessing.get_context') as get_context:
+                process_xml_folder(tmpdir, workers=8)
+            get_context.assert_not_called()
+            self.assertEqual(METRICS.counters['csv.files'] - parsed, 1)
+            speed = pd.read_csv(os.path.join(tmpdir, 'All_wells_speed.csv'))
+            self.assertEqual(speed['12'].count(), 6)
+
+            # Nothing changed, nothing is parsed
+            process_xml_folder(tmpdir)
+            self.assertEqual(METRICS.counters['csv.files'] - parsed, 1)
+
+
+
+class TestRefilter(unittest.TestCase):
+    def test_parse_track_filters(self):
+        filters = parse_track_filters('NUMBER_SPOTS>31, NUMBER_SPLITS<0.5')
+        self.assertEqual(filters, (('NUMBER_SPOTS', 31.0, True), ('NUMBER_SPLITS', 0.5, False)))
+        self.assertEqual(format_track_filters(filters), 'NUMBER_SPOTS>31,NUMBER_SPLITS<0.5')
+        with self.assertRaises(ValueError):
+            parse_track_filters('NUMBER_SPOTS=31')
+
+    def test_refilter_matches_linking(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            folder = os.path.join(tmpdir, 'Group1')
+            os.makedirs(folder)
+            path = os.path.join(folder, 'Well1-Pos001.tif.trackmate.xml')
+            write_trackmate_xml(path, n_tracks=8, n_frames=10, seed=1)
+            tree = ET.parse(path)
+            tracks = tree.getroot().findall('Model/AllTracks/Track')
+            filters = (('CONFINMENT_RATIO', 0.3, True), ('NUMBER_SPOTS', 5, True))
+            expected = [track.get('TRACK_ID') for track in tracks
+                        if passes_filters({key: float(value) for key, value in track.attrib.items()
+                                           if key != 'name'}, filters)]
+
+            results = refilter_folder(tmpdir, filters, workers=1)
+            self.assertEqual(results, [(path, len(expected), 8)])
+            root = ET.parse(path).getroot()
+            self.assertEqual([track.get('TRACK_ID')
+                              for track in root.findall('Model/FilteredTracks/TrackID')], expected)
+            self.assertEqual(len(process_imagestack(path)[0]), len(expected))
+
+            # The same filters leave the file as it is
+            mtime = os.stat(path).st_mtime_ns
+            refilter_xml(path, filters)
+            self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+            self.assertEqual(refilter_xml(path, (('NUMBER_SPOTS', 11, True),)), (0, 8))
+            self.assertEqual(ET.parse(path).getroot().findall('Model/FilteredTracks/TrackID'), [])
+
+
+class TestTrackmateXML(unittest.TestCase):
+    def test_calibration(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tm_xml = trackmateXML(calibration=ImageCalibration(512, 256, 0.65, 0.65, 90.0))
+            tm_xml.imagepath = tmpdir
+            tm_xml.filename = 'Well1-Pos001.tif'
+            for frame in range(3):
+                tm_xml.frame = tm_xml.nframes = frame
+                tm_xml.add_frame_spots([(0, 0, 10, 10)], [0.9])
+            tm_xml.write_xml()
+            path = os.path.join(tmpdir, 'Well1-Pos001.tif.xml')
+            root = ET.parse(path).getroot()
+            image_data = parse_trackmate_xml(path)['image_data']
+        self.assertEqual(float(image_data['pixelwidth']), 0.65)
+        self.assertEqual(float(image_data['timeinterval']), 90.0)
+        self.assertEqual(image_data['width'], '512')
+        self.assertEqual(root.find('Settings/BasicSettings').get('xend'), '511')
+        self.assertEqual(root.find('Settings/BasicSettings').get('yend'), '255')
+        self.assertEqual([spots[0][3] for frame, spots in sorted(read_spots(root).items())],
+                         [0.0, 90.0, 180.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Unit tests for the tuning profiles and batched detection.
+"""
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmarks.timelapse import StubModel, make_timelapse
+from cell_track.tools.checkpoint import DetectionLog
+from cell_track.tools.stack_io import open_frame_source
+from cell_track.tools.track_image import detect_frames, predict_frame
+from cell_track.tools.tuning import default_grid, load_tuning, save_tuning
+
+
+class TestTuning(unittest.TestCase):
+    def test_profiles_per_host(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'tuning.json')
+            self.assertEqual(load_tuning(path), {})
+            with open(path, 'w') as f:
+                json.dump({'other-host': {'batch_size': 8}}, f)
+            save_tuning({'batch_size': 2, 'workers': 4}, path)
+            self.assertEqual(load_tuning(path), {'batch_size': 2, 'workers': 4})
+            with open(path) as f:
+                profiles = json.load(f)
+            self.assertEqual(profiles['other-host'], {'batch_size': 8})
+            self.assertIn(socket.gethostname(), profiles)
+
+    def test_default_grid(self):
+        grid = default_grid(cpus=16)
+        self.assertEqual(grid['intra_op_threads'], [4, 8, 16])
+        self.assertEqual(default_grid(cpus=1)['workers'], [1])
+
+    def test_batched_detection_matches_single_frames(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            truth = make_timelapse(tmpdir, n_series=1, n_frames=7, n_cells=10)
+            source = open_frame_source(next(iter(truth)))
+            frames = [np.asarray(source[t]) for t in range(len(source))]
+            single = [predict_frame(StubModel(seed=t), frame)
+                      for t, frame in enumerate(frames)]
+
+            # Frames 0 and 4 were detected before an interruption
+            done_frames = {0: single[0], 4: single[4]}
+            log = DetectionLog(os.path.join(tmpdir, 'stack.detections.jsonl'))
+            model = StubModel()
+            model.predict_on_batch = _per_frame_seeds(model.predict_on_batch)
+            results = list(detect_frames(model, enumerate(frames), done_frames, log,
+                                         batch_size=3))
+            log.close()
+            logged = log.read()
+
+        self.assertEqual([i for i, boxes, scores in results], list(range(7)))
+        self.assertEqual(sorted(logged), [1, 2, 3, 5, 6])
+        for i, boxes, scores in results:
+            np.testing.assert_allclose(boxes, single[i][0], rtol=1e-6)
+            np.testing.assert_allclose(scores, single[i][1], rtol=1e-6)
+
+
+def _per_frame_seeds(predict_on_batch):
+    # The stub model jitters its boxes randomly, reseed it per frame so a
+    # batch gives the same boxes as predicting its frames one by one.
+    frame_seeds = iter([1, 2, 3, 5, 6])
+
+    def predict(batch):
+        outputs = [StubModel(seed=next(frame_seeds)).predict_on_batch(batch[i:i + 1])
+                   for i in range(len(batch))]
+        return tuple(np.concatenate(parts) for parts in zip(*outputs))
+    return predict
+
+
+if __name__ == "__main__":
+    unittest.main()
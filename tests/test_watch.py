@@ -0,0 +1,57 @@
+"""
+Unit tests for watching a folder for finished LIF files.
+"""
+import os
+import tempfile
+import unittest
+
+from cell_track.tools.watch import LifWatcher
+
+
+def write_lif(path, size, mtime):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    os.utime(path, (mtime, mtime))
+
+
+class TestLifWatcher(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'plate1.lif')
+        self.watcher = LifWatcher(self.folder, settle_time=60)
+
+    def test_growing_file_is_not_reported(self):
+        for step in range(10):
+            write_lif(self.path, 100 * (step + 1), 1000 + 30 * step)
+            self.assertEqual(self.watcher.poll(now=1000 + 30 * step), [])
+
+    def test_settled_file_is_reported_once(self):
+        write_lif(self.path, 100, 1000)
+        write_lif(os.path.join(self.folder, 'notes.txt'), 100, 1000)
+        self.assertEqual(self.watcher.poll(now=1000), [])
+        self.assertEqual(self.watcher.poll(now=1030), [])
+        self.assertEqual(self.watcher.poll(now=1060), [self.path])
+        self.assertEqual(self.watcher.poll(now=1120), [])
+        self.assertEqual(self.watcher.poll(now=5000), [])
+
+    def test_rewritten_file_is_reported_again(self):
+        write_lif(self.path, 100, 1000)
+        self.watcher.poll(now=1000)
+        self.assertEqual(self.watcher.poll(now=1060), [self.path])
+        write_lif(self.path, 200, 2000)
+        self.assertEqual(self.watcher.poll(now=2000), [])
+        self.assertEqual(self.watcher.poll(now=2060), [self.path])
+
+    def test_removed_candidate_is_forgotten(self):
+        write_lif(self.path, 100, 1000)
+        self.assertEqual(self.watcher.poll(now=1000), [])
+        os.remove(self.path)
+        self.assertEqual(self.watcher.poll(now=1030), [])
+        # Written again just like before, it has to settle from scratch
+        write_lif(self.path, 100, 1000)
+        self.assertEqual(self.watcher.poll(now=1070), [])
+        self.assertEqual(self.watcher.poll(now=1130), [self.path])
+
+
+if __name__ == "__main__":
+    unittest.main()
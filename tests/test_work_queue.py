@@ -0,0 +1,78 @@
+"""
+Unit tests for the shared-filesystem work queue.
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from cell_track.tools import work_queue
+from cell_track.tools.work_queue import WorkQueue, run_worker
+
+
+class TestWorkQueue(unittest.TestCase):
+    def test_claims_are_exclusive_and_stale_claims_reclaimed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            node1 = WorkQueue(tmpdir, worker_id='node1', lease_time=60)
+            node2 = WorkQueue(tmpdir, worker_id='node2', lease_time=60)
+            self.assertTrue(node1.add('plate1.lif', 'Infected/Well1-Pos001'))
+            self.assertTrue(node1.add('plate1.lif', 'Infected/Well1-Pos002'))
+            self.assertFalse(node2.add('plate1.lif', 'Infected/Well1-Pos001'))
+
+            claim1 = node1.claim()
+            claim2 = node2.claim()
+            self.assertNotEqual(claim1.unit['series'], claim2.unit['series'])
+            self.assertIsNone(node2.claim())
+
+            # Both stop sending heartbeats, the claims are given back after the lease expires
+            self.assertEqual(node2.reclaim_stale(), [])
+            self.assertEqual(sorted(node2.reclaim_stale(now=time.time() + 120)),
+                             sorted([claim1.name, claim2.name]))
+            self.assertFalse(claim1.heartbeat())
+            claim1.complete()  # no effect, the claim was lost
+            self.assertEqual(node1.counts()['pending'], 2)
+
+            self.assertEqual(run_worker(node2, lambda unit: None), 2)
+            self.assertEqual(node2.counts(), {'pending': 0, 'claimed': 0,
+                                              'done': 2, 'failed': 0})
+
+    def test_unit_moving_between_subfolders_is_not_added_again(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = WorkQueue(tmpdir)
+            self.assertTrue(queue.add('plate1.lif', 'Well1-Pos001'))
+            claim = queue.claim()
+            # Released, on its way through tmp/ back to pending/
+            os.rename(claim.path, os.path.join(tmpdir, 'tmp', os.path.basename(claim.path)))
+            self.assertFalse(queue.add('plate1.lif', 'Well1-Pos001'))
+            self.assertEqual(queue.counts()['pending'], 0)
+
+    def test_failed_units_are_retried(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = WorkQueue(tmpdir, max_attempts=2)
+            queue.add('plate1.lif', 'Well1-Pos001')
+
+            def fail(unit):
+                raise ValueError('broken series')
+            self.assertEqual(run_worker(queue, fail, poll_interval=0), 0)
+            self.assertEqual(queue.counts()['failed'], 1)
+
+    def test_claim_reclaimed_before_the_lease_is_renewed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            node1 = WorkQueue(tmpdir, worker_id='node1', lease_time=60)
+            node2 = WorkQueue(tmpdir, worker_id='node2', lease_time=60)
+            node1.add('plate1.lif', 'Well1-Pos001')
+            utime = os.utime
+
+            def reclaim_first(path, *args, **kwargs):
+                # node2 sees the old mtime of the renamed file as an expired lease
+                node2.reclaim_stale(now=time.time() + 120)
+                return utime(path, *args, **kwargs)
+            with mock.patch.object(work_queue.os, 'utime', side_effect=reclaim_first):
+                self.assertIsNone(node1.claim())
+            self.assertEqual(node1.counts()['pending'], 1)
+            self.assertIsNotNone(node2.claim())
+
+
+if __name__ == "__main__":
+    unittest.main()